@@ -1,17 +1,43 @@
-from typing import TYPE_CHECKING, Tuple, Union
+from threading import Event
+from time import time
+from typing import TYPE_CHECKING, Tuple, List, Dict, Callable, Sequence, Union
 
 from game.analyzer import Analyzer
+from game.internal_types import SearchTimeout
+from game.batch import ILLEGAL
+from game.board import ZOBRIST_STONES, ZOBRIST_MAXIMIZING_PLAYER, index
 from game.rules import GameRules
+from game.transposition import TranspositionTable, EXACT, LOWER_BOUND, UPPER_BOUND
 
 if TYPE_CHECKING:
     from game.node import Node
+    from game.position import Position
     from game.heuristics import Heuristic
+    from game.ordering import MoveOrdering
+    from game.batch import BatchLeafEvaluator
 
 
 class Minimax:
-    def __init__(self, heuristic: 'Heuristic'):
+    ASPIRATION_WINDOW = 100000  # half width of the first window around the previous iteration's value
+    ASPIRATION_GROWTH = 4
+
+    def __init__(
+            self,
+            heuristic: 'Heuristic',
+            game_rules: GameRules = None,
+            transposition_table: TranspositionTable = None,
+            move_ordering: 'MoveOrdering' = None,
+            batch_evaluator: 'BatchLeafEvaluator' = None,
+    ):
         self.heuristic = heuristic
-        self.game_rules = GameRules()
+        self.game_rules = game_rules or GameRules()
+        self.transposition_table = transposition_table
+        self.move_ordering = move_ordering
+        self.batch_evaluator = batch_evaluator
+        self.deadline: Union[float, None] = None
+        self.cancelled = Event()  # the running search's token, see `iterative_deepening`
+        self.principal_variation: List[Tuple[int, int]] = []
+        self.node_count = 0  # nodes of the last iterative_deepening
 
     def calculate_minimax(
             self,
@@ -19,6 +45,7 @@ class Minimax:
             depth: int,
             alpha: float = None,
             beta: float = None,
+            ply: int = 0,
     ) -> Tuple[float, Union['Node', None]]:
         alpha = alpha if alpha is not None else self.heuristic.alpha_min
         beta = beta if beta is not None else self.heuristic.beta_max
@@ -28,26 +55,366 @@ class Minimax:
         if depth == 0 or self.game_rules.is_terminated(node):
             value = self.heuristic.calculate(node)
             return value, node
+        ordering = self.move_ordering
         if node.maximizing_player:
-            for child in node.children():
+            for child in node.children(ordering, ply):
                 Analyzer.update(Analyzer.NODE_COUNT, 1)
-                new_alpha = self.calculate_minimax(child, depth - 1, alpha, beta)[0]
+                new_alpha = self.calculate_minimax(child, depth - 1, alpha, beta, ply + 1)[0]
                 if new_alpha > alpha:
                     alpha = new_alpha
                     alpha_node = child
                 if beta <= alpha:
+                    if ordering:
+                        ordering.cutoff(child.new_move, node.stone, ply, depth)
                     break
             node.chosen = (alpha_node.new_move if alpha_node else None, alpha)
+            node.best_child = alpha_node
             return alpha, alpha_node
         else:
-            for child in node.children():
+            for child in node.children(ordering, ply):
                 Analyzer.update(Analyzer.NODE_COUNT, 1)
-                new_beta = self.calculate_minimax(child, depth - 1, alpha, beta)[0]
+                new_beta = self.calculate_minimax(child, depth - 1, alpha, beta, ply + 1)[0]
                 if new_beta < beta:
                     beta = new_beta
                     beta_node = child
                 if beta <= alpha:
+                    if ordering:
+                        ordering.cutoff(child.new_move, node.stone, ply, depth)
                     break
 
             node.chosen = (beta_node.new_move if beta_node else None, beta)
+            node.best_child = beta_node
             return beta, beta_node
+
+    def calculate_minimax_in_place(
+            self,
+            position: 'Position',
+            depth: int,
+            alpha: float = None,
+            beta: float = None,
+    ) -> Tuple[float, Union[Tuple[int, int], None]]:
+        """ Same search as calculate_minimax, but on one position changed with play/undo """
+        if self.cancelled.is_set() or self.deadline is not None and time() > self.deadline:
+            raise SearchTimeout()
+
+        alpha = alpha if alpha is not None else self.heuristic.alpha_min
+        beta = beta if beta is not None else self.heuristic.beta_max
+        alpha_move = None
+        beta_move = None
+
+        table = self.transposition_table
+        key = position.key
+        hash_move = None
+        if table is not None:
+            entry = table.get(key)
+            if entry is not None:
+                hash_move = entry.move
+                if entry.depth >= depth:
+                    Analyzer.update(Analyzer.TRANSPOSITION_HITS, 1)
+                    if entry.flag == EXACT:
+                        return entry.value, entry.move
+                    if entry.flag == LOWER_BOUND and entry.value >= beta:
+                        return entry.value, entry.move
+                    if entry.flag == UPPER_BOUND and entry.value <= alpha:
+                        return entry.value, entry.move
+
+        if depth == 0 or self.game_rules.is_terminated(position):
+            value = self.heuristic.calculate(position)
+            if table is not None:
+                table.store(key, depth, EXACT, value, None)
+            return value, None
+
+        alpha_start, beta_start = alpha, beta
+        ordering = self.move_ordering
+        stone, ply = position.stone, position.ply
+        if ordering:
+            moves = ordering.moves(position.board, stone, position.candidates, ply, hash_move)
+        else:
+            moves = self._moves(position, hash_move)
+
+        leaf_values = None
+        if depth == 1 and self.batch_evaluator is not None:
+            moves = list(moves)
+            leaf_values = self.batch_evaluator.evaluate(position, moves)
+
+        if position.maximizing_player:
+            for move in moves:
+                new_alpha = self._search_child(position, move, depth, alpha, beta, leaf_values)
+                if new_alpha is None:
+                    continue
+                if new_alpha > alpha:
+                    alpha = new_alpha
+                    alpha_move = move
+                if beta <= alpha:
+                    if ordering:
+                        ordering.cutoff(move, stone, ply, depth)
+                    break
+            value, chosen_move = alpha, alpha_move
+        else:
+            for move in moves:
+                new_beta = self._search_child(position, move, depth, alpha, beta, leaf_values)
+                if new_beta is None:
+                    continue
+                if new_beta < beta:
+                    beta = new_beta
+                    beta_move = move
+                if beta <= alpha:
+                    if ordering:
+                        ordering.cutoff(move, stone, ply, depth)
+                    break
+            value, chosen_move = beta, beta_move
+
+        if table is not None:
+            table.store(key, depth, table.flag_for(value, alpha_start, beta_start), value, chosen_move or hash_move)
+        return value, chosen_move
+
+    def _batch_leaf_value(
+            self,
+            position: 'Position',
+            move: Tuple[int, int],
+            leaf_values: Dict[Tuple[int, int], Union[int, str, None]],
+    ) -> Union[int, str, None]:
+        """
+        Value of the leaf after `move` from the batch, ILLEGAL, or None when the child has to be played:
+        it has captures or the transposition table has it, maybe from a deeper search. A batch value is
+        stored like the one of a played leaf, so the table ends up the same as without the batch.
+        """
+        leaf_value = leaf_values.get(move)
+        table = self.transposition_table
+        if leaf_value is None or leaf_value == ILLEGAL or table is None:
+            return leaf_value
+
+        # a move without captures changes only its square and the side to move
+        child_key = position.key ^ ZOBRIST_STONES[position.stone][index(*move)] ^ ZOBRIST_MAXIMIZING_PLAYER
+        if table.get(child_key) is not None:
+            return None
+        table.store(child_key, 0, EXACT, leaf_value, None)
+        return leaf_value
+
+    def _search_child(
+            self,
+            position: 'Position',
+            move: Tuple[int, int],
+            depth: int,
+            alpha: float,
+            beta: float,
+            leaf_values: Union[Dict[Tuple[int, int], Union[int, str, None]], None],
+    ) -> Union[float, None]:
+        """ Value of the child after `move`, None if the move is illegal """
+        if leaf_values is not None:
+            leaf_value = self._batch_leaf_value(position, move, leaf_values)
+            if leaf_value == ILLEGAL:
+                return None
+            if leaf_value is not None:
+                Analyzer.update(Analyzer.NODE_COUNT, 1)
+                return leaf_value
+
+        if not position.play(move):
+            return None
+        Analyzer.update(Analyzer.NODE_COUNT, 1)
+        value = self.calculate_minimax_in_place(position, depth - 1, alpha, beta)[0]
+        position.undo()
+        return value
+
+    def principal_variation_search(
+            self,
+            position: 'Position',
+            depth: int,
+            alpha: float = None,
+            beta: float = None,
+            pv_hint: Sequence[Tuple[int, int]] = (),
+    ) -> Tuple[float, List[Tuple[int, int]]]:
+        """
+        Negamax with principal variation search on the position changed with play/undo.
+        Same value as calculate_minimax_in_place (from player_1's point of view) and the moves of
+        the principal variation instead of only the first one.
+        :param pv_hint: principal variation of the previous iteration, tried first along its path
+        """
+        alpha = alpha if alpha is not None else self.heuristic.alpha_min
+        beta = beta if beta is not None else self.heuristic.beta_max
+        if position.maximizing_player:
+            score, principal_variation = self._negamax(position, depth, alpha, beta, pv_hint)
+            return score, principal_variation
+        score, principal_variation = self._negamax(position, depth, -beta, -alpha, pv_hint)
+        return -score, principal_variation
+
+    def _negamax(
+            self,
+            position: 'Position',
+            depth: int,
+            alpha: float,
+            beta: float,
+            pv_hint: Sequence[Tuple[int, int]],
+    ) -> Tuple[float, List[Tuple[int, int]]]:
+        """
+        Value for the player to move: the first move is searched with the full window, the rest
+        with a null window and searched again only if they turn out to be better.
+        The transposition table keeps values from player_1's point of view like the other searches.
+        """
+        if self.cancelled.is_set() or self.deadline is not None and time() > self.deadline:
+            raise SearchTimeout()
+
+        sign = 1 if position.maximizing_player else -1
+        table_alpha, table_beta = (alpha, beta) if sign == 1 else (-beta, -alpha)
+        table = self.transposition_table
+        key = position.key
+        hash_move = pv_hint[0] if pv_hint else None
+        if table is not None:
+            entry = table.get(key)
+            if entry is not None:
+                hash_move = hash_move or entry.move
+                if entry.depth >= depth:
+                    Analyzer.update(Analyzer.TRANSPOSITION_HITS, 1)
+                    if entry.flag == EXACT:
+                        return sign * entry.value, [entry.move] if entry.move is not None else []
+                    if entry.flag == LOWER_BOUND and entry.value >= table_beta \
+                            or entry.flag == UPPER_BOUND and entry.value <= table_alpha:
+                        return sign * entry.value, []
+
+        if depth == 0 or self.game_rules.is_terminated(position):
+            value = self.heuristic.calculate(position)
+            if table is not None:
+                table.store(key, depth, EXACT, value, None)
+            return sign * value, []
+
+        ordering = self.move_ordering
+        stone, ply = position.stone, position.ply
+        if ordering:
+            moves = ordering.moves(position.board, stone, position.candidates, ply, hash_move)
+        else:
+            moves = self._moves(position, hash_move)
+
+        leaf_values = None
+        if depth == 1 and self.batch_evaluator is not None:
+            moves = list(moves)
+            leaf_values = self.batch_evaluator.evaluate(position, moves)
+
+        principal_variation: List[Tuple[int, int]] = []
+        searched_any = False
+        for move in moves:
+            leaf_value = self._batch_leaf_value(position, move, leaf_values) if leaf_values is not None else None
+            if leaf_value == ILLEGAL:
+                continue
+            if leaf_value is not None:
+                Analyzer.update(Analyzer.NODE_COUNT, 1)
+                self.node_count += 1
+                score, child_variation = sign * leaf_value, []
+            else:
+                if not position.play(move):
+                    continue
+                Analyzer.update(Analyzer.NODE_COUNT, 1)
+                self.node_count += 1
+                child_hint = pv_hint[1:] if pv_hint and move == pv_hint[0] else ()
+                if not searched_any:
+                    score, child_variation = self._negamax(position, depth - 1, -beta, -alpha, child_hint)
+                    score = -score
+                else:
+                    score, child_variation = self._negamax(position, depth - 1, -alpha - 1, -alpha, child_hint)
+                    score = -score
+                    if alpha < score < beta:
+                        score, child_variation = self._negamax(position, depth - 1, -beta, -alpha, child_hint)
+                        score = -score
+                position.undo()
+            searched_any = True
+
+            if score > alpha:
+                alpha = score
+                principal_variation = [move] + child_variation
+            if alpha >= beta:
+                if ordering:
+                    ordering.cutoff(move, stone, ply, depth)
+                break
+
+        if table is not None:
+            value = sign * alpha
+            flag = table.flag_for(value, table_alpha, table_beta)
+            best_move = principal_variation[0] if principal_variation else hash_move
+            table.store(key, depth, flag, value, best_move)
+        return alpha, principal_variation
+
+    def iterative_deepening(
+            self,
+            position: 'Position',
+            time_limit: float,
+            max_depth: int,
+            principal_variation: Sequence[Tuple[int, int]] = (),
+            on_iteration: Callable[[float, int, List[Tuple[int, int]]], None] = None,
+            cancelled: Event = None,
+    ) -> Tuple[float, Union[Tuple[int, int], None], int]:
+        """
+        Searches with depth 1, 2, ... until `time_limit` seconds are over and returns
+        value, move and depth of the last completed iteration. Depth 1 is always completed.
+        From depth 2 every iteration starts with an aspiration window around the previous value
+        and follows the previous principal variation first. The principal variation of the last
+        completed iteration is left in `principal_variation`.
+        :param principal_variation: expected line from an earlier search, followed first by depth 1
+        :param on_iteration: called with value, depth and principal variation of every completed iteration
+        :param cancelled: set from another thread to stop this search like at the deadline. Only this search
+            sees it, so a search which starts later on the same engine isn't stopped by it.
+        """
+        deadline = time() + time_limit
+        self.cancelled = cancelled if cancelled is not None else Event()
+        start_ply = position.ply
+        if self.transposition_table is not None:
+            self.transposition_table.new_search()
+        if self.move_ordering:
+            self.move_ordering.new_search()
+        value, completed_depth = self.heuristic.alpha_min, 0
+        self.principal_variation = list(principal_variation)
+        self.node_count = 0
+
+        try:
+            for depth in range(1, max_depth + 1):
+                self.deadline = deadline if depth > 1 else None
+                try:
+                    value, principal_variation = self._aspiration_search(position, depth, value, completed_depth > 0)
+                except SearchTimeout:
+                    position.rewind(start_ply)
+                    break
+                finally:
+                    self.deadline = None
+                completed_depth = depth
+                self.principal_variation = principal_variation
+                if on_iteration is not None:
+                    on_iteration(value, depth, principal_variation)
+                if not principal_variation or time() > deadline:
+                    break
+        finally:
+            self.cancelled = Event()
+
+        chosen_move = self.principal_variation[0] if self.principal_variation else None
+        return value, chosen_move, completed_depth
+
+    def _aspiration_search(
+            self,
+            position: 'Position',
+            depth: int,
+            guess: float,
+            use_guess: bool,
+    ) -> Tuple[float, List[Tuple[int, int]]]:
+        """ Widens the window on the failed side until the value falls inside it """
+        alpha_min, beta_max = self.heuristic.alpha_min, self.heuristic.beta_max
+        if not use_guess:
+            return self.principal_variation_search(position, depth, pv_hint=self.principal_variation)
+
+        lower_width = upper_width = self.ASPIRATION_WINDOW
+        while True:
+            alpha = max(guess - lower_width, alpha_min)
+            beta = min(guess + upper_width, beta_max)
+            value, principal_variation = self.principal_variation_search(
+                position, depth, alpha, beta, self.principal_variation,
+            )
+            if alpha < value < beta or value <= alpha_min or value >= beta_max:
+                return value, principal_variation
+            if value <= alpha:
+                lower_width *= self.ASPIRATION_GROWTH
+            else:
+                upper_width *= self.ASPIRATION_GROWTH
+
+    @staticmethod
+    def _moves(position: 'Position', hash_move: Union[Tuple[int, int], None]):
+        if hash_move is not None and position.candidates >> index(*hash_move) & 1:
+            yield hash_move
+        for move in position.moves():
+            if move != hash_move:
+                yield move
@@ -7,12 +7,16 @@ class Analyzer:
     HEURISTIC_CALCULATE = 'time_heuristic_calculate'
     ALL_TIME = 'all_time'
     NODE_COUNT = 'node_count'
+    TRANSPOSITION_HITS = 'transposition_hits'
+    THREAT_SEARCH = 'time_threat_search'
 
     values = {
         HEURISTIC_FIND_LINES: 0.0,
         HEURISTIC_CALCULATE: 0.0,
         ALL_TIME: 0.0,
-        NODE_COUNT: 0
+        NODE_COUNT: 0,
+        TRANSPOSITION_HITS: 0,
+        THREAT_SEARCH: 0.0,
     }
 
     @classmethod
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class GameConfig(AppConfig):
     name = 'game'
+
+    def ready(self):
+        import game.signals  # noqa: F401 connects the receivers
@@ -0,0 +1,124 @@
+from typing import Tuple, List, Dict, Union, TYPE_CHECKING
+
+import numpy as np
+from singleton_decorator import singleton
+
+from game.analyzer import Analyzer
+from game.board import SIZE, CELLS, LINE_SQUARES, line_keys
+from game.heuristics import HeuristicSimpleTreat
+from game.patterns import WINDOW_SIZE, TABLE_SIZE
+from game.rules import GameRules
+
+if TYPE_CHECKING:
+    from game.position import Position
+
+
+ILLEGAL = 'illegal'  # the move makes a double three
+
+_OFF_LINE = 3
+_REACH = WINDOW_SIZE - 1  # farthest square of a window which covers the candidate
+_STRIP_LENGTH = 2 * _REACH + 1
+_CELL_CODES = np.full(256, _OFF_LINE, dtype=np.int64)
+_CELL_CODES[ord('-')], _CELL_CODES[ord('x')], _CELL_CODES[ord('o')] = 0, 1, 2
+_STONE_CODES = {'x': 1, 'o': 2}
+
+
+def _build_strips() -> np.ndarray:
+    """
+    For every square and each of its 4 lines: indices of the squares up to 6 steps back and forth
+    along the line, CELLS (an off-line cell) where the line ends.
+    """
+    strips = np.full((CELLS, 4, _STRIP_LENGTH), CELLS, dtype=np.int64)
+    for square in range(CELLS):
+        for direction, key in enumerate(line_keys(square % SIZE, square // SIZE)):
+            squares = LINE_SQUARES[key]
+            position = squares.index(square)
+            for step in range(-_REACH, _REACH + 1):
+                if 0 <= position + step < len(squares):
+                    strips[square, direction, _REACH + step] = squares[position + step]
+    return strips
+
+
+_STRIPS = _build_strips()
+
+
+@singleton
+class BatchLeafEvaluator:
+    """
+    Heuristic values of all children of a position in one vectorized pass. Only the windows
+    which cover the new stone change, so for every candidate the 4 strips of 13 squares around it
+    are stacked, the stone is put in and the 7 windows of each strip are scored before and after
+    through the HeuristicSimpleTreat table at once.
+    Children with captures are not scored (None), the search has to play them.
+    """
+    def __init__(self):
+        heuristic = HeuristicSimpleTreat()
+        rules = GameRules()
+        self._window_scores = np.zeros((TABLE_SIZE, 4), dtype=np.int64)
+        for code, score in enumerate(heuristic.window_scores):
+            if score is not None:
+                self._window_scores[code] = score
+        self._open_three_windows = {
+            'x': np.array(rules.x_open_three_windows, dtype=np.int64),
+            'o': np.array(rules.o_open_three_windows, dtype=np.int64),
+        }
+
+    @Analyzer.update_time(Analyzer.HEURISTIC_CALCULATE)
+    def evaluate(
+            self,
+            position: 'Position',
+            moves: List[Tuple[int, int]],
+    ) -> Dict[Tuple[int, int], Union[int, str, None]]:
+        """ Child value, ILLEGAL or None (has captures) for every move of the side to move """
+        if not moves:
+            return {}
+        stone = position.stone
+        stone_code = _STONE_CODES[stone]
+        victim_code = 3 - stone_code
+
+        cells = np.empty(CELLS + 1, dtype=np.int64)
+        cells[:CELLS] = _CELL_CODES[np.frombuffer(bytes(position.board.cells), dtype=np.uint8)]
+        cells[CELLS] = _OFF_LINE
+
+        old_strips = cells[_STRIPS[[y * SIZE + x for x, y in moves]]]
+        new_strips = old_strips.copy()
+        new_strips[:, :, _REACH] = stone_code
+        old_windows = self._window_codes(old_strips)
+        new_windows = self._window_codes(new_strips)
+
+        open_three_windows = self._open_three_windows[stone]
+        new_open_threes = open_three_windows[new_windows].sum(axis=(1, 2)) \
+            - open_three_windows[old_windows].sum(axis=(1, 2))
+        illegal = new_open_threes > 1
+
+        captures = np.zeros(len(moves), dtype=bool)
+        for step in (1, -1):
+            captures |= (
+                (new_strips[:, :, _REACH + step] == victim_code)
+                & (new_strips[:, :, _REACH + 2 * step] == victim_code)
+                & (new_strips[:, :, _REACH + 3 * step] == stone_code)
+            ).any(axis=1)
+
+        delta = (self._window_scores[new_windows] - self._window_scores[old_windows]).sum(axis=(1, 2))
+        line_scores = position.line_scores
+        if position.maximizing_player:  # the child is the opponent's turn
+            values = (line_scores.x_opponent_turn - line_scores.o_my_turn + position.capture_value) \
+                + delta[:, 1] - delta[:, 2]
+        else:
+            values = (line_scores.x_my_turn - line_scores.o_opponent_turn + position.capture_value) \
+                + delta[:, 0] - delta[:, 3]
+
+        return {
+            move: ILLEGAL if is_illegal else (None if has_captures else value)
+            for move, value, is_illegal, has_captures in zip(
+                moves, values.tolist(), illegal.tolist(), captures.tolist()
+            )
+        }
+
+    @staticmethod
+    def _window_codes(strips: np.ndarray) -> np.ndarray:
+        """ Same codes as game.patterns.window_codes for the 7 windows which cover the strip middle """
+        codes = strips[..., 0:WINDOW_SIZE].copy()
+        for position in range(1, WINDOW_SIZE):
+            codes |= strips[..., position:position + WINDOW_SIZE] << (2 * position)
+        return codes
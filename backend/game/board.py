@@ -0,0 +1,339 @@
+import struct
+from random import Random
+from typing import Dict, List, Tuple, Iterator, Iterable, NamedTuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from game.models import Game
+
+
+SIZE = 19
+CELLS = SIZE * SIZE
+
+EMPTY = '-'
+X_STONE = 'x'
+O_STONE = 'o'
+
+_EMPTY_CODE = ord(EMPTY)
+_STONE_CODES = {X_STONE: ord(X_STONE), O_STONE: ord(O_STONE)}
+
+FULL_MASK = (1 << CELLS) - 1
+_NOT_FIRST_COLUMN = FULL_MASK ^ sum(1 << (y * SIZE) for y in range(SIZE))
+_NOT_LAST_COLUMN = FULL_MASK ^ sum(1 << (y * SIZE + SIZE - 1) for y in range(SIZE))
+
+_COLUMNS_SHIFT_MASKS = {
+    dx: FULL_MASK ^ sum(
+        1 << (y * SIZE + x)
+        for y in range(SIZE)
+        for x in (range(dx) if dx > 0 else range(SIZE + dx, SIZE))
+    )
+    for dx in range(-(SIZE - 1), SIZE)
+}
+DIRECTIONS = ((1, 0), (0, 1), (1, 1), (-1, 1))
+
+LineKey = Tuple[int, int]
+
+_zobrist_random = Random(SIZE)  # fixed seed: keys must be the same in every process and run
+ZOBRIST_STONES = {
+    X_STONE: tuple(_zobrist_random.getrandbits(64) for _ in range(CELLS)),
+    O_STONE: tuple(_zobrist_random.getrandbits(64) for _ in range(CELLS)),
+}
+ZOBRIST_CAPTURES_X = tuple(_zobrist_random.getrandbits(64) for _ in range(CELLS // 2 + 1))
+ZOBRIST_CAPTURES_O = tuple(_zobrist_random.getrandbits(64) for _ in range(CELLS // 2 + 1))
+ZOBRIST_MAXIMIZING_PLAYER = _zobrist_random.getrandbits(64)
+
+
+def index(x: int, y: int) -> int:
+    return y * SIZE + x
+
+
+def coordinates(square: int) -> Tuple[int, int]:
+    return square % SIZE, square // SIZE
+
+
+def line_keys(x: int, y: int) -> Tuple[LineKey, LineKey, LineKey, LineKey]:
+    """
+    Keys of the four lines which go through the square, in the same notation as node lines:
+
+    1 - horizontal
+    2 - vertical
+    3 - diagonal (from up-left to down-right)
+    4 - diagonal (from up-right to down-left)
+
+    """
+    return (1, y), (2, x), (3, x - y), (4, x + y)
+
+
+def _build_line_slices() -> Dict[LineKey, slice]:
+    slices = {}
+    for y in range(SIZE):
+        slices[(1, y)] = slice(y * SIZE, y * SIZE + SIZE, 1)
+    for x in range(SIZE):
+        slices[(2, x)] = slice(x, CELLS, SIZE)
+    for diff in range(-(SIZE - 1), SIZE):
+        x_start = max(0, diff)
+        length = SIZE - abs(diff)
+        start = index(x_start, x_start - diff)
+        slices[(3, diff)] = slice(start, start + (SIZE + 1) * (length - 1) + 1, SIZE + 1)
+    for total in range(2 * SIZE - 1):
+        x_start = max(0, total - (SIZE - 1))
+        length = min(SIZE - 1, total) - x_start + 1
+        start = index(x_start, total - x_start)
+        last = start - (SIZE - 1) * (length - 1)
+        slices[(4, total)] = slice(start, last - 1 if last > 0 else None, -(SIZE - 1))
+    return slices
+
+
+LINE_SLICES = _build_line_slices()
+LINE_SQUARES = {key: tuple(range(CELLS)[line_slice]) for key, line_slice in LINE_SLICES.items()}
+LINE_MASKS = {key: sum(1 << square for square in squares) for key, squares in LINE_SQUARES.items()}
+
+
+def _build_capture_rays() -> Tuple[Tuple[Tuple[int, int, int], ...], ...]:
+    """
+    For every square: the 3 squares next to it in each of 8 directions (horizontal, vertical,
+    diagonal 3, diagonal 4, both ways), only the directions which stay on the board
+    """
+    rays = []
+    for square in range(CELLS):
+        x, y = square % SIZE, square // SIZE
+        rays.append(tuple(
+            tuple(index(x + step * dx, y + step * dy) for step in (1, 2, 3))
+            for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (-1, -1), (1, -1), (-1, 1))
+            if 0 <= x + 3 * dx < SIZE and 0 <= y + 3 * dy < SIZE
+        ))
+    return tuple(rays)
+
+
+CAPTURE_RAYS = _build_capture_rays()
+
+
+class Board:
+    """
+    19x19 position stored twice: as two per-player bit sets (bit `y * 19 + x`) for set operations
+    and as a mailbox of '-', 'x', 'o' bytes, so a whole line is a single slice.
+    Player 1 always plays 'x', player 2 - 'o'.
+    `key` is the Zobrist hash of the stones, updated on every place/remove.
+    """
+    __slots__ = ('x_bits', 'o_bits', 'cells', 'key')
+
+    def __init__(self, x_bits: int = 0, o_bits: int = 0, cells: bytearray = None, key: int = 0):
+        self.x_bits = x_bits
+        self.o_bits = o_bits
+        self.cells = cells if cells is not None else bytearray(EMPTY * CELLS, 'ascii')
+        self.key = key
+
+    @classmethod
+    def from_tiles(cls, x_tiles: List[Tuple[int, int]], o_tiles: List[Tuple[int, int]]) -> 'Board':
+        board = cls()
+        for tile in x_tiles:
+            board.place(tile[0], tile[1], X_STONE)
+        for tile in o_tiles:
+            board.place(tile[0], tile[1], O_STONE)
+        return board
+
+    @classmethod
+    def from_bits(cls, x_bits: int, o_bits: int) -> 'Board':
+        board = cls()
+        for square in iterate_squares(x_bits):
+            board.place_square(square, X_STONE)
+        for square in iterate_squares(o_bits):
+            board.place_square(square, O_STONE)
+        return board
+
+    @classmethod
+    def from_game(cls, game: 'Game') -> 'Board':
+        """ The board packed on the game row, no tiles are read """
+        return PackedGame.unpack(game.board).board
+
+    def copy(self) -> 'Board':
+        return Board(self.x_bits, self.o_bits, self.cells[:], self.key)
+
+    @property
+    def occupied(self) -> int:
+        return self.x_bits | self.o_bits
+
+    def bits(self, stone: str) -> int:
+        return self.x_bits if stone == X_STONE else self.o_bits
+
+    def get(self, x: int, y: int) -> str:
+        if 0 <= x < SIZE and 0 <= y < SIZE:
+            return chr(self.cells[y * SIZE + x])
+        return ''
+
+    def is_empty(self, x: int, y: int) -> bool:
+        return self.cells[y * SIZE + x] == _EMPTY_CODE
+
+    def place(self, x: int, y: int, stone: str):
+        self.place_square(y * SIZE + x, stone)
+
+    def place_square(self, square: int, stone: str):
+        if stone == X_STONE:
+            self.x_bits |= 1 << square
+        else:
+            self.o_bits |= 1 << square
+        self.cells[square] = _STONE_CODES[stone]
+        self.key ^= ZOBRIST_STONES[stone][square]
+
+    def remove(self, x: int, y: int):
+        self.remove_square(y * SIZE + x)
+
+    def remove_square(self, square: int):
+        self.key ^= ZOBRIST_STONES[chr(self.cells[square])][square]
+        mask = ~(1 << square)
+        self.x_bits &= mask
+        self.o_bits &= mask
+        self.cells[square] = _EMPTY_CODE
+
+    def stones(self, stone: str) -> List[Tuple[int, int]]:
+        return list(iterate_coordinates(self.bits(stone)))
+
+    def line(self, key: LineKey) -> str:
+        return self.cells[LINE_SLICES[key]].decode()
+
+    def lines(self) -> Dict[LineKey, str]:
+        occupied = self.x_bits | self.o_bits
+        return {
+            key: self.cells[LINE_SLICES[key]].decode()
+            for key, mask in LINE_MASKS.items()
+            if occupied & mask
+        }
+
+    def update_lines(self, lines: Dict[LineKey, str], keys: Iterable[LineKey]):
+        """ Rebuilds only the given lines of `lines`, dropping the ones left without stones """
+        occupied = self.x_bits | self.o_bits
+        for key in keys:
+            if occupied & LINE_MASKS[key]:
+                lines[key] = self.cells[LINE_SLICES[key]].decode()
+            else:
+                lines.pop(key, None)
+
+    def find_captures(self, x: int, y: int, stone: str) -> List[Tuple[Tuple[int, int], Tuple[int, int]]]:
+        """
+        Pairs of stones captured by `stone` put on (x, y): the 'xoox' or 'oxxo' pattern in any
+        of 8 directions, checked in the order horizontal, vertical, diagonal 3, diagonal 4.
+        """
+        return [
+            ((first % SIZE, first // SIZE), (second % SIZE, second // SIZE))
+            for first, second in self.capture_pairs(y * SIZE + x, stone)
+        ]
+
+    def capture_pairs(self, square: int, stone: str) -> List[Tuple[int, int]]:
+        """ Same as find_captures, by square indices """
+        cells = self.cells
+        own = _STONE_CODES[stone]
+        victim = _STONE_CODES[O_STONE if stone == X_STONE else X_STONE]
+        return [
+            (first, second)
+            for first, second, third in CAPTURE_RAYS[square]
+            if cells[first] == victim and cells[second] == victim and cells[third] == own
+        ]
+
+    def capture_squares(self, stone: str) -> int:
+        """ Bits of empty squares where `stone` captures at least one pair """
+        own = self.bits(stone)
+        victims = self.o_bits if stone == X_STONE else self.x_bits
+        result = 0
+        for dx, dy in DIRECTIONS:
+            for sign in (1, -1):
+                step_x, step_y = sign * dx, sign * dy
+                result |= shift(victims, -step_x, -step_y) \
+                    & shift(victims, -2 * step_x, -2 * step_y) \
+                    & shift(own, -3 * step_x, -3 * step_y)
+        return result & ~(self.x_bits | self.o_bits) & FULL_MASK
+
+    def capture_threat_squares(self, stone: str, targets: int) -> int:
+        """
+        Bits of empty squares where `stone` threatens to capture a pair holding a stone of `targets`:
+        the pair is closed on the far side by an empty square, which the next move of `stone` takes
+        """
+        victims = self.o_bits if stone == X_STONE else self.x_bits
+        empty = ~(self.x_bits | self.o_bits) & FULL_MASK
+        result = 0
+        for dx, dy in DIRECTIONS:
+            for sign in (1, -1):
+                step_x, step_y = sign * dx, sign * dy
+                first = shift(victims, -step_x, -step_y)
+                second = shift(victims, -2 * step_x, -2 * step_y)
+                pairs = (first & second) & (shift(targets, -step_x, -step_y) | shift(targets, -2 * step_x, -2 * step_y))
+                result |= pairs & shift(empty, -3 * step_x, -3 * step_y)
+        return result & empty
+
+    def five_completions(self, stone: str) -> int:
+        """ Bits of empty squares where `stone` makes five (or more) in a row """
+        own = self.bits(stone)
+        result = 0
+        for dx, dy in DIRECTIONS:
+            # shifted[m] has a bit on the square if `stone` stands m steps further along the direction
+            shifted = {m: shift(own, -m * dx, -m * dy) for m in range(-4, 5) if m}
+            for position_in_five in range(5):
+                five = FULL_MASK
+                for step in range(5):
+                    if step != position_in_five:
+                        five &= shifted[step - position_in_five]
+                result |= five
+        return result & ~(self.x_bits | self.o_bits) & FULL_MASK
+
+    def __eq__(self, other):
+        return isinstance(other, Board) and self.x_bits == other.x_bits and self.o_bits == other.o_bits
+
+    def __hash__(self):
+        return hash((self.x_bits, self.o_bits))
+
+
+_PLANE_BYTES = (CELLS + 7) // 8
+_PACKED_HEADER = struct.Struct('<BB?')  # captures made by x, captures made by o, x is to move
+
+
+class PackedGame(NamedTuple):
+    """ Game state in the `Game.board` column: the header, then the x and o bit planes, little-endian """
+    board: Board
+    captures_x: int = 0
+    captures_o: int = 0
+    x_to_move: bool = True
+
+    def pack(self) -> bytes:
+        return _PACKED_HEADER.pack(self.captures_x, self.captures_o, self.x_to_move) \
+            + self.board.x_bits.to_bytes(_PLANE_BYTES, 'little') \
+            + self.board.o_bits.to_bytes(_PLANE_BYTES, 'little')
+
+    @staticmethod
+    def unpack(data: bytes) -> 'PackedGame':
+        data = bytes(data)
+        if len(data) != PACKED_GAME_SIZE:
+            raise ValueError(f'A packed game takes {PACKED_GAME_SIZE} bytes, not {len(data)}')
+        captures_x, captures_o, x_to_move = _PACKED_HEADER.unpack_from(data)
+        planes = data[_PACKED_HEADER.size:]
+        board = Board.from_bits(
+            int.from_bytes(planes[:_PLANE_BYTES], 'little'),
+            int.from_bytes(planes[_PLANE_BYTES:], 'little'),
+        )
+        return PackedGame(board, captures_x, captures_o, x_to_move)
+
+
+PACKED_GAME_SIZE = _PACKED_HEADER.size + 2 * _PLANE_BYTES
+EMPTY_PACKED_GAME = PackedGame(Board()).pack()
+
+
+def shift(bits: int, dx: int, dy: int) -> int:
+    """ Moves every square of `bits` by (dx, dy), dropping squares which leave the board """
+    amount = dy * SIZE + dx
+    shifted = bits << amount if amount >= 0 else bits >> -amount
+    return shifted & _COLUMNS_SHIFT_MASKS[dx] & FULL_MASK if dx else shifted & FULL_MASK
+
+
+def neighbourhood(bits: int) -> int:
+    """ Every square in the 3x3 block around any square of `bits`, clipped to the board """
+    horizontal = bits | ((bits << 1) & _NOT_FIRST_COLUMN) | ((bits >> 1) & _NOT_LAST_COLUMN)
+    return (horizontal | (horizontal << SIZE) | (horizontal >> SIZE)) & FULL_MASK
+
+
+def iterate_squares(bits: int) -> Iterator[int]:
+    while bits:
+        lowest = bits & -bits
+        yield lowest.bit_length() - 1
+        bits ^= lowest
+
+
+def iterate_coordinates(bits: int) -> Iterator[Tuple[int, int]]:
+    for square in iterate_squares(bits):
+        yield square % SIZE, square // SIZE
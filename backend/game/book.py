@@ -0,0 +1,222 @@
+import mmap
+import os
+import struct
+from threading import Lock
+from typing import Tuple, List, Dict, Callable, Union
+
+from django.conf import settings
+
+from game.algorithm import Minimax
+from game.batch import BatchLeafEvaluator
+from game.board import Board, X_STONE, O_STONE, SIZE, index, neighbourhood, iterate_coordinates
+from game.heuristics import HeuristicSimpleTreat
+from game.ordering import MoveOrdering
+from game.position import Position
+from game.transposition import TranspositionTable
+
+
+Move = Tuple[int, int]
+
+MAGIC = b'GMKBOOK1'
+_HEADER = struct.Struct('<8sI4x')  # magic, amount of entries
+_ENTRY = struct.Struct('<QH')  # Zobrist key of the position, square of the move
+
+_LAST = SIZE - 1
+SYMMETRIES: Tuple[Callable[[int, int], Move], ...] = (
+    lambda x, y: (x, y),
+    lambda x, y: (_LAST - x, y),
+    lambda x, y: (x, _LAST - y),
+    lambda x, y: (_LAST - x, _LAST - y),
+    lambda x, y: (y, x),
+    lambda x, y: (_LAST - y, x),
+    lambda x, y: (y, _LAST - x),
+    lambda x, y: (_LAST - y, _LAST - x),
+)
+
+
+class OpeningBook:
+    """
+    Position key -> move table in a file: a header and entries sorted by the key, found by binary
+    search right in the memory-mapped file. Nothing is read up front and every process which
+    opens the same file shares its pages.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as book_file:
+            stat = os.fstat(book_file.fileno())
+            self.stamp = (stat.st_ino, stat.st_mtime_ns)  # a rewritten book is another file, see `write`
+            self._map = mmap.mmap(book_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._size = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or len(self._map) != _HEADER.size + self._size * _ENTRY.size:
+            self._map.close()
+            raise ValueError(f"'{path}' is not an opening book")
+
+    def __len__(self) -> int:
+        return self._size
+
+    def get(self, key: int) -> Union[Move, None]:
+        low, high = 0, self._size
+        try:
+            while low < high:
+                middle = (low + high) // 2
+                entry_key, square = _ENTRY.unpack_from(self._map, _HEADER.size + middle * _ENTRY.size)
+                if entry_key == key:
+                    return square % SIZE, square // SIZE
+                if entry_key < key:
+                    low = middle + 1
+                else:
+                    high = middle
+        except ValueError:
+            pass  # closed by get_opening_book for a newer book while this lookup ran
+        return None
+
+    def move(self, position: Position) -> Union[Move, None]:
+        """ Book move of the position, if there is one and it is legal """
+        move = self.get(position.key)
+        if move is None or not position.board.is_empty(*move) or not position.play(move):
+            return None
+        position.undo()
+        return move
+
+    def close(self):
+        try:
+            self._map.close()
+        except BufferError:
+            pass  # a lookup still reads it, the map is closed when that one lets go of it
+
+    @staticmethod
+    def write(path: str, moves: Dict[int, Move]):
+        """ Writes to a temporary file first, so processes which read the old book never see half of the new one """
+        temporary_path = f'{path}.tmp'
+        with open(temporary_path, 'wb') as book_file:
+            book_file.write(_HEADER.pack(MAGIC, len(moves)))
+            for key in sorted(moves):
+                book_file.write(_ENTRY.pack(key, index(*moves[key])))
+        os.replace(temporary_path, path)
+
+
+_book: Union[OpeningBook, None] = None
+_book_lock = Lock()
+
+
+def get_opening_book() -> Union[OpeningBook, None]:
+    """
+    The book from GOMOKU_OPENING_BOOK_PATH, opened on first use and again when the file was replaced;
+    None while there is no such file
+    """
+    global _book
+    path = settings.GOMOKU_OPENING_BOOK_PATH
+    try:
+        stat = os.stat(path)
+        stamp = (stat.st_ino, stat.st_mtime_ns)
+    except FileNotFoundError:
+        stamp = None
+    with _book_lock:
+        if _book is not None and (_book.path != path or _book.stamp != stamp):
+            _book.close()
+            _book = None
+        if _book is None and stamp is not None:
+            _book = OpeningBook(path)
+        return _book
+
+
+class OpeningBookBuilder:
+    """
+    Searches the early positions offline. The bot may play either side, so two trees are walked from
+    the empty board: on the bot's turns only its searched move is followed, on the opponent's turns
+    the `width` moves with the best static value are. Every searched position is stored together
+    with its 7 mirror and rotation images.
+    """
+    def __init__(
+            self,
+            plies: int,
+            width: int,
+            time_limit: float,
+            max_depth: int,
+            log: Callable[[str], None] = None,
+    ):
+        self.plies = plies
+        self.width = width
+        self.time_limit = time_limit
+        self.max_depth = max_depth
+        self.log = log
+        self.moves: Dict[int, Move] = {}
+        self._searched: Dict[int, Union[Move, None]] = {}
+        self._minimax = Minimax(
+            HeuristicSimpleTreat(),
+            transposition_table=TranspositionTable(),
+            move_ordering=MoveOrdering(),
+            batch_evaluator=BatchLeafEvaluator(),
+        )
+
+    def build(self) -> Dict[int, Move]:
+        for bot_moves_first in (True, False):
+            position = Position(player_1='player_1', player_2='player_2', maximizing_player=True, board=Board())
+            self._expand(position, bot_moves_first)
+        return self.moves
+
+    def _expand(self, position: Position, bot_to_move: bool):
+        if position.ply >= self.plies:
+            return
+
+        if bot_to_move:
+            move = self._book_move(position)
+            if move is not None and position.play(move):
+                self._expand(position, False)
+                position.undo()
+        else:
+            for reply in self._replies(position):
+                position.play(reply)
+                self._expand(position, True)
+                position.undo()
+
+    def _book_move(self, position: Position) -> Union[Move, None]:
+        key = position.key
+        if key in self._searched:
+            return self._searched[key]
+
+        if position.board.occupied:
+            move = self._minimax.iterative_deepening(position, self.time_limit, self.max_depth)[1]
+        else:
+            move = (SIZE // 2, SIZE // 2)
+        self._searched[key] = move
+        if move is not None:
+            self._store(position, move)
+            if self.log:
+                self.log(f'{len(self._searched)} positions searched, ply {position.ply}: {move}')
+        return move
+
+    def _store(self, position: Position, move: Move):
+        x_stones = position.board.stones(X_STONE)
+        o_stones = position.board.stones(O_STONE)
+        for symmetry in SYMMETRIES:
+            image = Position(
+                player_1=position.player_1,
+                player_2=position.player_2,
+                maximizing_player=position.maximizing_player,
+                board=Board.from_tiles(
+                    [symmetry(*stone) for stone in x_stones],
+                    [symmetry(*stone) for stone in o_stones],
+                ),
+                captures_x=position.captures_x,
+                captures_o=position.captures_o,
+            )
+            self.moves.setdefault(image.key, symmetry(*move))
+
+    def _replies(self, position: Position) -> List[Move]:
+        """ The opponent's moves with the best static value, closer to the center first on ties """
+        candidates = position.candidates
+        if not position.board.occupied:
+            center = 1 << index(SIZE // 2, SIZE // 2)
+            candidates = neighbourhood(neighbourhood(center))
+
+        heuristic = HeuristicSimpleTreat()
+        sign = 1 if position.maximizing_player else -1
+        scored = []
+        for move in iterate_coordinates(candidates):
+            if not position.play(move):
+                continue
+            distance = abs(move[0] - SIZE // 2) + abs(move[1] - SIZE // 2)
+            scored.append((-sign * heuristic.calculate(position), distance, move))
+            position.undo()
+        return [move for _, _, move in sorted(scored)[:self.width]]
@@ -1,11 +1,11 @@
-import re
 from abc import ABC, abstractmethod
-from typing import TYPE_CHECKING, NamedTuple
+from typing import TYPE_CHECKING, NamedTuple, Tuple, List, Dict, Iterable, Union
 from functools import wraps
 
 from singleton_decorator import singleton
 
 from game.analyzer import Analyzer
+from game.patterns import window_codes, first_match_table, TABLE_SIZE
 
 if TYPE_CHECKING:
     from game.node import Node
@@ -19,6 +19,69 @@ class Treat(NamedTuple):
     terminated: bool = False
 
 
+LineScore = Tuple[int, int, int, int]
+NO_TREATS: LineScore = (0, 0, 0, 0)
+
+
+class LineScores:
+    """
+    Treat values of every line of a position, with the totals over the board kept up to date
+    line by line: a move only replaces the scores of the lines it touched.
+    A line score is (x my turn, x opponent turn, o my turn, o opponent turn) values.
+    """
+    __slots__ = ('scores', 'x_my_turn', 'x_opponent_turn', 'o_my_turn', 'o_opponent_turn')
+
+    def __init__(self, scores: Dict[Tuple[int, int], LineScore] = None):
+        self.scores = scores if scores is not None else {}
+        self.x_my_turn = sum(score[0] for score in self.scores.values())
+        self.x_opponent_turn = sum(score[1] for score in self.scores.values())
+        self.o_my_turn = sum(score[2] for score in self.scores.values())
+        self.o_opponent_turn = sum(score[3] for score in self.scores.values())
+
+    def copy(self) -> 'LineScores':
+        line_scores = LineScores.__new__(LineScores)
+        line_scores.scores = dict(self.scores)
+        line_scores.x_my_turn = self.x_my_turn
+        line_scores.x_opponent_turn = self.x_opponent_turn
+        line_scores.o_my_turn = self.o_my_turn
+        line_scores.o_opponent_turn = self.o_opponent_turn
+        return line_scores
+
+    def value(self, maximizing_player: bool) -> int:
+        if maximizing_player:
+            return self.x_my_turn - self.o_opponent_turn
+        return self.x_opponent_turn - self.o_my_turn
+
+    def update(
+            self,
+            lines: Dict[Tuple[int, int], str],
+            keys: Iterable[Tuple[int, int]],
+    ) -> List[Tuple[Tuple[int, int], LineScore]]:
+        """ Rescores the given lines and returns their old scores for `restore` """
+        old_scores = []
+        line_score = HeuristicSimpleTreat().line_score
+        for key in keys:
+            line = lines.get(key)
+            old_scores.append((key, self._replace(key, line_score(line) if line else NO_TREATS)))
+        return old_scores
+
+    def restore(self, old_scores: List[Tuple[Tuple[int, int], LineScore]]):
+        for key, score in reversed(old_scores):
+            self._replace(key, score)
+
+    def _replace(self, key: Tuple[int, int], score: LineScore) -> LineScore:
+        old_score = self.scores.get(key, NO_TREATS)
+        if score == NO_TREATS:
+            self.scores.pop(key, None)
+        else:
+            self.scores[key] = score
+        self.x_my_turn += score[0] - old_score[0]
+        self.x_opponent_turn += score[1] - old_score[1]
+        self.o_my_turn += score[2] - old_score[2]
+        self.o_opponent_turn += score[3] - old_score[3]
+        return old_score
+
+
 class Heuristic(ABC):
     def __init__(self, *args, **kwargs):
         self.alpha_min: int = -1000000000000
@@ -46,15 +109,15 @@ def update_node_heuristic_value(func):
 class HeuristicSimpleTreat(Heuristic):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.pattern_x = re.compile(f'(?=({"|".join([treat.x_template for treat in self.TREAT_TYPES])}))')
-        self.pattern_o = re.compile(f'(?=({"|".join([treat.o_template for treat in self.TREAT_TYPES])}))')
-
         self.treats_x = {treat.x_template: (treat.my_turn_value, treat.opponent_turn_value)
                          for treat in self.TREAT_TYPES}
 
         self.treats_o = {treat.o_template: (treat.my_turn_value, treat.opponent_turn_value)
                          for treat in self.TREAT_TYPES}
 
+        self.window_scores = self._build_window_scores()
+        self._line_scores_cache: Dict[str, LineScore] = {}
+
     TREAT_TYPES = [
         Treat(x_template='xxxxx', o_template='ooooo', my_turn_value=1000000000, opponent_turn_value=1000000000, terminated=True),
         Treat(x_template='-xxxx-', o_template='-oooo-', my_turn_value=2000000, opponent_turn_value=1000000),
@@ -72,6 +135,8 @@ class HeuristicSimpleTreat(Heuristic):
         Treat(x_template='-xx--x-', o_template='-oo--o-', my_turn_value=5000, opponent_turn_value=100),
     ]
 
+    LINE_SCORES_CACHE_SIZE = 1 << 18
+
     CAPTURE_VALUES = (
         10000,
         50000,
@@ -83,39 +148,56 @@ class HeuristicSimpleTreat(Heuristic):
     @update_node_heuristic_value
     @Analyzer.update_time(Analyzer.HEURISTIC_CALCULATE)
     def calculate(self, node: 'Node', *args, **kwargs) -> float:
-        score = 0
-        maximizing_player = node.maximizing_player
-
-        for line_key, line in node.lines.items():
-            if len(line) < 4:
+        return node.line_scores.value(node.maximizing_player) + node.capture_value
+
+    def line_score(self, line: str) -> LineScore:
+        """
+        Sum of the treats which start on every square of the line, at most one per square:
+        the first one in TREAT_TYPES order, read from the precomputed window table.
+        """
+        cached = self._line_scores_cache.get(line)
+        if cached is not None:
+            return cached
+
+        x_my_turn = x_opponent_turn = o_my_turn = o_opponent_turn = 0
+        window_scores = self.window_scores
+        for code in window_codes(line):
+            score = window_scores[code]
+            if score is not None:
+                x_my_turn += score[0]
+                x_opponent_turn += score[1]
+                o_my_turn += score[2]
+                o_opponent_turn += score[3]
+
+        if len(self._line_scores_cache) >= self.LINE_SCORES_CACHE_SIZE:
+            self._line_scores_cache.clear()
+        score = (x_my_turn, x_opponent_turn, o_my_turn, o_opponent_turn)
+        self._line_scores_cache[line] = score
+        return score
+
+    def _build_window_scores(self) -> List[Union[LineScore, None]]:
+        x_matches = first_match_table([treat.x_template for treat in self.TREAT_TYPES])
+        o_matches = first_match_table([treat.o_template for treat in self.TREAT_TYPES])
+        window_scores = [None] * TABLE_SIZE
+        for code in range(TABLE_SIZE):
+            if x_matches[code] < 0 and o_matches[code] < 0:
                 continue
-
-            o_treats = self.pattern_o.findall(line)
-            x_treats = self.pattern_x.findall(line)
-
-            if o_treats:
-                for treat in o_treats:
-                    treat_values = self.treats_o[treat]
-                    if not maximizing_player:
-                        score += treat_values[0] * (-1)
-
-                    else:
-                        score += treat_values[1] * (-1)
-
-                    #  TODO: CHECK IF TERMINATED
-
-            if x_treats:
-                for treat in x_treats:
-                    treat_values = self.treats_x[treat]
-                    if maximizing_player:
-                        score += treat_values[0]
-
-                    else:
-                        score += treat_values[1]
-
-                    #  TODO: CHECK IF TERMINATED
-
-        return score + node.capture_value
+            x_treat = self.TREAT_TYPES[x_matches[code]] if x_matches[code] >= 0 else None
+            o_treat = self.TREAT_TYPES[o_matches[code]] if o_matches[code] >= 0 else None
+            window_scores[code] = (
+                x_treat.my_turn_value if x_treat else 0,
+                x_treat.opponent_turn_value if x_treat else 0,
+                o_treat.my_turn_value if o_treat else 0,
+                o_treat.opponent_turn_value if o_treat else 0,
+            )
+        return window_scores
+
+    def line_scores(self, lines: Dict[Tuple[int, int], str]) -> LineScores:
+        return LineScores({
+            key: score
+            for key, score in ((key, self.line_score(line)) for key, line in lines.items())
+            if score != NO_TREATS
+        })
 
     @classmethod
     def update_capture_value(cls, node: 'Node') -> int:
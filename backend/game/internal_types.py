@@ -38,3 +38,7 @@ class TileXY(NamedTuple):
 
 class TerminatedException(Exception):
     pass
+
+
+class SearchTimeout(Exception):
+    pass
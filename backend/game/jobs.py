@@ -0,0 +1,108 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import timedelta
+from functools import partial
+from multiprocessing import get_context
+from threading import Lock, Thread
+from time import time
+from typing import Tuple, Dict, Union
+from uuid import UUID
+
+import django
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from singleton_decorator import singleton
+
+from game.models import Game, SearchJob
+from game.parallel import Snapshot
+from game.sessions import EngineSessions
+from game.states import GameStates
+
+
+def _run_job(game_id: int, snapshot: Snapshot, time_limit: float) -> Dict[str, Union[Tuple[int, int], int, float]]:
+    """
+    Runs in a worker process, which keeps the engine sessions of the games it searched for.
+    The position comes with the job: workers don't use the database.
+    """
+    start_time = time()
+    session = EngineSessions().get(game_id)
+    value, chosen_move, depth, _ = session.find_move(snapshot.position(), time_limit)
+    return {
+        'coordinates': chosen_move if chosen_move else (9, 9),
+        'time': time() - start_time,
+        'depth': depth,
+    }
+
+
+@singleton
+class SearchJobs:
+    """
+    Runs next_move searches on a pool of GOMOKU_JOB_WORKERS processes, so web workers only wait for I/O.
+    The jobs are SearchJob rows: any web worker answers the polls, the one which queued a job writes
+    its result. A request for a position which already has a job - the same game, board, captures and
+    time limit - gets that job unless it failed. Jobs are dropped GOMOKU_JOB_RESULT_TIMEOUT seconds
+    after they were queued; the job of a process which died stays pending until then.
+    """
+    def __init__(self):
+        self._pool: Union[ProcessPoolExecutor, None] = None
+        self._lock = Lock()
+
+    def submit(self, game: Game, player: str, time_limit: float) -> SearchJob:
+        position = GameStates().get(game).position(player)
+        key = f'{position.key}:{position.captures_x}:{position.captures_o}:{time_limit}'
+        self._evict()
+        # a request which loses the race to create the job gets an IntegrityError and then the other job
+        job, created = SearchJob.objects.exclude(status=SearchJob.FAILED).get_or_create(game=game, key=key)
+        if not created:
+            return job
+
+        transaction.on_commit(partial(self._start, job.id, game.id, Snapshot.from_position(position), time_limit))
+        return job
+
+    @staticmethod
+    def get(job_id: str) -> Union[SearchJob, None]:
+        try:
+            return SearchJob.objects.filter(pk=UUID(job_id)).first()
+        except ValueError:
+            return None
+
+    def _start(self, job_id: UUID, game_id: int, snapshot: Snapshot, time_limit: float):
+        future = self._get_pool().submit(_run_job, game_id, snapshot, time_limit)
+        future.add_done_callback(lambda done: Thread(target=self._save_result, args=(job_id, done)).start())
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        """
+        Started by the first job. The workers are spawned, not forked: a fork would copy the threads
+        and the open database connections of the web process.
+        """
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=settings.GOMOKU_JOB_WORKERS,
+                    mp_context=get_context('spawn'),
+                    initializer=django.setup,
+                )
+            return self._pool
+
+    @staticmethod
+    def _save_result(job_id: UUID, future: Future):
+        """ Runs in a thread of its own, so it can close its database connection """
+        try:
+            if future.cancelled() or future.exception() is not None:
+                SearchJob.objects.filter(pk=job_id).update(status=SearchJob.FAILED)
+                return
+            result = future.result()
+            SearchJob.objects.filter(pk=job_id).update(
+                status=SearchJob.DONE,
+                x_coordinate=result['coordinates'][0],
+                y_coordinate=result['coordinates'][1],
+                time=result['time'],
+                depth=result['depth'],
+            )
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _evict():
+        timeout = timedelta(seconds=settings.GOMOKU_JOB_RESULT_TIMEOUT)
+        SearchJob.objects.filter(created__lt=timezone.now() - timeout).delete()
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from game.book import OpeningBook, OpeningBookBuilder
+
+
+class Command(BaseCommand):
+    help = 'Searches the early positions and writes their moves to the opening book file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--plies', type=int, default=6, help='stones on the board of the deepest book position')
+        parser.add_argument('--width', type=int, default=4, help="opponent's moves followed in every position")
+        parser.add_argument('--time-limit', type=float, default=settings.GOMOKU_SEARCH_TIME_LIMIT * 5)
+        parser.add_argument('--max-depth', type=int, default=settings.GOMOKU_SEARCH_MAX_DEPTH)
+        parser.add_argument('--output', default=settings.GOMOKU_OPENING_BOOK_PATH)
+
+    def handle(self, *args, **options):
+        builder = OpeningBookBuilder(
+            plies=options['plies'],
+            width=options['width'],
+            time_limit=options['time_limit'],
+            max_depth=options['max_depth'],
+            log=self.stdout.write if options['verbosity'] > 1 else None,
+        )
+        moves = builder.build()
+        OpeningBook.write(options['output'], moves)
+        self.stdout.write(self.style.SUCCESS(f"{len(moves)} positions written to {options['output']}"))
@@ -0,0 +1,45 @@
+# Generated by Django 2.2.13 on 2026-10-18 17:49
+
+import struct
+
+from django.db import migrations, models
+
+
+# the packing of game.board.PackedGame as it was when this migration was written
+SIZE = 19
+PLANE_BYTES = (SIZE * SIZE + 7) // 8
+HEADER = struct.Struct('<BB?')  # captures made by x, captures made by o, x is to move
+
+
+def pack_boards(apps, schema_editor):
+    Game = apps.get_model('game', 'Game')
+    Tile = apps.get_model('game', 'Tile')
+    for game in Game.objects.all().iterator():
+        tiles = list(Tile.objects.filter(game=game).order_by('id'))
+        x_bits = o_bits = 0
+        for tile in tiles:
+            bit = 1 << tile.y_coordinate * SIZE + tile.x_coordinate
+            if tile.player == game.player_1:
+                x_bits |= bit
+            else:
+                o_bits |= bit
+        x_to_move = not tiles or tiles[-1].player != game.player_1
+        game.board = HEADER.pack(game.captures_x, game.captures_o, x_to_move) \
+            + x_bits.to_bytes(PLANE_BYTES, 'little') + o_bits.to_bytes(PLANE_BYTES, 'little')
+        game.save(update_fields=['board'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0009_game_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='board',
+            field=models.BinaryField(default=b'\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'),
+        ),
+        migrations.RunPython(pack_boards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.13 on 2026-10-18 17:52
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0010_game_board'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='tile',
+            unique_together={('game', 'x_coordinate', 'y_coordinate')},
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.13 on 2026-10-18 18:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0011_tile_unique_square'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('key', models.CharField(max_length=100)),
+                ('status', models.CharField(default='pending', max_length=10)),
+                ('x_coordinate', models.IntegerField(null=True)),
+                ('y_coordinate', models.IntegerField(null=True)),
+                ('depth', models.IntegerField(null=True)),
+                ('time', models.FloatField(null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='game.Game')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='searchjob',
+            constraint=models.UniqueConstraint(condition=models.Q(_negated=True, status='failed'), fields=('game', 'key'), name='search_job_unique_key'),
+        ),
+    ]
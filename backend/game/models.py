@@ -1,4 +1,9 @@
+from uuid import uuid4
+
 from django.db import models
+from django.db.models import F
+
+from game.board import Board, PackedGame, EMPTY_PACKED_GAME
 
 
 class Game(models.Model):
@@ -9,6 +14,20 @@ class Game(models.Model):
     winner = models.CharField(max_length=30, null=True)
     captures_x = models.PositiveIntegerField(default=0)
     captures_o = models.PositiveIntegerField(default=0)
+    version = models.PositiveIntegerField(default=0)  # changed with every tile, cached game states compare it
+    board = models.BinaryField(default=EMPTY_PACKED_GAME)  # game.board.PackedGame, what positions are loaded from
+
+    def rebuild_board(self):
+        """ Packs the board again from the tiles, after they were written without it """
+        tiles = list(self.tile_set.order_by('id'))
+        board = Board.from_tiles(
+            [(tile.x_coordinate, tile.y_coordinate) for tile in tiles if tile.player == self.player_1],
+            [(tile.x_coordinate, tile.y_coordinate) for tile in tiles if tile.player != self.player_1],
+        )
+        x_to_move = not tiles or tiles[-1].player != self.player_1
+        self.board = PackedGame(board, self.captures_x, self.captures_o, x_to_move).pack()
+        Game.objects.filter(pk=self.pk).update(board=self.board, version=F('version') + 1)
+        self.refresh_from_db(fields=('version',))
 
 
 class Tile(models.Model):
@@ -16,3 +35,43 @@ class Tile(models.Model):
     y_coordinate = models.IntegerField()
     player = models.CharField(max_length=30)
     game = models.ForeignKey(Game, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = (('game', 'x_coordinate', 'y_coordinate'),)
+
+
+class SearchJob(models.Model):
+    """ A next_move search run in the background by game.jobs.SearchJobs, polled by its id from any web worker """
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+    game = models.ForeignKey(Game, on_delete=models.CASCADE)
+    key = models.CharField(max_length=100)  # position key, captures and time limit, the same for the same search
+    status = models.CharField(max_length=10, default=PENDING)
+    x_coordinate = models.IntegerField(null=True)
+    y_coordinate = models.IntegerField(null=True)
+    depth = models.IntegerField(null=True)
+    time = models.FloatField(null=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            # one search per position, another one only after it failed
+            models.UniqueConstraint(
+                fields=['game', 'key'], condition=~models.Q(status='failed'), name='search_job_unique_key',
+            ),
+        ]
+
+    def data(self) -> dict:
+        """ Status, and the result of the search when it is done """
+        if self.status != SearchJob.DONE:
+            return {'job_id': self.id.hex, 'status': self.status}
+        return {
+            'job_id': self.id.hex,
+            'status': self.status,
+            'coordinates': (self.x_coordinate, self.y_coordinate),
+            'time': self.time,
+            'depth': self.depth,
+        }
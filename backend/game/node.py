@@ -1,196 +1,254 @@
-from collections import defaultdict
 from typing import Tuple, List, Dict, Set, Union, TYPE_CHECKING
-from copy import deepcopy
 
-from sortedcontainers import SortedList
-from django.utils.functional import cached_property
-
-from game.models import Tile
 from game.internal_types import TileXY
 from game.heuristics import HeuristicSimpleTreat
+from game.rules import GameRules
+from game.board import Board, X_STONE, O_STONE, SIZE, line_keys, neighbourhood, iterate_coordinates, iterate_squares
 
 
 if TYPE_CHECKING:
     from game.models import Game
+    from game.ordering import MoveOrdering
 
 
 class Node:
-    _x_size = 19
-    _y_size = 19
+    """
+    Position of the tree search. Expanded children are not kept unless the node is made with
+    `keep_children` (for print_children), only the best child (`best_child`) and the best move and
+    value (`chosen`) the search found, so a finished subtree is freed as soon as the search leaves it.
+    """
+    _x_size = SIZE
+    _y_size = SIZE
+
+    __slots__ = (
+        'player_1', 'player_2', 'maximizing_player', 'board', 'new_move', 'father', 'heuristic_value',
+        'captures_x', 'captures_o', 'capture_value', 'chosen', 'best_child', 'line_scores',
+        '_inspect_bits', '_children', '_lines', '_fives', '_five_lines',
+    )
 
     def __init__(
             self,
             player_1: str,
             player_2: str,
             maximizing_player: bool,
-            tiles: Dict[str, List[Tuple[int, int]]],
+            tiles: Dict[str, List[Tuple[int, int]]] = None,
             new_move: Tuple[int, int] = None,
             should_inspect: Set[Tuple[int, int]] = None,
             father: 'Node' = None,
             captures_x: int = None,
             captures_o: int = None,
+            board: Board = None,
+            inspect_bits: int = None,
+            keep_children: bool = False,
     ):
         self.player_1 = player_1
         self.player_2 = player_2
         self.maximizing_player = maximizing_player
-        self.tiles = tiles
+        self.board = board if board is not None else Board.from_tiles(tiles[player_1], tiles[player_2])
         self.new_move = new_move
-        self.should_inspect = should_inspect or self._get_inspections()
+        if inspect_bits is not None:
+            self._inspect_bits = inspect_bits
+        elif should_inspect:
+            self._inspect_bits = self._bits_from_tiles(should_inspect)
+        else:
+            self._inspect_bits = self._get_inspections()
         self.father = father
 
-        self._children: Dict[Tuple[int, int], Node] = {}
+        self._children: Union[Dict[Tuple[int, int], Node], None] = {} if keep_children else None
         self.heuristic_value = None
-        self._sorted_tiles = None
         self.captures_x = captures_x if captures_x else 0
         self.captures_o = captures_o if captures_o else 0
         self.capture_value = father.capture_value if father else 0  # TODO: check
         self.chosen: Union[Tuple[Tuple[int, int], float], None] = None
-        self._lines = None
-
-        self._o_open_threes = 0
-        self._x_open_threes = 0
-        self.update_open_threes()
+        self.best_child: Union[Node, None] = None
+        self._fives: Union[Tuple[bool, bool], None] = None
+        self._five_lines: Union[Dict[Tuple[int, int], int], None] = None
+        if father is not None and new_move is not None:
+            self._lines = self._lines_from_father()
+            self.line_scores = father.line_scores.copy()
+            self.line_scores.update(self._lines, line_keys(*new_move))
+        else:
+            self._lines = None
+            self.line_scores = HeuristicSimpleTreat().line_scores(self.lines)
 
     @property
     def children_amount(self) -> int:
-        return len(self._children)
+        return len(self._children) if self._children is not None else 0
+
+    @property
+    def keep_children(self) -> bool:
+        return self._children is not None
 
-    @cached_property
+    @property
     def player(self):
         return self.player_1 if self.maximizing_player else self.player_2
 
-    @cached_property
+    @property
     def another_player(self):
         return self.player_2 if self.maximizing_player else self.player_1
 
+    @property
+    def stone(self) -> str:
+        return X_STONE if self.maximizing_player else O_STONE
+
+    @property
+    def another_stone(self) -> str:
+        return O_STONE if self.maximizing_player else X_STONE
+
+    @property
+    def tiles(self) -> Dict[str, List[Tuple[int, int]]]:
+        return {
+            self.player_1: self.board.stones(X_STONE),
+            self.player_2: self.board.stones(O_STONE),
+        }
+
     @property
     def used_tiles(self) -> List[Tuple[int, int]]:
-        return self.tiles[self.player_1] + self.tiles[self.player_2]
+        return list(iterate_coordinates(self.board.occupied))
 
     @property
     def tiles_set(self) -> Set[Tuple[int, int]]:
         return set(self.used_tiles)
 
     @property
-    def lines(self):  # TODO: maybe can be cached
-        if not self._lines:
+    def should_inspect(self) -> Set[Tuple[int, int]]:
+        return set(iterate_coordinates(self._inspect_bits))
+
+    @property
+    def lines(self) -> Dict[Tuple[int, int], str]:
+        if self._lines is None:
             self._find_lines()
         return self._lines
 
     @property
-    def sorted_tiles(self) -> SortedList:
-        if not self._sorted_tiles:
-            self._sorted_tiles = SortedList()  # TODO: make tiles already sorted while creating and change sortedlist dinamically for created children
-            self._sorted_tiles.update(self.tiles_set | self.should_inspect)
-        return self._sorted_tiles
-
-    def children(self):
-        for coordinate in self.should_inspect:
+    def fives(self) -> Tuple[bool, bool]:
+        """ Whether x and o have five in a row anywhere on the board, found on first use """
+        if self._fives is None:
+            fives = 0
+            for line_fives in self.five_lines.values():
+                fives |= line_fives
+            self._fives = bool(fives & 1), bool(fives & 2)
+        return self._fives
+
+    @property
+    def five_lines(self) -> Dict[Tuple[int, int], int]:
+        """
+        GameRules.line_fives of the lines which have a five, by line key. A child takes its father's ones
+        and checks again only the lines through the new move and the captured stones.
+        """
+        if self._five_lines is None:
+            lines = self.lines
+            if self.father is not None and self.new_move is not None:
+                five_lines = dict(self.father.five_lines)
+                keys = set(line_keys(*self.new_move))
+                for captured in iterate_squares(self.father.board.occupied & ~self.board.occupied):
+                    keys.update(line_keys(captured % self._x_size, captured // self._x_size))
+            else:
+                five_lines = {}
+                keys = lines.keys()
+            line_fives = GameRules().line_fives
+            for key in keys:
+                fives = line_fives(lines[key]) if key in lines else 0
+                if fives:
+                    five_lines[key] = fives
+                else:
+                    five_lines.pop(key, None)
+            self._five_lines = five_lines
+        return self._five_lines
+
+    @property
+    def principal_variation(self) -> List[Tuple[int, int]]:
+        """ Moves of the best children the search chose, from this node down """
+        moves = []
+        node = self.best_child
+        while node is not None:
+            moves.append(node.new_move)
+            node = node.best_child
+        return moves
+
+    @property
+    def candidates(self) -> int:
+        return self._inspect_bits
+
+    def children(self, ordering: 'MoveOrdering' = None, ply: int = 0, hash_move: Tuple[int, int] = None):
+        """ Children are built one by one, so a cutoff skips building the rest of them """
+        if ordering:
+            coordinates = ordering.moves(self.board, self.stone, self._inspect_bits, ply, hash_move)
+        else:
+            coordinates = iterate_coordinates(self._inspect_bits)
+        for coordinate in coordinates:
             new_node = self.create_child_with_new_tile(coordinate)
             if not new_node:
                 continue
-            self._children[coordinate] = new_node  # TODO: Check if exists
+            if self._children is not None:
+                self._children[coordinate] = new_node  # TODO: Check if exists
             yield new_node
 
     def create_child_with_new_tile(self, tile: Tuple[int, int]):
-        new_tiles = deepcopy(self.tiles)
-        new_tiles[self.player].append(tile)
+        if GameRules().makes_double_three(self.board, tile[0], tile[1], self.stone):
+            return None
+
+        new_board = self.board.copy()
+        new_board.place(tile[0], tile[1], self.stone)
 
-        inspections_for_tile = self._get_inspections_for_tile(tile)
-        new_inspections = (self.should_inspect | inspections_for_tile) - {tile}
+        tile_bit = 1 << (tile[1] * self._x_size + tile[0])
+        new_inspections = (self._inspect_bits | neighbourhood(tile_bit) & ~self.board.occupied) & ~tile_bit
         node = Node(
             player_1=self.player_1,
             player_2=self.player_2,
             maximizing_player=not self.maximizing_player,
-            tiles=new_tiles,
-            should_inspect=new_inspections,
+            board=new_board,
             new_move=tile,
+            inspect_bits=new_inspections,
             father=self,
+            captures_x=self.captures_x,
+            captures_o=self.captures_o,
+            keep_children=self._children is not None,
         )
-        if node._x_open_threes - self._x_open_threes > 1 or node._o_open_threes - self._o_open_threes > 1:
-            return None
-
-        captures = node.find_captures_to_delete(TileXY.from_tuple(node.new_move))
+        captures = new_board.capture_pairs(tile[1] * self._x_size + tile[0], self.stone)
         if captures:
-            node.update_from_captures(captures)
+            node._remove_captures(captures)
 
         return node
 
-    def update_open_threes(self):
-        for line_key, line in self.lines.items():
-            if len(line) < 5:
-                continue
-            self._o_open_threes += len(GameRules().pattern_o.findall(line))
-            self._x_open_threes += len(GameRules().pattern_x.findall(line))
-
     def _find_lines(self):
-        # TODO: add missing tiles between divided areas ??? or check that it isn't important
-        self._lines = defaultdict(str)
-        for tile in self.sorted_tiles:
-            self.update_lines(tile)
-
-    def update_lines(self, tile):  # TODO: add position
-        """
+        self._lines = self.board.lines()
 
-        :param tile:
+    def _lines_from_father(self) -> Dict[Tuple[int, int], str]:
+        """ Only the 4 lines through the new move differ from the father's ones """
+        lines = dict(self.father.lines)
+        self.board.update_lines(lines, line_keys(*self.new_move))
+        return lines
 
-        1 - horizontal
-        2 - vertical
-        3 - diagonal (from up-left to down-right)
-        4 - diagonal (from up-right to down-left)
-
-        """
-        if tile in self.tiles[self.player_1]:
-            self._lines[(1, tile[1])] += 'x'
-            self._lines[(2, tile[0])] += 'x'
-            self._lines[(3, tile[0] - tile[1])] += 'x'
-            self._lines[(4, tile[0] + tile[1])] += 'x'
-        elif tile in self.tiles[self.player_2]:
-            self._lines[(1, tile[1])] += 'o'
-            self._lines[(2, tile[0])] += 'o'
-            self._lines[(3, tile[0] - tile[1])] += 'o'
-            self._lines[(4, tile[0] + tile[1])] += 'o'
-        else:
-            self._lines[(1, tile[1])] += '-'
-            self._lines[(2, tile[0])] += '-'
-            self._lines[(3, tile[0] - tile[1])] += '-'
-            self._lines[(4, tile[0] + tile[1])] += '-'
-
-    def _get_inspections(self) -> Set[Tuple[int, int]]:
-        inspections = set()
-        [inspections.update(self._get_inspections_for_tile(tile)) for tile in self.used_tiles]
-        return inspections
+    def _get_inspections(self) -> int:
+        occupied = self.board.occupied
+        return neighbourhood(occupied) & ~occupied
 
     def _get_inspections_for_tile(self, tile: Tuple[int, int]) -> Set[Tuple[int, int]]:
         assert 0 <= tile[0] < self._x_size
         assert 0 <= tile[1] < self._y_size
 
-        diff = 1  # TODO: check if it is optimal
-        result_set = set()
-
-        x_min = tile[0] - diff if tile[0] - diff >= 0 else 0
-        x_max = tile[0] + diff if tile[0] + diff < self._x_size else self._x_size - 1
-        y_min = tile[1] - diff if tile[1] - diff >= 0 else 0
-        y_max = tile[1] + diff if tile[1] + diff < self._y_size else self._y_size - 1
-        [
-            result_set.add((i, j))
-            for j in range(y_min, y_max + 1)
-            for i in range(x_min, x_max + 1)
-            if (i, j) not in self.tiles_set
-        ]
-        return result_set
+        occupied = self.board.occupied
+        return set(iterate_coordinates(neighbourhood(1 << (tile[1] * self._x_size + tile[0])) & ~occupied))
+
+    def _bits_from_tiles(self, tiles: Set[Tuple[int, int]]) -> int:
+        bits = 0
+        for x, y in tiles:
+            bits |= 1 << (y * self._x_size + x)
+        return bits
 
-    @cached_property
+    @property
     def pretty(self):
         result = "  " + "".join(["{:2d}".format(index) for index in range(self._x_size)]) + "\n"
         for y in range(self._y_size):
             result += "{:2d} ".format(y)
             for x in range(self._x_size):
-                if (x, y) in self.tiles[self.player_1]:
+                stone = self.board.get(x, y)
+                if stone == X_STONE:
                     result += 'X '
-                elif (x, y) in self.tiles[self.player_2]:
+                elif stone == O_STONE:
                     result += 'O '
-                elif (x, y) in self.should_inspect:
+                elif self._inspect_bits >> (y * self._x_size + x) & 1:
                     result += '. '
                 else:
                     result += '  '
@@ -198,6 +256,7 @@ class Node:
         return result
 
     def print_children(self, tabs):
+        """ Prints the expanded tree, only a node made with `keep_children` has it """
         print("\t" * tabs,
               self.new_move, "->",
               self.heuristic_value,
@@ -205,117 +264,57 @@ class Node:
               f"({self.maximizing_player})",
               f"CHOOSE: {self.chosen}" if self.chosen else "")
 
-        for move, child in self._children.items():
+        for move, child in (self._children or {}).items():
             child.print_children(tabs + 1)
 
     @staticmethod
     def from_game(game: 'Game', player: str):
-        data = {game.player_1: [], game.player_2: []}
-        for tile in Tile.objects.filter(game=game):
-            data[tile.player].append((tile.x_coordinate, tile.y_coordinate))
-
+        board = Board.from_game(game)
         return Node(
             player_1=game.player_1,
             player_2=game.player_2,
             maximizing_player=game.player_1 == player,
-            tiles=data,
+            board=board,
             captures_x=game.captures_x,
             captures_o=game.captures_o,
         )
 
     def find_captures_to_delete(self, tile_xy: TileXY) -> List[Tuple[TileXY, TileXY]]:
-        captures = []
-        template = 'xoox' if not self.maximizing_player else 'oxxo'
-        lines = self.lines
-        tiles = self.tiles
-
-        if template in lines[(1, tile_xy.y)]:  # Horizontal
-            if (tile_xy.x + 1, tile_xy.y) in tiles[self.player] \
-                    and (tile_xy.x + 2, tile_xy.y) in tiles[self.player] \
-                    and (tile_xy.x + 3, tile_xy.y) in tiles[self.another_player]:
-                captures.append(
-                    (TileXY(x=tile_xy.x + 1, y=tile_xy.y),
-                     TileXY(x=tile_xy.x + 2, y=tile_xy.y),)
-                )
-            if (tile_xy.x - 1, tile_xy.y) in tiles[self.player] \
-                    and (tile_xy.x - 2, tile_xy.y) in tiles[self.player] \
-                    and (tile_xy.x - 3, tile_xy.y) in tiles[self.another_player]:
-                captures.append(
-                    (TileXY(x=tile_xy.x - 1, y=tile_xy.y),
-                     TileXY(x=tile_xy.x - 2, y=tile_xy.y),)
-                )
-
-        if template in lines[(2, tile_xy.x)]:  # Vertical
-            if (tile_xy.x, tile_xy.y + 1) in tiles[self.player] \
-                    and (tile_xy.x, tile_xy.y + 2) in tiles[self.player] \
-                    and (tile_xy.x, tile_xy.y + 3) in tiles[self.another_player]:
-                captures.append(
-                    (TileXY(x=tile_xy.x, y=tile_xy.y + 1),
-                     TileXY(x=tile_xy.x, y=tile_xy.y + 2),)
-                )
-            if (tile_xy.x, tile_xy.y - 1) in tiles[self.player] \
-                    and (tile_xy.x, tile_xy.y - 2) in tiles[self.player] \
-                    and (tile_xy.x, tile_xy.y - 3) in tiles[self.another_player]:
-                captures.append(
-                    (TileXY(x=tile_xy.x, y=tile_xy.y - 1),
-                     TileXY(x=tile_xy.x, y=tile_xy.y - 2),)
-                )
-
-        if template in lines[(3, tile_xy.x - tile_xy.y)]:  # Diagonal (from up-left to down-right)
-            if (tile_xy.x + 1, tile_xy.y + 1) in tiles[self.player] \
-                    and (tile_xy.x + 2, tile_xy.y + 2) in tiles[self.player] \
-                    and (tile_xy.x + 3, tile_xy.y + 3) in tiles[self.another_player]:
-                captures.append(
-                    (TileXY(x=tile_xy.x + 1, y=tile_xy.y + 1),
-                     TileXY(x=tile_xy.x + 2, y=tile_xy.y + 2),)
-                )
-            if (tile_xy.x - 1, tile_xy.y - 1) in tiles[self.player] \
-                    and (tile_xy.x - 2, tile_xy.y - 2) in tiles[self.player] \
-                    and (tile_xy.x - 3, tile_xy.y - 3) in tiles[self.another_player]:
-                captures.append(
-                    (TileXY(x=tile_xy.x - 1, y=tile_xy.y - 1),
-                     TileXY(x=tile_xy.x - 2, y=tile_xy.y - 2),)
-                )
-
-        if template in lines[(4, tile_xy.x + tile_xy.y)]:  # Diagonal (from up-right to down-left)
-            if (tile_xy.x + 1, tile_xy.y - 1) in tiles[self.player] \
-                    and (tile_xy.x + 2, tile_xy.y - 2) in tiles[self.player] \
-                    and (tile_xy.x + 3, tile_xy.y - 3) in tiles[self.another_player]:
-                captures.append(
-                    (TileXY(x=tile_xy.x + 1, y=tile_xy.y - 1),
-                     TileXY(x=tile_xy.x + 2, y=tile_xy.y - 2),)
-                )
-            if (tile_xy.x - 1, tile_xy.y + 1) in tiles[self.player] \
-                    and (tile_xy.x - 2, tile_xy.y + 2) in tiles[self.player] \
-                    and (tile_xy.x - 3, tile_xy.y + 3) in tiles[self.another_player]:
-                captures.append(
-                    (TileXY(x=tile_xy.x - 1, y=tile_xy.y + 1),
-                     TileXY(x=tile_xy.x - 2, y=tile_xy.y + 2),)
-                )
-
-        return captures
+        return [
+            (TileXY.from_tuple(first), TileXY.from_tuple(second))
+            for first, second in self.board.find_captures(tile_xy.x, tile_xy.y, self.another_stone)
+        ]
 
     def update_from_captures(self, captures: List[Tuple[TileXY, TileXY]]):
+        self._remove_captures([
+            (first.y * self._x_size + first.x, second.y * self._x_size + second.x)
+            for first, second in captures
+        ])
+
+    def _remove_captures(self, captures: List[Tuple[int, int]]):
+        """ Takes the captured pairs, given by square indices, off the board """
+        keys = set()
         for capture in captures:
             HeuristicSimpleTreat().update_capture_value(self)
 
-            capture_0_tuple = capture[0].to_tuple()
-            capture_1_tuple = capture[1].to_tuple()
             if self.maximizing_player:
                 self.captures_o += 1
             else:
                 self.captures_x += 1
-            self.tiles[self.player].remove(capture_0_tuple)
-            self.tiles[self.player].remove(capture_1_tuple)
-            self.should_inspect.add(capture_0_tuple)
-            self.should_inspect.add(capture_1_tuple)
-            self._find_lines()
+            for captured in capture:
+                self.board.remove_square(captured)
+                self._inspect_bits |= 1 << captured
+                keys.update(line_keys(captured % self._x_size, captured // self._x_size))
+        self.board.update_lines(self.lines, keys)
+        self.line_scores.update(self.lines, keys)
+        self._fives = None
+        self._five_lines = None
 
     def __str__(self):
         return str(self.tiles)
 
     def __getitem__(self, tile):
+        if self._children is None:
+            raise KeyError(f'{tile}: the node does not keep its children, make it with keep_children')
         return self._children[tile]
 
-
-from game.rules import GameRules
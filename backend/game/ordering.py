@@ -0,0 +1,71 @@
+from collections import defaultdict
+from typing import Tuple, List, Dict, Iterator, Union
+
+from game.board import Board, X_STONE, O_STONE, CELLS, SIZE, iterate_squares
+
+
+class MoveOrdering:
+    """
+    Orders candidate moves for alpha-beta in stages: the hash move, immediate wins, blocks of the
+    opponent's fours, killer moves of the ply and then the rest by the history table.
+    Every stage is computed only when the previous one is used up, so a cutoff on an early move
+    skips the work of the later stages.
+    """
+    KILLERS_PER_PLY = 2
+
+    def __init__(self):
+        self._killers: Dict[int, List[Tuple[int, int]]] = defaultdict(list)
+        self._history = {X_STONE: [0] * CELLS, O_STONE: [0] * CELLS}
+
+    def moves(
+            self,
+            board: Board,
+            stone: str,
+            candidates: int,
+            ply: int = 0,
+            hash_move: Union[Tuple[int, int], None] = None,
+    ) -> Iterator[Tuple[int, int]]:
+        """
+        :param board: position to move in
+        :param stone: stone of the player to move
+        :param candidates: bits of the squares to try
+        :param ply: distance from the root, killers are kept per ply
+        :param hash_move: best move of the position from the transposition table
+        """
+        if hash_move is not None:
+            hash_bit = 1 << (hash_move[1] * SIZE + hash_move[0])
+            if candidates & hash_bit:
+                candidates ^= hash_bit
+                yield hash_move
+
+        another_stone = O_STONE if stone == X_STONE else X_STONE
+        for threats in (board.five_completions(stone), board.five_completions(another_stone)):
+            threats &= candidates
+            candidates ^= threats
+            for square in iterate_squares(threats):
+                yield square % SIZE, square // SIZE
+
+        for killer in self._killers[ply]:
+            killer_bit = 1 << (killer[1] * SIZE + killer[0])
+            if candidates & killer_bit:
+                candidates ^= killer_bit
+                yield killer
+
+        history = self._history[stone]
+        for square in sorted(iterate_squares(candidates), key=lambda rest_square: -history[rest_square]):
+            yield square % SIZE, square // SIZE
+
+    def cutoff(self, move: Tuple[int, int], stone: str, ply: int, depth: int):
+        """ Remembers a move which caused a beta cutoff """
+        killers = self._killers[ply]
+        if move not in killers:
+            killers.insert(0, move)
+            del killers[self.KILLERS_PER_PLY:]
+        self._history[stone][move[1] * SIZE + move[0]] += depth * depth
+
+    def new_search(self):
+        self._killers.clear()
+
+    def clear(self):
+        self._killers.clear()
+        self._history = {X_STONE: [0] * CELLS, O_STONE: [0] * CELLS}
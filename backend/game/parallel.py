@@ -0,0 +1,262 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import count
+from multiprocessing import Array
+from queue import Queue
+from threading import Lock
+from time import time
+from typing import Tuple, List, NamedTuple, Union, TYPE_CHECKING
+
+from django.conf import settings
+
+from game.algorithm import Minimax
+from game.batch import BatchLeafEvaluator
+from game.board import Board
+from game.heuristics import HeuristicSimpleTreat
+from game.internal_types import SearchTimeout
+from game.ordering import MoveOrdering
+from game.position import Position
+from game.transposition import TranspositionTable, EXACT
+
+if TYPE_CHECKING:
+    from multiprocessing.sharedctypes import SynchronizedArray
+
+
+BOUND_SLOTS = 64  # searches which can run on the pool at the same time
+WORKER_SEARCHES = 4  # searches a worker keeps its tables for, the least recent one is dropped
+
+
+class Snapshot(NamedTuple):
+    """ What a worker needs to rebuild the root position """
+    player_1: str
+    player_2: str
+    maximizing_player: bool
+    board: Board
+    captures_x: int
+    captures_o: int
+    capture_value: int
+
+    @staticmethod
+    def from_position(position: Position) -> 'Snapshot':
+        return Snapshot(
+            player_1=position.player_1,
+            player_2=position.player_2,
+            maximizing_player=position.maximizing_player,
+            board=position.board.copy(),
+            captures_x=position.captures_x,
+            captures_o=position.captures_o,
+            capture_value=position.capture_value,
+        )
+
+    def position(self) -> Position:
+        return Position(
+            player_1=self.player_1,
+            player_2=self.player_2,
+            maximizing_player=self.maximizing_player,
+            board=self.board.copy(),
+            captures_x=self.captures_x,
+            captures_o=self.captures_o,
+            capture_value=self.capture_value,
+        )
+
+
+_pool: Union[ProcessPoolExecutor, None] = None
+_pool_lock = Lock()
+_bounds: Union['SynchronizedArray', None] = None
+_free_slots: 'Queue[int]' = Queue()
+_search_ids = count()
+
+_worker_bounds: Union['SynchronizedArray', None] = None
+_worker_searches: 'OrderedDict[int, Minimax]' = OrderedDict()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """ One pool per process, started by the first parallel search """
+    global _pool, _bounds
+    with _pool_lock:
+        if _pool is None:
+            _bounds = Array('d', BOUND_SLOTS)
+            for slot in range(BOUND_SLOTS):
+                _free_slots.put(slot)
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.GOMOKU_SEARCH_MAX_WORKERS,
+                initializer=_init_worker,
+                initargs=(_bounds,),
+            )
+    return _pool
+
+
+def _init_worker(bounds: 'SynchronizedArray'):
+    global _worker_bounds
+    _worker_bounds = bounds
+
+
+def _worker_minimax(search_id: int) -> Minimax:
+    """
+    The worker's engine for the search, so its tables live on from one root move and iteration to
+    the next. Every search starts with empty tables: stored values depend on the root's captures,
+    and the pool serves the searches of all the games.
+    """
+    minimax = _worker_searches.pop(search_id, None)
+    if minimax is None:
+        minimax = Minimax(
+            HeuristicSimpleTreat(),
+            transposition_table=TranspositionTable(),
+            move_ordering=MoveOrdering(),
+            batch_evaluator=BatchLeafEvaluator(),
+        )
+    _worker_searches[search_id] = minimax
+    while len(_worker_searches) > WORKER_SEARCHES:
+        _worker_searches.popitem(last=False)
+    return minimax
+
+
+def _search_root_move(
+        search_id: int,
+        slot: int,
+        snapshot: Snapshot,
+        move: Tuple[int, int],
+        depth: int,
+        deadline: Union[float, None],
+) -> Union[float, None]:
+    """
+    Value of the root move, or None if it is illegal or worse than the best move found so far.
+    The best value is read from the shared slot before the search and written back after it.
+    """
+    position = snapshot.position()
+    maximizing_player = position.maximizing_player
+    if not position.play(move):
+        return None
+
+    minimax = _worker_minimax(search_id)
+    bound = _worker_bounds[slot]
+    if maximizing_player:
+        alpha, beta = bound - 1, minimax.heuristic.beta_max
+    else:
+        alpha, beta = minimax.heuristic.alpha_min, bound + 1
+
+    minimax.deadline = deadline
+    try:
+        value = minimax.principal_variation_search(position, depth - 1, alpha, beta)[0]
+    finally:
+        minimax.deadline = None
+    if value <= alpha or value >= beta:
+        return None
+
+    with _worker_bounds.get_lock():
+        best_value = _worker_bounds[slot]
+        if maximizing_player and value > best_value or not maximizing_player and value < best_value:
+            _worker_bounds[slot] = value
+    return value
+
+
+class ParallelMinimax:
+    """
+    Splits the root moves of the search over a pool of processes. The first move (the best one of
+    the previous iteration) is searched alone to get a bound, the rest go to the workers in the
+    serial order and every worker starts with the best value any of them has found so far.
+    A worker's window is one wider than that bound, so a move as good as the best one still gets
+    its exact value and ties go to the earlier move: the chosen move is the serial one.
+    """
+    def __init__(self, minimax: Minimax, workers: int):
+        """
+        :param minimax: orders the root moves, its transposition table keeps the best root move
+        :param workers: most root moves searched at the same time by this search
+        """
+        self.minimax = minimax
+        self.workers = workers
+        self.search_id = next(_search_ids)  # the workers' tables belong to it, make a ParallelMinimax per search
+
+    def search(
+            self,
+            position: Position,
+            depth: int,
+            deadline: Union[float, None] = None,
+    ) -> Tuple[float, Union[Tuple[int, int], None]]:
+        """ Same value and move as Minimax.calculate_minimax_in_place with the full window """
+        heuristic = self.minimax.heuristic
+        maximizing_player = position.maximizing_player
+        best_value = heuristic.alpha_min if maximizing_player else heuristic.beta_max
+        best_index: Union[int, None] = None
+        moves = self._root_moves(position)
+        snapshot = Snapshot.from_position(position)
+
+        pool = _get_pool()
+        slot = _free_slots.get()
+        _bounds[slot] = best_value + 1 if maximizing_player else best_value - 1
+        pending = {}
+        next_index = 0
+        has_bound = False
+        try:
+            while next_index < len(moves) or pending:
+                limit = self.workers if has_bound else 1
+                while next_index < len(moves) and len(pending) < limit:
+                    future = pool.submit(
+                        _search_root_move, self.search_id, slot, snapshot, moves[next_index], depth, deadline,
+                    )
+                    pending[future] = next_index
+                    next_index += 1
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = pending.pop(future)
+                    value = future.result()
+                    has_bound = True
+                    if value is None:
+                        continue
+                    if maximizing_player and value > best_value or not maximizing_player and value < best_value \
+                            or value == best_value and index < best_index:
+                        best_value, best_index = value, index
+        finally:
+            for future in pending:
+                future.cancel()
+            wait(pending)  # the slot is free only when no worker can write to it anymore
+            _free_slots.put(slot)
+
+        chosen_move = moves[best_index] if best_index is not None else None
+        if self.minimax.transposition_table is not None:
+            self.minimax.transposition_table.store(position.key, depth, EXACT, best_value, chosen_move)
+        return best_value, chosen_move
+
+    def iterative_deepening(
+            self,
+            position: Position,
+            time_limit: float,
+            max_depth: int,
+    ) -> Tuple[float, Union[Tuple[int, int], None], int]:
+        """
+        Same as Minimax.iterative_deepening with every iteration split over the pool. The workers
+        don't return their lines, the principal variation left in `minimax` is the chosen move only.
+        """
+        deadline = time() + time_limit
+        self.minimax.principal_variation = []
+        if self.minimax.transposition_table is not None:
+            self.minimax.transposition_table.new_search()
+        if self.minimax.move_ordering:
+            self.minimax.move_ordering.new_search()
+        value, chosen_move, completed_depth = self.minimax.heuristic.alpha_min, None, 0
+
+        for depth in range(1, max_depth + 1):
+            try:
+                value, chosen_move = self.search(position, depth, deadline if depth > 1 else None)
+            except SearchTimeout:
+                break
+            completed_depth = depth
+            self.minimax.principal_variation = [chosen_move] if chosen_move is not None else []
+            if chosen_move is None or time() > deadline:
+                break
+
+        return value, chosen_move, completed_depth
+
+    def _root_moves(self, position: Position) -> List[Tuple[int, int]]:
+        hash_move = None
+        if self.minimax.transposition_table is not None:
+            entry = self.minimax.transposition_table.get(position.key)
+            if entry is not None:
+                hash_move = entry.move
+
+        if self.minimax.move_ordering:
+            return list(self.minimax.move_ordering.moves(
+                position.board, position.stone, position.candidates, position.ply, hash_move,
+            ))
+        return list(Minimax._moves(position, hash_move))
@@ -0,0 +1,36 @@
+from typing import Sequence, List
+
+
+WINDOW_SIZE = 7
+TABLE_SIZE = 1 << (2 * WINDOW_SIZE)
+
+_CELL_CODES = {'-': 0, 'x': 1, 'o': 2}  # 3 is a square outside of the line
+_WINDOW_MASK = TABLE_SIZE - 1
+
+
+def window_codes(line: str) -> List[int]:
+    """
+    Code of the window of 7 squares which starts on every square of the line: 2 bits per square,
+    the first square in the lowest bits, squares after the end of the line are all ones.
+    """
+    codes = [0] * len(line)
+    code = _WINDOW_MASK
+    for position in range(len(line) - 1, -1, -1):
+        code = ((code << 2) | _CELL_CODES[line[position]]) & _WINDOW_MASK
+        codes[position] = code
+    return codes
+
+
+def first_match_table(templates: Sequence[str]) -> List[int]:
+    """
+    For every window code: index of the first template the window starts with, or -1.
+    This is what `re.findall('(?=(t0|t1|...))', line)` finds on each position of the line.
+    """
+    table = [-1] * TABLE_SIZE
+    for index in range(len(templates) - 1, -1, -1):
+        template = templates[index]
+        assert len(template) <= WINDOW_SIZE
+        prefix = sum(_CELL_CODES[cell] << (2 * position) for position, cell in enumerate(template))
+        for suffix in range(1 << (2 * (WINDOW_SIZE - len(template)))):
+            table[prefix | suffix << (2 * len(template))] = index
+    return table
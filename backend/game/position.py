@@ -0,0 +1,229 @@
+from typing import Tuple, List, Dict, Set, Iterable, Iterator, NamedTuple, TYPE_CHECKING
+
+from game.board import (
+    Board, X_STONE, O_STONE, SIZE, line_keys, neighbourhood, iterate_coordinates,
+    ZOBRIST_CAPTURES_X, ZOBRIST_CAPTURES_O, ZOBRIST_MAXIMIZING_PLAYER,
+)
+from game.heuristics import HeuristicSimpleTreat, LineScore
+from game.rules import GameRules
+
+
+if TYPE_CHECKING:
+    from game.models import Game
+    from game.node import Node
+
+
+class Move(NamedTuple):
+    tile: Tuple[int, int]
+    captures: List[Tuple[int, int]]  # squares of the captured pairs
+    capture_value: int
+    touched_bits: int
+    new_move: Tuple[int, int]
+    line_keys: Set[Tuple[int, int]]
+    line_scores: List[Tuple[Tuple[int, int], LineScore]]
+    fives: List[Tuple[Tuple[int, int], int]]
+
+
+class Position:
+    """
+    Single mutable position for the search: `play` puts a stone (with captures) in place and
+    `undo` takes it back, so the search doesn't allocate a Node per child.
+    Exposes the same attributes as Node, so heuristics and rules work with both.
+    """
+    def __init__(
+            self,
+            player_1: str,
+            player_2: str,
+            maximizing_player: bool,
+            board: Board,
+            captures_x: int = 0,
+            captures_o: int = 0,
+            capture_value: int = 0,
+    ):
+        self.player_1 = player_1
+        self.player_2 = player_2
+        self.maximizing_player = maximizing_player
+        self.board = board
+        self.captures_x = captures_x
+        self.captures_o = captures_o
+        self.capture_value = capture_value
+        self.new_move = None
+        self.heuristic_value = None
+
+        self._touched_bits = board.occupied
+        self._history: List[Move] = []
+        self._lines = board.lines()
+        self.line_scores = HeuristicSimpleTreat().line_scores(self._lines)
+        self._line_fives: Dict[Tuple[int, int], int] = {}
+        self._x_fives = self._o_fives = 0
+        self._update_fives(self._lines)
+
+    @property
+    def stone(self) -> str:
+        return X_STONE if self.maximizing_player else O_STONE
+
+    @property
+    def key(self) -> int:
+        """ Zobrist hash of the stones, both capture counters and the side to move """
+        key = self.board.key ^ ZOBRIST_CAPTURES_X[self.captures_x] ^ ZOBRIST_CAPTURES_O[self.captures_o]
+        return key ^ ZOBRIST_MAXIMIZING_PLAYER if self.maximizing_player else key
+
+    @property
+    def lines(self) -> Dict[Tuple[int, int], str]:
+        return self._lines
+
+    @property
+    def fives(self) -> Tuple[bool, bool]:
+        """ Whether x and o have five in a row, kept up to date on the lines every move touches """
+        return self._x_fives > 0, self._o_fives > 0
+
+    @property
+    def ply(self) -> int:
+        return len(self._history)
+
+    @property
+    def candidates(self) -> int:
+        """ Bits of the empty squares around every stone played so far """
+        return neighbourhood(self._touched_bits) & ~self.board.occupied
+
+    def moves(self) -> Iterator[Tuple[int, int]]:
+        return iterate_coordinates(self.candidates)
+
+    def play(self, tile: Tuple[int, int]) -> bool:
+        """ Returns False and keeps the position unchanged if the square is taken or the move makes a double three """
+        x, y = tile
+        stone = self.stone
+        board = self.board
+        square = y * SIZE + x
+        if board.occupied >> square & 1 or GameRules().makes_double_three(board, x, y, stone):
+            return False
+
+        board.place_square(square, stone)
+        captures = board.capture_pairs(square, stone)
+        capture_value = self.capture_value
+        touched_bits = self._touched_bits
+        new_move = self.new_move
+
+        self._touched_bits |= 1 << square
+        self.maximizing_player = not self.maximizing_player
+        self.new_move = tile
+
+        move_keys = line_keys(x, y)
+        keys = set(move_keys)
+        for capture in captures:
+            HeuristicSimpleTreat().update_capture_value(self)
+            if self.maximizing_player:
+                self.captures_o += 1
+            else:
+                self.captures_x += 1
+            for captured in capture:
+                board.remove_square(captured)
+                keys.update(line_keys(captured % SIZE, captured // SIZE))
+
+        board.update_lines(self._lines, keys)
+        self._history.append(Move(
+            tile=tile,
+            captures=captures,
+            capture_value=capture_value,
+            touched_bits=touched_bits,
+            new_move=new_move,
+            line_keys=keys,
+            line_scores=self.line_scores.update(self._lines, keys),
+            fives=self._update_fives(keys, move_keys, stone),
+        ))
+        return True
+
+    def undo(self):
+        move = self._history.pop()
+        board = self.board
+        self.maximizing_player = not self.maximizing_player
+        victim = O_STONE if self.maximizing_player else X_STONE
+
+        for capture in move.captures:
+            if self.maximizing_player:
+                self.captures_x -= 1
+            else:
+                self.captures_o -= 1
+            for captured in capture:
+                board.place_square(captured, victim)
+
+        board.remove(move.tile[0], move.tile[1])
+        board.update_lines(self._lines, move.line_keys)
+        self.line_scores.restore(move.line_scores)
+        for key, fives in reversed(move.fives):
+            self._replace_fives(key, fives)
+        self.capture_value = move.capture_value
+        self._touched_bits = move.touched_bits
+        self.new_move = move.new_move
+
+    def _update_fives(
+            self,
+            keys: Iterable[Tuple[int, int]],
+            move_keys: Iterable[Tuple[int, int]] = (),
+            stone: str = None,
+    ) -> List[Tuple[Tuple[int, int], int]]:
+        """
+        Checks the lines for fives and returns the old state of the changed ones for `undo`. After a move
+        only `stone` can get a new five and only on `move_keys`, the lines through it: the other touched
+        lines lost stones to captures, so only the fives they had are checked again.
+        """
+        lines = self._lines
+        line_fives = self._line_fives
+        old_fives = []
+        rules = GameRules()
+        if stone is None or line_fives:
+            count_fives = rules.line_fives
+            for key in keys:
+                if stone is None or key in line_fives:
+                    line = lines.get(key)
+                    old_fives.append((key, self._replace_fives(key, count_fives(line) if line else 0)))
+
+        if stone is not None:
+            template, bit = (rules.X_WIN_TEMPLATE, 1) if stone == X_STONE else (rules.O_WIN_TEMPLATE, 2)
+            for key in move_keys:
+                if template in lines[key]:
+                    fives = line_fives.get(key, 0)
+                    if not fives & bit:
+                        old_fives.append((key, self._replace_fives(key, fives | bit)))
+        return old_fives
+
+    def _replace_fives(self, key: Tuple[int, int], fives: int) -> int:
+        old_fives = self._line_fives.get(key, 0)
+        if old_fives == fives:
+            return old_fives
+        if fives:
+            self._line_fives[key] = fives
+        else:
+            del self._line_fives[key]
+        self._x_fives += (fives & 1) - (old_fives & 1)
+        self._o_fives += (fives >> 1) - (old_fives >> 1)
+        return old_fives
+
+    def rewind(self, ply: int):
+        """ Undo moves until only `ply` of them are left, e.g. after an aborted search """
+        while len(self._history) > ply:
+            self.undo()
+
+    @staticmethod
+    def from_node(node: 'Node') -> 'Position':
+        return Position(
+            player_1=node.player_1,
+            player_2=node.player_2,
+            maximizing_player=node.maximizing_player,
+            board=node.board.copy(),
+            captures_x=node.captures_x,
+            captures_o=node.captures_o,
+            capture_value=node.capture_value,
+        )
+
+    @staticmethod
+    def from_game(game: 'Game', player: str) -> 'Position':
+        board = Board.from_game(game)
+        return Position(
+            player_1=game.player_1,
+            player_2=game.player_2,
+            maximizing_player=game.player_1 == player,
+            board=board,
+            captures_x=game.captures_x,
+            captures_o=game.captures_o,
+        )
@@ -1,12 +1,14 @@
-import re
-from typing import Union, TYPE_CHECKING
+from typing import Union, Tuple, Dict, Iterator, TYPE_CHECKING
 
 from singleton_decorator import singleton
 
-from game.node import Node
+from game.board import Board, X_STONE, O_STONE, SIZE, line_keys, iterate_squares
+from game.patterns import window_codes, first_match_table
 
 
 if TYPE_CHECKING:
+    from game.node import Node
+    from game.position import Position
     from game.internal_types import TileXY
 
 
@@ -30,40 +32,64 @@ class GameRules:
         '-xx-x-',
     )
 
+    OPEN_THREES_CACHE_SIZE = 1 << 18
+
     def __init__(self):
-        self.pattern_x = re.compile(f'(?=({"|".join([treat for treat in self.x_open_threes])}))')
-        self.pattern_o = re.compile(f'(?=({"|".join([treat for treat in self.o_open_threes])}))')
+        x_matches = first_match_table(self.x_open_threes)
+        o_matches = first_match_table(self.o_open_threes)
+        self.x_open_three_windows = [int(match >= 0) for match in x_matches]
+        self.o_open_three_windows = [int(match >= 0) for match in o_matches]
+        self._open_threes_cache: Dict[str, Tuple[int, int]] = {}
+
+    def count_open_threes(self, line: str) -> Tuple[int, int]:
+        """ Amount of open threes of x and of o which start on the squares of the line """
+        cached = self._open_threes_cache.get(line)
+        if cached is not None:
+            return cached
+
+        x_windows = self.x_open_three_windows
+        o_windows = self.o_open_three_windows
+        codes = window_codes(line)
+        open_threes = (sum(x_windows[code] for code in codes), sum(o_windows[code] for code in codes))
+
+        if len(self._open_threes_cache) >= self.OPEN_THREES_CACHE_SIZE:
+            self._open_threes_cache.clear()
+        self._open_threes_cache[line] = open_threes
+        return open_threes
 
     @staticmethod
     def _win_by_captures(node):
-        if node.captures_x == 5:
+        if node.captures_x >= 5:
             return node.player_1
-        elif node.captures_o == 5:
+        elif node.captures_o >= 5:
             return node.player_2
         else:
             return None
 
-    def is_terminated(self, node: Node) -> Union[str, None]:
+    def line_fives(self, line: str) -> int:
+        """ 1 if x has five in a row on the line, plus 2 if o has """
+        return (self.X_WIN_TEMPLATE in line) | (self.O_WIN_TEMPLATE in line) << 1
+
+    def is_terminated(self, node: Union['Node', 'Position']) -> Union[str, None]:
         win_by_captures = self._win_by_captures(node)
         if win_by_captures:
             return win_by_captures
 
-        winners = set()
-        for line_key, line in node.lines.items():
-            if self.X_WIN_TEMPLATE in line:
-                winners.add(node.player_1)
-            if self.O_WIN_TEMPLATE in line:
-                winners.add(node.player_2)
-
-        if len(winners) == 1:
-            return list(winners)[0]
-        elif len(winners) > 1:
-            print(winners)
+        x_five, o_five = node.fives
+        if x_five and o_five:
             return DRAW
+        elif x_five:
+            return node.player_1
+        elif o_five:
+            return node.player_2
         else:
             return None
 
-    def deeper_winner_check(self, node: Node):
+    def deeper_winner_check(self, node: Union['Node', 'Position']):
+        """
+        The winner of the position, unless the player to move can break the five: only a capture can,
+        so only the capturing moves are tried
+        """
         supposed_winner = self.is_terminated(node)
         if not supposed_winner:
             return supposed_winner
@@ -72,18 +98,68 @@ class GameRules:
         if win_by_captures:
             return win_by_captures
 
-        for child in node.children():
-            winner_check = self.is_terminated(child)
+        for winner_check in self._capture_results(node):
             if winner_check != supposed_winner and winner_check != DRAW:
                 return winner_check
         return supposed_winner
 
-    @staticmethod
-    def check_open_threes(node: Node, tile: 'TileXY') -> bool:
-        child_node = node.create_child_with_new_tile(tile.to_tuple())
-
-        if not child_node:
+    def _capture_results(self, node: Union['Node', 'Position']) -> Iterator[Union[str, None]]:
+        """
+        is_terminated of the positions after the legal captures of the player to move which take a stone
+        off a line with a five or win by the fifth pair. The other captures can't change the winner.
+        The captures are played on the board and taken back, no child is built.
+        """
+        board = node.board
+        stone = node.stone
+        victim = O_STONE if stone == X_STONE else X_STONE
+        player = node.player_1 if stone == X_STONE else node.player_2
+        captures = node.captures_x if stone == X_STONE else node.captures_o
+        five_keys = {key for key, line in node.lines.items() if self.line_fives(line)}
+
+        for square in iterate_squares(board.capture_squares(stone)):
+            x, y = square % SIZE, square // SIZE
+            pairs = board.capture_pairs(square, stone)
+            breaks_five = any(
+                key in five_keys
+                for pair in pairs
+                for captured in pair
+                for key in line_keys(captured % SIZE, captured // SIZE)
+            )
+            if not breaks_five and captures + len(pairs) < 5 or self.makes_double_three(board, x, y, stone):
+                continue
+            if captures + len(pairs) >= 5:
+                yield player
+                continue
+
+            board.place_square(square, stone)
+            for pair in pairs:
+                for captured in pair:
+                    board.remove_square(captured)
+            fives = 0
+            for key in five_keys.union(line_keys(x, y)):
+                fives |= self.line_fives(board.line(key))
+            for pair in pairs:
+                for captured in pair:
+                    board.place_square(captured, victim)
+            board.remove_square(square)
+
+            if fives == 3:
+                yield DRAW
+            else:
+                yield node.player_1 if fives == 1 else node.player_2 if fives == 2 else None
+
+    def makes_double_three(self, board: Board, x: int, y: int, stone: str) -> bool:
+        """ Whether `stone` on the empty square makes two new open threes. Only the 4 lines through it can change """
+        if not board.is_empty(x, y):
             return False
-        return True
-
-
+        player_index = 0 if stone == X_STONE else 1
+        keys = line_keys(x, y)
+        before = sum(self.count_open_threes(board.line(key))[player_index] for key in keys)
+        board.place(x, y, stone)
+        after = sum(self.count_open_threes(board.line(key))[player_index] for key in keys)
+        board.remove(x, y)
+        return after - before > 1
+
+    def check_open_threes(self, board: Board, tile: 'TileXY', stone: str) -> bool:
+        """ Whether the tile is allowed by the double three rule """
+        return not self.makes_double_three(board, tile.x, tile.y, stone)
@@ -1,8 +1,9 @@
+from django.conf import settings
 from rest_framework import serializers
-from rest_framework.validators import UniqueTogetherValidator
 
 from game.models import Game, Tile
 from game.internal_types import GameType
+from game.states import GameStates
 
 
 class GameSerializer(serializers.ModelSerializer):
@@ -27,36 +28,31 @@ class GameSerializer(serializers.ModelSerializer):
 class TileSerializer(serializers.ModelSerializer):
     x_coordinate = serializers.IntegerField(min_value=0, max_value=18)
     y_coordinate = serializers.IntegerField(min_value=0, max_value=18)
-    game_id = serializers.IntegerField()
+    game_id = serializers.PrimaryKeyRelatedField(source='game', queryset=Game.objects.select_for_update())
 
     class Meta:
         model = Tile
         fields = ('x_coordinate', 'y_coordinate', 'game_id', 'player')
-        validators = [
-            UniqueTogetherValidator(
-                queryset=Tile.objects.all(),
-                fields=('x_coordinate', 'y_coordinate', 'game_id')
-            )
-        ]
+        validators = []  # the square is checked on the game state, the unique index guards the rest
 
     def validate(self, attrs):
-        game = Game.objects.filter(pk=attrs['game_id']).get()
+        """ Validate inside a transaction: the game row stays locked until the tile is written """
+        game = attrs['game']
         if attrs['player'] != game.player_1 and attrs['player'] != game.player_2:
             raise serializers.ValidationError("No such player")
+        if not GameStates().get(game).has(attrs['x_coordinate'], attrs['y_coordinate'], None):
+            raise serializers.ValidationError("The square is taken")
         return attrs
 
-    @staticmethod
-    def validate_game_id(game_id):
-        try:
-            Game.objects.filter(pk=game_id).get()
-        except Game.DoesNotExist:
-            raise serializers.ValidationError("Game not found")
-        return game_id
-
 
-class NextMoveSerializer(serializers.Serializer):
+class SearchRequestSerializer(serializers.Serializer):
     game = serializers.PrimaryKeyRelatedField(queryset=Game.objects.all())
     player = serializers.CharField()
+    time_limit = serializers.FloatField(
+        min_value=0.01,
+        max_value=settings.GOMOKU_SEARCH_TIME_LIMIT,
+        default=settings.GOMOKU_SEARCH_TIME_LIMIT,
+    )
 
     def validate(self, attrs):
         game = attrs["game"]
@@ -64,3 +60,12 @@ class NextMoveSerializer(serializers.Serializer):
         if player != game.player_1 and player != game.player_2:
             raise serializers.ValidationError(f"No such player '{player}'")
         return attrs
+
+
+class NextMoveSerializer(SearchRequestSerializer):
+    workers = serializers.IntegerField(
+        min_value=1,
+        max_value=settings.GOMOKU_SEARCH_MAX_WORKERS,
+        default=1,
+    )
+    ponder = serializers.BooleanField(default=False)
@@ -0,0 +1,337 @@
+from collections import OrderedDict
+from queue import Queue, Empty
+from threading import Event, Lock, Thread
+from time import time
+from typing import Tuple, List, Dict, Callable, Iterator, NamedTuple, Union
+
+from django.conf import settings
+from singleton_decorator import singleton
+
+from game.algorithm import Minimax
+from game.batch import BatchLeafEvaluator
+from game.book import get_opening_book
+from game.heuristics import HeuristicSimpleTreat
+from game.ordering import MoveOrdering
+from game.parallel import ParallelMinimax
+from game.position import Position
+from game.threats import ThreatSpaceSearch
+from game.transposition import TranspositionTable
+
+
+Move = Tuple[int, int]
+
+STREAM_KEEPALIVE = 1.0  # seconds `EngineSession.stream` waits for an iteration before it yields None
+
+
+class Iteration(NamedTuple):
+    """ Result of one completed iteration of a search """
+    value: float
+    move: Union[Move, None]
+    depth: int
+    nodes: int
+    principal_variation: List[Move]
+
+
+class EngineSession:
+    """
+    Search state of one game kept between next_move calls: the transposition table, the history of
+    the move ordering and the principal variation. When the opponent answers with the move the last
+    search expected, the next search starts from the rest of that variation.
+    Only one search at a time may use a session, hold `lock` around `search`.
+
+    While the opponent thinks, the session can ponder: search the position after the expected answer
+    in a background thread with the same tables, until it is stopped or its time is over. Starting
+    and stopping the pondering hold `_ponder_lock`, so one request at a time changes it.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.last_used = time()
+        self.minimax = Minimax(
+            HeuristicSimpleTreat(),
+            transposition_table=TranspositionTable(),
+            move_ordering=MoveOrdering(),
+            batch_evaluator=BatchLeafEvaluator(),
+        )
+        self._continuations: Dict[int, List[Move]] = {}
+        self._captures: Union[Tuple[int, int], None] = None
+        self._ponder_lock = Lock()
+        self._ponder_thread: Union[Thread, None] = None
+        self._ponder_key: Union[int, None] = None
+        self._ponder_cancelled: Union[Event, None] = None
+        self._ponder_result: Union[Tuple[float, Union[Move, None], int], None] = None
+        self._ponder_time = 0.0
+
+    def search(
+            self,
+            position: Position,
+            time_limit: float,
+            max_depth: int,
+            workers: int = 1,
+            on_iteration: Callable[[Iteration], None] = None,
+            cancelled: Event = None,
+    ) -> Tuple[float, Union[Move, None], int]:
+        """
+        Minimax.iterative_deepening on the position with everything the earlier searches left.
+        `on_iteration` gets every completed iteration and `cancelled` stops a serial search.
+        """
+        captures = (position.captures_x, position.captures_o)
+        if captures != self._captures:
+            # capture values are counted from the root, the stored ones are off by the new captures
+            self.minimax.transposition_table.clear()
+            self._continuations = {}
+            self._captures = captures
+
+        expected_line = self._continuations.get(position.key, [])
+        if workers > 1:
+            value, move, depth = ParallelMinimax(self.minimax, workers).iterative_deepening(
+                position, time_limit, max_depth,
+            )
+            self._continuations = {}
+        else:
+            def report(value: float, depth: int, principal_variation: List[Move]):
+                on_iteration(Iteration(
+                    value, principal_variation[0] if principal_variation else None, depth,
+                    self.minimax.node_count, principal_variation,
+                ))
+
+            value, move, depth = self.minimax.iterative_deepening(
+                position,
+                time_limit,
+                max_depth,
+                expected_line,
+                on_iteration=report if on_iteration is not None else None,
+                cancelled=cancelled,
+            )
+            self._continuations = self._find_continuations(position, self.minimax.principal_variation)
+        return value, move, depth
+
+    def find_move(
+            self,
+            position: Position,
+            time_limit: float,
+            workers: int = 1,
+            on_iteration: Callable[[Iteration], None] = None,
+            cancelled: Event = None,
+    ) -> Tuple[float, Union[Move, None], int, List[Move]]:
+        """
+        Value, move, depth and the expected line from the opening book, the threat search or `search`.
+        `on_iteration` gets the iterations of the search, or the book move or the forced win as one.
+        """
+        start_time = time()
+        heuristic = HeuristicSimpleTreat()
+
+        opening_book = get_opening_book()
+        book_move = opening_book.move(position) if opening_book is not None else None
+        if book_move is not None:
+            value = heuristic.calculate(position)
+            if on_iteration is not None:
+                on_iteration(Iteration(value, book_move, 0, 0, [book_move]))
+            return value, book_move, 0, [book_move]
+
+        winning_line = ThreatSpaceSearch().solve(
+            position,
+            settings.GOMOKU_THREAT_SEARCH_MAX_DEPTH,
+            settings.GOMOKU_THREAT_SEARCH_MAX_THREE_DEPTH,
+            time_limit * settings.GOMOKU_THREAT_SEARCH_TIME_SHARE,
+        )
+        if winning_line:
+            value = heuristic.beta_max if position.maximizing_player else heuristic.alpha_min
+            if on_iteration is not None:
+                on_iteration(Iteration(value, winning_line[0], len(winning_line), 0, winning_line))
+            return value, winning_line[0], len(winning_line), winning_line
+
+        with self.lock:
+            value, chosen_move, depth = self.search(
+                position,
+                max(time_limit - (time() - start_time), 0),
+                settings.GOMOKU_SEARCH_MAX_DEPTH,
+                workers,
+                on_iteration,
+                cancelled,
+            )
+            return value, chosen_move, depth, list(self.minimax.principal_variation)
+
+    def stream(self, position: Position, time_limit: float) -> Iterator[Union[Iteration, None]]:
+        """
+        Runs `find_move` in a thread and yields its iterations as they complete, None after every
+        STREAM_KEEPALIVE seconds without one. Closing the generator cancels the search.
+        """
+        self.stop_pondering()
+        iterations: 'Queue[Union[Iteration, None]]' = Queue()
+        cancelled = Event()  # only this stream's search: other searches of the session go on
+        thread = Thread(target=self._stream, args=(position, time_limit, iterations, cancelled), daemon=True)
+        thread.start()
+        try:
+            while True:
+                try:
+                    iteration = iterations.get(timeout=STREAM_KEEPALIVE)
+                except Empty:
+                    yield None
+                    continue
+                if iteration is None:
+                    return
+                yield iteration
+        finally:
+            cancelled.set()
+            thread.join()
+
+    @property
+    def pondering_key(self) -> Union[int, None]:
+        """ Key of the position the session ponders on, None if it doesn't """
+        with self._ponder_lock:
+            return self._ponder_key
+
+    def ponder(self, position: Position, expected_line: List[Move], time_limit: float, max_depth: int) -> bool:
+        """
+        Starts to search the position after the first two moves of `expected_line` - our move and
+        the expected answer - in the background. False if there is no answer to expect.
+        """
+        with self._ponder_lock:
+            self._stop_pondering()
+            return self._start_pondering(position, expected_line, time_limit, max_depth)
+
+    def _start_pondering(
+            self,
+            position: Position,
+            expected_line: List[Move],
+            time_limit: float,
+            max_depth: int,
+    ) -> bool:
+        if len(expected_line) < 2:
+            return False
+
+        pondered = Position(
+            player_1=position.player_1,
+            player_2=position.player_2,
+            maximizing_player=position.maximizing_player,
+            board=position.board.copy(),
+            captures_x=position.captures_x,
+            captures_o=position.captures_o,
+        )
+        if not pondered.play(expected_line[0]) or not pondered.play(expected_line[1]):
+            return False
+        pondered = Position(
+            player_1=position.player_1,
+            player_2=position.player_2,
+            maximizing_player=pondered.maximizing_player,
+            board=pondered.board,
+            captures_x=pondered.captures_x,
+            captures_o=pondered.captures_o,
+        )
+
+        self._ponder_key = pondered.key
+        self._ponder_cancelled = Event()  # only this pondering: stopping it must not stop another search
+        self._ponder_thread = Thread(
+            target=self._ponder, args=(pondered, time_limit, max_depth, self._ponder_cancelled), daemon=True,
+        )
+        self._ponder_thread.start()
+        return True
+
+    def stop_pondering(self, key: int = None) -> Union[Tuple[Tuple[float, Union[Move, None], int], float], None]:
+        """
+        Cancels the pondering and waits for the thread. If `key` is the pondered position, returns
+        the result of its last completed iteration and the seconds spent on it.
+        """
+        with self._ponder_lock:
+            return self._stop_pondering(key)
+
+    def _stop_pondering(self, key: int = None) -> Union[Tuple[Tuple[float, Union[Move, None], int], float], None]:
+        if self._ponder_thread is None:
+            return None
+        self._ponder_cancelled.set()
+        self._ponder_thread.join()
+
+        hit = key is not None and key == self._ponder_key and self._ponder_result is not None \
+            and self._ponder_result[2] > 0
+        result = (self._ponder_result, self._ponder_time) if hit else None
+        self._ponder_thread = None
+        self._ponder_key = None
+        self._ponder_cancelled = None
+        self._ponder_result = None
+        return result
+
+    def close(self):
+        """
+        Lets a pondering thread finish at once, without waiting for it - nor for `_ponder_lock`,
+        which a request stopping the pondering holds until the thread is done
+        """
+        cancelled = self._ponder_cancelled
+        if cancelled is not None:
+            cancelled.set()
+
+    def _ponder(self, position: Position, time_limit: float, max_depth: int, cancelled: Event):
+        start_time = time()
+        with self.lock:
+            self._ponder_result = self.search(position, time_limit, max_depth, cancelled=cancelled)
+        self._ponder_time = time() - start_time
+
+    def _stream(
+            self,
+            position: Position,
+            time_limit: float,
+            iterations: 'Queue[Union[Iteration, None]]',
+            cancelled: Event,
+    ):
+        try:
+            self.find_move(position, time_limit, on_iteration=iterations.put, cancelled=cancelled)
+        finally:
+            iterations.put(None)  # the search is over
+
+    @staticmethod
+    def _find_continuations(position: Position, principal_variation: List[Move]) -> Dict[int, List[Move]]:
+        """ Rest of the variation by the key of every position on it where the same player is to move """
+        continuations = {}
+        start_ply = position.ply
+        for played, move in enumerate(principal_variation, 1):
+            if not position.play(move):
+                break
+            if played % 2 == 0 and played < len(principal_variation):
+                continuations[position.key] = principal_variation[played:]
+        position.rewind(start_ply)
+        return continuations
+
+
+@singleton
+class EngineSessions:
+    """
+    Sessions of the games this process searches for, by game id. A session is dropped after
+    GOMOKU_SESSION_IDLE_TIMEOUT seconds without a search, the least recently used one also when
+    there are more than GOMOKU_SESSION_MAX_COUNT of them.
+    """
+    def __init__(self):
+        self._sessions: 'OrderedDict[int, EngineSession]' = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, game_id: int) -> EngineSession:
+        now = time()
+        with self._lock:
+            self._evict(now)
+            session = self._sessions.pop(game_id, None) or EngineSession()
+            session.last_used = now
+            self._sessions[game_id] = session
+            while len(self._sessions) > settings.GOMOKU_SESSION_MAX_COUNT:
+                self._sessions.popitem(last=False)[1].close()
+            return session
+
+    def find(self, game_id: int) -> Union[EngineSession, None]:
+        """ The session of the game if there is one, without creating it """
+        with self._lock:
+            return self._sessions.get(game_id)
+
+    def discard(self, game_id: int):
+        with self._lock:
+            session = self._sessions.pop(game_id, None)
+        if session is not None:
+            session.close()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _evict(self, now: float):
+        idle_timeout = settings.GOMOKU_SESSION_IDLE_TIMEOUT
+        while self._sessions:
+            game_id, session = next(iter(self._sessions.items()))
+            if now - session.last_used <= idle_timeout:
+                break
+            del self._sessions[game_id]
+            session.close()
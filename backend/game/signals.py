@@ -0,0 +1,27 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from game.models import Game, Tile
+from game.states import GameStates
+
+
+@receiver(post_save, sender=Tile)
+def check_saved_tile(sender, instance: Tile, **kwargs):
+    if not GameStates().check_tile(instance):
+        instance.game.rebuild_board()
+
+
+@receiver(post_delete, sender=Tile)
+def check_deleted_tile(sender, instance: Tile, **kwargs):
+    if not GameStates().check_tile(instance, deleted=True):
+        game = Game.objects.filter(pk=instance.game_id).first()
+        if game is not None:  # None when the tile goes with its game
+            game.rebuild_board()
+
+
+@receiver(post_save, sender=Game)
+def check_saved_game(sender, instance: Game, created: bool, **kwargs):
+    if created:
+        GameStates().discard(instance.id)  # a new game may get the id of a deleted one
+    else:
+        GameStates().check_game(instance)
@@ -0,0 +1,156 @@
+from collections import OrderedDict
+from threading import Lock, RLock
+from time import time
+from typing import Tuple, List, Dict, Union, TYPE_CHECKING
+
+from django.conf import settings
+from singleton_decorator import singleton
+
+from game.board import PackedGame, EMPTY, X_STONE, O_STONE, SIZE, iterate_squares
+from game.internal_types import TileXY
+from game.position import Position
+from game.rules import GameRules
+
+if TYPE_CHECKING:
+    from game.models import Game, Tile
+
+
+class GameState:
+    """
+    Board and capture counters of a game as they are in the database at `version`, so the views
+    don't rebuild the board from the Tile rows on every request.
+    The methods hold `lock`, hold it around them too when the database has to change with the state.
+    """
+    def __init__(self, game: 'Game'):
+        self.lock = RLock()
+        self.last_used = time()
+        self.game_id = game.id
+        self.player_1 = game.player_1
+        self.player_2 = game.player_2
+        packed = PackedGame.unpack(game.board)
+        self.board = packed.board
+        self.captures_x = packed.captures_x
+        self.captures_o = packed.captures_o
+        self.version = game.version
+
+    def stone(self, player: str) -> str:
+        return X_STONE if player == self.player_1 else O_STONE
+
+    def position(self, player: str) -> Position:
+        """ A position of its own for the search, `player` to move """
+        with self.lock:
+            return Position(
+                player_1=self.player_1,
+                player_2=self.player_2,
+                maximizing_player=player == self.player_1,
+                board=self.board.copy(),
+                captures_x=self.captures_x,
+                captures_o=self.captures_o,
+            )
+
+    def place(self, x: int, y: int, player: str) -> List[Tuple[int, int]]:
+        """ Puts the player's stone, takes the captured pairs off and returns them by square indices """
+        stone = self.stone(player)
+        square = y * SIZE + x
+        with self.lock:
+            self.board.place_square(square, stone)
+            captures = self.board.capture_pairs(square, stone)
+            for capture in captures:
+                for captured in capture:
+                    self.board.remove_square(captured)
+            if stone == X_STONE:
+                self.captures_x += len(captures)
+            else:
+                self.captures_o += len(captures)
+        return captures
+
+    def allows(self, x: int, y: int, player: str) -> bool:
+        """ Whether the player may put a stone on the square by the double three rule """
+        with self.lock:
+            return GameRules().check_open_threes(self.board, TileXY(x=x, y=y), self.stone(player))
+
+    def pack(self, x_to_move: bool) -> bytes:
+        """ The state for the `Game.board` column """
+        with self.lock:
+            return PackedGame(self.board.copy(), self.captures_x, self.captures_o, x_to_move).pack()
+
+    def has(self, x: int, y: int, player: Union[str, None]) -> bool:
+        """ Whether the square holds the player's stone, or is empty for None """
+        with self.lock:
+            return self.board.get(x, y) == (self.stone(player) if player is not None else EMPTY)
+
+    def tiles(self) -> List[Dict[str, Union[int, str]]]:
+        """ Tiles of the game in the TileSerializer format """
+        with self.lock:
+            occupied = self.board.occupied
+            cells = self.board.cells[:]
+        return [
+            {
+                'x_coordinate': square % SIZE,
+                'y_coordinate': square // SIZE,
+                'game_id': self.game_id,
+                'player': self.player_1 if cells[square] == ord(X_STONE) else self.player_2,
+            }
+            for square in iterate_squares(occupied)
+        ]
+
+
+@singleton
+class GameStates:
+    """
+    States of the games this process serves, by game id. A state is read from the database again when
+    its version is not the game's one anymore: the views change the state and then the database
+    (write-through) and raise the version with every tile. Other writes of this process drop the state
+    when a saved or deleted row doesn't match it (see `check_tile` and `check_game`).
+    A state is dropped after GOMOKU_GAME_STATE_IDLE_TIMEOUT seconds without a request, the least recently
+    used one also when there are more than GOMOKU_GAME_STATE_MAX_COUNT of them.
+    """
+    def __init__(self):
+        self._states: 'OrderedDict[int, GameState]' = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, game: 'Game') -> GameState:
+        now = time()
+        with self._lock:
+            self._evict(now)
+            state = self._states.pop(game.id, None)
+            if state is None or state.version != game.version:
+                state = GameState(game)
+            state.last_used = now
+            self._states[game.id] = state
+            while len(self._states) > settings.GOMOKU_GAME_STATE_MAX_COUNT:
+                self._states.popitem(last=False)
+            return state
+
+    def check_tile(self, tile: 'Tile', deleted: bool = False) -> bool:
+        """
+        Whether the tile was written through the game's state. If not, the state is dropped: it doesn't
+        have the saved tile or still has the deleted one.
+        """
+        state = self._states.get(tile.game_id)
+        if state is not None and state.has(tile.x_coordinate, tile.y_coordinate, None if deleted else tile.player):
+            return True
+        self.discard(tile.game_id)
+        return False
+
+    def check_game(self, game: 'Game'):
+        """ Drops the state of the game if the saved row has other players or capture counters """
+        state = self._states.get(game.id)
+        if state is not None and (state.player_1, state.player_2, state.captures_x, state.captures_o) \
+                != (game.player_1, game.player_2, game.captures_x, game.captures_o):
+            self.discard(game.id)
+
+    def discard(self, game_id: int):
+        with self._lock:
+            self._states.pop(game_id, None)
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def _evict(self, now: float):
+        idle_timeout = settings.GOMOKU_GAME_STATE_IDLE_TIMEOUT
+        while self._states:
+            game_id, state = next(iter(self._states.items()))
+            if now - state.last_used <= idle_timeout:
+                break
+            del self._states[game_id]
@@ -1,13 +1,40 @@
-from django.test import TestCase, Client
+import json
+import os
+import re
+from itertools import product
+from multiprocessing import Array
+from random import Random
+from tempfile import TemporaryDirectory
+from threading import Thread, active_count
+from time import time, sleep
+from unittest.mock import patch
+
+from django.db import connection, transaction, IntegrityError
+from django.db.models import F, QuerySet
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 
 from game.internal_types import GameType
-from game.models import Game, Tile
+from game.models import Game, Tile, SearchJob
 from game.algorithm import Minimax
 from game.node import Node
 from game.rules import GameRules
 from game.heuristics import Heuristic, HeuristicSimpleTreat
+from game.board import Board, PackedGame, PACKED_GAME_SIZE, X_STONE, O_STONE, index, iterate_coordinates
+from game.position import Position
+from game.transposition import TranspositionTable, EXACT, LOWER_BOUND
+from game.ordering import MoveOrdering
+from game.batch import BatchLeafEvaluator, ILLEGAL
+from game import parallel
+from game.parallel import ParallelMinimax, Snapshot
+from game.threats import ThreatSpaceSearch
+from game.book import OpeningBook, OpeningBookBuilder, get_opening_book
+from game.sessions import EngineSession, EngineSessions
+from game.states import GameStates
+from game.jobs import SearchJobs
+from game.analyzer import Analyzer
 
 
 class GameApiTestCase(TestCase):
@@ -160,6 +187,74 @@ class GameApiTestCase(TestCase):
         new_amount_of_tiles = Tile.objects.count()
         self.assertEqual(old_amount_of_tiles + 1, new_amount_of_tiles)
 
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Tile.objects.create(game=game, player="player_1", x_coordinate=1, y_coordinate=6)
+
+    def test_create_tile_double_three(self):
+        game = Game.objects.create(type=GameType.BOT.value, player_1="player_1", player_2="player_2")
+        for x, y in ((9, 8), (9, 7), (8, 9), (7, 9)):
+            Tile.objects.create(game=game, player="player_1", x_coordinate=x, y_coordinate=y)
+
+        request_body = {'x_coordinate': 9, 'y_coordinate': 9, 'game_id': game.id, 'player': 'player_1'}
+        response = self.client.post(reverse('tile'), request_body)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        response = self.client.post(reverse('tile'), {**request_body, 'player': 'player_2'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_create_tile_query_count(self):
+        game = Game.objects.create(type=GameType.BOT.value, player_1="player_1", player_2="player_2")
+        Tile.objects.create(game=game, player="player_1", x_coordinate=9, y_coordinate=9)
+        for x in (10, 11):
+            Tile.objects.create(game=game, player="player_2", x_coordinate=x, y_coordinate=9)
+
+        request_body = {'x_coordinate': 12, 'y_coordinate': 9, 'game_id': game.id, 'player': 'player_1'}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('tile'), request_body)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual({'x': 1, 'o': 0}, response.data['captures'])
+        statements = [query['sql'].split()[0] for query in queries]
+        self.assertEqual(['SAVEPOINT', 'SELECT', 'INSERT', 'DELETE', 'UPDATE', 'RELEASE'], statements)
+        self.assertEqual(2, Tile.objects.filter(game=game).count())
+
+    def test_next_move(self):
+        game = Game.objects.create(type=GameType.BOT.value, player_1="player_1", player_2="player_2")
+        Tile.objects.create(game=game, player="player_1", x_coordinate=9, y_coordinate=9)
+
+        response = self.client.get(
+            reverse('next_move', kwargs={'game_id': game.id, 'player': 'player_2'}),
+            {'time_limit': 0.2},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(tuple(response.data['coordinates']), Node.from_game(game, 'player_2').should_inspect)
+        self.assertGreaterEqual(response.data['depth'], 1)
+
+        response = self.client.get(
+            reverse('next_move', kwargs={'game_id': game.id, 'player': 'player_2'}),
+            {'time_limit': -1},
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(
+            reverse('next_move', kwargs={'game_id': game.id, 'player': 'player_2'}),
+            {'workers': 0},
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_next_move_forced_win(self):
+        game = Game.objects.create(type=GameType.BOT.value, player_1="player_1", player_2="player_2")
+        for x, y in ((5, 5), (6, 5), (7, 5), (8, 6), (8, 7), (8, 8)):
+            Tile.objects.create(game=game, player="player_1", x_coordinate=x, y_coordinate=y)
+        for x, y in ((4, 5), (8, 9), (12, 12), (13, 13), (0, 0), (1, 18)):
+            Tile.objects.create(game=game, player="player_2", x_coordinate=x, y_coordinate=y)
+
+        response = self.client.get(
+            reverse('next_move', kwargs={'game_id': game.id, 'player': 'player_1'}),
+            {'time_limit': 0.5},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([8, 5], list(response.data['coordinates']))
+
 
 class GameTestCase(TestCase):
     @classmethod
@@ -252,3 +347,1030 @@ class GameTestCase(TestCase):
         minimax = Minimax(HeuristicSimpleTreat(), GameRules())
         value, node = minimax.calculate_minimax(node, 1)
         # TODO: finish
+
+
+class BoardTestCase(TestCase):
+    def test_lines(self):
+        board = Board.from_tiles([(0, 0), (1, 1), (18, 0)], [(2, 2), (17, 1)])
+
+        self.assertEqual('x-----------------x', board.line((1, 0)))
+        self.assertEqual('x' + '-' * 18, board.line((2, 0)))
+        self.assertEqual('xxo' + '-' * 16, board.line((3, 0)))
+        self.assertEqual('-o' + 'x', board.line((4, 18))[-3:])
+        self.assertEqual(19, len(board.line((4, 18))))
+        self.assertEqual('x', board.line((4, 0)))
+        self.assertNotIn((1, 5), board.lines())
+
+    def test_copy_is_independent(self):
+        board = Board.from_tiles([(9, 9)], [])
+        board_copy = board.copy()
+        board_copy.place(10, 10, O_STONE)
+        board_copy.remove(9, 9)
+
+        self.assertEqual(X_STONE, board.get(9, 9))
+        self.assertTrue(board.is_empty(10, 10))
+        self.assertEqual([(10, 10)], board_copy.stones(O_STONE))
+        self.assertEqual([], board_copy.stones(X_STONE))
+
+    def test_packed_game(self):
+        board = Board.from_tiles([(0, 0), (18, 18), (9, 9)], [(18, 0), (0, 18)])
+        packed = PackedGame(board, captures_x=2, captures_o=4, x_to_move=False)
+        self.assertEqual(PACKED_GAME_SIZE, len(packed.pack()))
+        unpacked = PackedGame.unpack(packed.pack())
+        self.assertEqual(packed, unpacked)
+        self.assertEqual(board.key, unpacked.board.key)
+        self.assertEqual(board.cells, unpacked.board.cells)
+        with self.assertRaises(ValueError):
+            PackedGame.unpack(packed.pack()[:-1])
+
+    def test_game_board_column(self):
+        game = Game.objects.create(type=GameType.BOT.value, player_1="player_1", player_2="player_2")
+        self.assertEqual(Board(), Board.from_game(game))
+
+        # tiles written without the view pack the board again
+        Tile.objects.create(game=game, player="player_1", x_coordinate=9, y_coordinate=9)
+        Tile.objects.create(game=game, player="player_2", x_coordinate=9, y_coordinate=10)
+        game = Game.objects.get(pk=game.pk)
+        with CaptureQueriesContext(connection) as queries:
+            board = Board.from_game(game)
+        self.assertEqual(0, len(queries))
+        self.assertEqual(Board.from_tiles([(9, 9)], [(9, 10)]), board)
+        self.assertTrue(PackedGame.unpack(game.board).x_to_move)
+
+    def test_find_captures(self):
+        board = Board.from_tiles([(0, 0), (3, 0), (6, 3)], [(1, 0), (2, 0), (4, 1), (5, 2)])
+
+        self.assertEqual([((2, 0), (1, 0)), ((4, 1), (5, 2))], board.find_captures(3, 0, X_STONE))
+        self.assertEqual([], board.find_captures(3, 0, O_STONE))
+
+    def test_capture_pairs_match_brute_force(self):
+        random = Random(16)
+        for _ in range(20):
+            squares = random.sample(range(19 * 19), 120)
+            board = Board.from_tiles(
+                [(square % 19, square // 19) for square in squares[:60]],
+                [(square % 19, square // 19) for square in squares[60:]],
+            )
+            for square, stone in product(range(19 * 19), (X_STONE, O_STONE)):
+                x, y = square % 19, square // 19
+                victim = O_STONE if stone == X_STONE else X_STONE
+                expected = [
+                    (index(x + dx, y + dy), index(x + 2 * dx, y + 2 * dy))
+                    for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (-1, -1), (1, -1), (-1, 1))
+                    if board.get(x + dx, y + dy) == victim
+                    and board.get(x + 2 * dx, y + 2 * dy) == victim
+                    and board.get(x + 3 * dx, y + 3 * dy) == stone
+                ]
+                self.assertEqual(expected, board.capture_pairs(square, stone))
+
+
+class PositionTestCase(TestCase):
+    def test_play_and_undo_with_captures(self):
+        board = Board.from_tiles([(0, 0)], [(1, 0), (2, 0)])
+        position = Position(player_1='p1', player_2='p2', maximizing_player=True, board=board.copy())
+
+        self.assertTrue(position.play((3, 0)))
+        self.assertEqual(1, position.captures_x)
+        self.assertTrue(position.board.is_empty(1, 0))
+        self.assertTrue(position.board.is_empty(2, 0))
+        self.assertFalse(position.maximizing_player)
+
+        position.undo()
+        self.assertEqual(board, position.board)
+        self.assertEqual(0, position.captures_x)
+        self.assertEqual(0, position.capture_value)
+        self.assertTrue(position.maximizing_player)
+
+    def test_lines_are_updated_incrementally(self):
+        board = Board.from_tiles([(0, 0), (5, 5)], [(1, 0), (2, 0)])
+        position = Position(player_1='p1', player_2='p2', maximizing_player=True, board=board)
+
+        position.play((3, 0))
+        self.assertEqual(position.board.lines(), position.lines)
+        self.assertNotIn((3, 1), position.lines)
+        position.play((9, 9))
+        self.assertEqual(position.board.lines(), position.lines)
+        position.undo()
+        position.undo()
+        self.assertEqual(board.lines(), position.lines)
+
+        node = Node(player_1='p1', player_2='p2', maximizing_player=True, board=board.copy())
+        child = node.create_child_with_new_tile((3, 0))
+        self.assertEqual(child.board.lines(), child.lines)
+        self.assertEqual(board.lines(), node.lines)
+
+    def test_double_three_is_illegal(self):
+        board = Board.from_tiles([(9, 8), (9, 7), (8, 9), (7, 9)], [(0, 0)])
+        position = Position(player_1='p1', player_2='p2', maximizing_player=True, board=board)
+
+        self.assertFalse(position.play((9, 9)))
+        self.assertEqual(board, position.board)
+
+        rules = GameRules()
+        self.assertTrue(rules.makes_double_three(board, 9, 9, X_STONE))
+        self.assertFalse(rules.makes_double_three(board, 9, 9, O_STONE))
+        self.assertFalse(rules.makes_double_three(board, 9, 8, O_STONE))  # occupied
+        self.assertEqual(board, position.board)
+
+        self.assertFalse(position.play((9, 8)))
+        self.assertFalse(position.play((0, 0)))
+        self.assertEqual(board, position.board)
+
+        node = Node(player_1='p1', player_2='p2', maximizing_player=True, board=board.copy())
+        self.assertIsNone(node.create_child_with_new_tile((9, 9)))
+        self.assertIsNotNone(node.create_child_with_new_tile((10, 10)))
+
+    def test_in_place_search_matches_node_search(self):
+        tiles = {'p1': [(9, 9), (10, 9), (12, 12)], 'p2': [(10, 10), (11, 10), (11, 11)]}
+        node = Node(player_1='p1', player_2='p2', maximizing_player=True, tiles=tiles)
+        position = Position.from_node(node)
+        minimax = Minimax(HeuristicSimpleTreat())
+
+        value, chosen_node = minimax.calculate_minimax(node, 2)
+        self.assertEqual((value, chosen_node.new_move), minimax.calculate_minimax_in_place(position, 2))
+        self.assertEqual(node.board, position.board)
+
+    def test_in_place_search_matches_node_search_with_captures(self):
+        random = Random(1)
+        minimax = Minimax(HeuristicSimpleTreat())
+        for _ in range(20):
+            squares = random.sample(list(product(range(6, 13), repeat=2)), 12)
+            node = Node(
+                player_1='p1', player_2='p2', maximizing_player=True, tiles={'p1': squares[:6], 'p2': squares[6:]},
+                captures_x=random.randrange(5), captures_o=random.randrange(5),
+            )
+            position = Position.from_node(node)
+
+            value, chosen_node = minimax.calculate_minimax(node, 2)
+            self.assertEqual((value, chosen_node.new_move), minimax.calculate_minimax_in_place(position, 2))
+
+
+class NodeTreeTestCase(TestCase):
+    def test_only_the_principal_variation_is_kept(self):
+        tiles = {'p1': [(9, 9), (10, 9), (12, 12)], 'p2': [(10, 10), (11, 10), (11, 11)]}
+        node = Node(player_1='p1', player_2='p2', maximizing_player=True, tiles=tiles)
+        value, chosen_node = Minimax(HeuristicSimpleTreat()).calculate_minimax(node, 3)
+        self.assertEqual(0, node.children_amount)
+        self.assertIs(chosen_node, node.best_child)
+        self.assertEqual(3, len(node.principal_variation))
+        self.assertEqual(chosen_node.new_move, node.principal_variation[0])
+        with self.assertRaises(AttributeError):
+            node.some_attribute = None
+        with self.assertRaises(KeyError):
+            node[chosen_node.new_move]
+
+        node = Node(player_1='p1', player_2='p2', maximizing_player=True, tiles=tiles, keep_children=True)
+        kept_value, kept_node = Minimax(HeuristicSimpleTreat()).calculate_minimax(node, 3)
+        self.assertEqual((value, chosen_node.new_move), (kept_value, kept_node.new_move))
+        self.assertGreater(node.children_amount, 0)
+        self.assertTrue(node[node.chosen[0]].keep_children)
+
+
+class TerminationTestCase(TestCase):
+    def test_fives_are_kept_up_to_date(self):
+        random = Random(18)
+        rules = GameRules()
+        for _ in range(10):
+            position = Position(
+                player_1='p1', player_2='p2', maximizing_player=True, board=Board.from_tiles([(9, 9)], []),
+            )
+            for _ in range(60):
+                moves = list(position.moves())
+                if not moves or random.random() < 0.2 and position.ply:
+                    position.undo()
+                    continue
+                position.play(random.choice(moves))
+                node = Node(player_1='p1', player_2='p2', maximizing_player=True, board=position.board.copy())
+                self.assertEqual(node.fives, position.fives)
+            position.rewind(0)
+            self.assertEqual((False, False), position.fives)
+            self.assertIsNone(rules.is_terminated(position))
+
+    def test_node_fives_follow_the_father(self):
+        random = Random(3)
+        for _ in range(10):
+            node = Node(player_1='p1', player_2='p2', maximizing_player=True, board=Board.from_tiles([(9, 9)], []))
+            for _ in range(60):
+                moves = list(node.should_inspect)
+                random.shuffle(moves)
+                child = next((child for child in map(node.create_child_with_new_tile, moves) if child), None)
+                if child is None:
+                    break
+                node = child
+                scanned = Node(player_1='p1', player_2='p2', maximizing_player=True, board=node.board.copy())
+                self.assertEqual(scanned.fives, node.fives)
+
+    def test_deeper_winner_check(self):
+        x_tiles = [(5, 5), (6, 5), (7, 5), (8, 5), (9, 5)]
+        node = Node(player_1='p1', player_2='p2', maximizing_player=False, board=Board.from_tiles(x_tiles, [(4, 5)]))
+        self.assertEqual('p1', GameRules().deeper_winner_check(node))
+
+        # o can take (6, 5) and (6, 6) with (6, 4)
+        board = Board.from_tiles(x_tiles + [(6, 6)], [(4, 5), (6, 7)])
+        node = Node(player_1='p1', player_2='p2', maximizing_player=False, board=board)
+        self.assertEqual('p1', GameRules().is_terminated(node))
+        self.assertIsNone(GameRules().deeper_winner_check(node))
+
+        # far from the five, but the fifth pair of o
+        board = Board.from_tiles(x_tiles + [(12, 12), (13, 12)], [(4, 5), (11, 12)])
+        node = Node(player_1='p1', player_2='p2', maximizing_player=False, board=board, captures_o=4)
+        self.assertEqual('p2', GameRules().deeper_winner_check(node))
+        self.assertEqual(board, node.board)
+
+
+class TranspositionTestCase(TestCase):
+    def test_key_is_incremental(self):
+        position = Position(
+            player_1='p1', player_2='p2', maximizing_player=True,
+            board=Board.from_tiles([(0, 0)], [(1, 0), (2, 0)]),
+        )
+        start_key = position.key
+
+        position.play((3, 0))
+        rebuilt = Position(
+            player_1='p1', player_2='p2', maximizing_player=False,
+            board=Board.from_tiles([(0, 0), (3, 0)], []), captures_x=1,
+        )
+        self.assertEqual(rebuilt.key, position.key)
+
+        position.undo()
+        self.assertEqual(start_key, position.key)
+
+    def test_transpositions_have_same_key(self):
+        position = Position(player_1='p1', player_2='p2', maximizing_player=True, board=Board.from_tiles([(9, 9)], []))
+        position.play((5, 5))
+        position.play((7, 7))
+        position.play((6, 6))
+        position.play((8, 8))
+        key = position.key
+        for _ in range(4):
+            position.undo()
+        position.play((6, 6))
+        position.play((8, 8))
+        position.play((5, 5))
+        position.play((7, 7))
+        self.assertEqual(key, position.key)
+
+    def test_replacement_policy(self):
+        table = TranspositionTable(size_power=1)
+        table.store(key=2, depth=3, flag=EXACT, value=1, move=(1, 1))
+        table.store(key=4, depth=1, flag=EXACT, value=2, move=(2, 2))
+        self.assertIsNone(table.get(4))
+        self.assertEqual(1, table.get(2).value)
+
+        table.store(key=2, depth=0, flag=LOWER_BOUND, value=5, move=None)
+        self.assertEqual(LOWER_BOUND, table.get(2).flag)
+
+        table.new_search()
+        table.store(key=4, depth=1, flag=EXACT, value=2, move=(2, 2))
+        self.assertIsNone(table.get(2))
+        self.assertEqual((2, 2), table.get(4).move)
+
+    def test_search_with_table_matches_search_without(self):
+        tiles = {'p1': [(9, 9), (10, 9), (12, 12)], 'p2': [(10, 10), (11, 10), (11, 11)]}
+        node = Node(player_1='p1', player_2='p2', maximizing_player=True, tiles=tiles)
+
+        expected = Minimax(HeuristicSimpleTreat()).calculate_minimax_in_place(Position.from_node(node), 3)
+        minimax = Minimax(HeuristicSimpleTreat(), transposition_table=TranspositionTable())
+        self.assertEqual(expected, minimax.calculate_minimax_in_place(Position.from_node(node), 3))
+
+
+class IterativeDeepeningTestCase(TestCase):
+    def test_deadline(self):
+        tiles = {'p1': [(9, 9), (10, 9), (12, 12)], 'p2': [(10, 10), (11, 10), (11, 11)]}
+        position = Position.from_node(Node(player_1='p1', player_2='p2', maximizing_player=True, tiles=tiles))
+        board = position.board.copy()
+        minimax = Minimax(HeuristicSimpleTreat(), transposition_table=TranspositionTable())
+
+        start = time()
+        value, move, depth = minimax.iterative_deepening(position, time_limit=0.3, max_depth=20)
+        self.assertLess(time() - start, 1.5)
+        self.assertGreaterEqual(depth, 1)
+        self.assertLess(depth, 20)
+        self.assertIsNotNone(move)
+        self.assertEqual(board, position.board)
+        self.assertEqual(0, position.ply)
+
+    def test_max_depth(self):
+        tiles = {'p1': [(9, 9)], 'p2': []}
+        position = Position.from_node(Node(player_1='p1', player_2='p2', maximizing_player=False, tiles=tiles))
+        minimax = Minimax(HeuristicSimpleTreat(), transposition_table=TranspositionTable())
+
+        value, move, depth = minimax.iterative_deepening(position, time_limit=30, max_depth=2)
+        self.assertEqual(2, depth)
+        self.assertEqual((value, move), Minimax(HeuristicSimpleTreat()).calculate_minimax_in_place(position, 2))
+
+
+class PrincipalVariationSearchTestCase(TestCase):
+    def test_same_value_as_minimax(self):
+        board = Board.from_tiles([(9, 9), (10, 9), (10, 11), (7, 9)], [(8, 9), (10, 10), (11, 10), (9, 11)])
+        for maximizing_player, depth in product((True, False), (1, 2, 3)):
+            position = Position(player_1='p1', player_2='p2', maximizing_player=maximizing_player, board=board.copy())
+            value, move = Minimax(HeuristicSimpleTreat()).calculate_minimax_in_place(position, depth)
+            pvs_value, principal_variation = Minimax(
+                HeuristicSimpleTreat(), transposition_table=TranspositionTable(), move_ordering=MoveOrdering(),
+            ).principal_variation_search(position, depth)
+            self.assertEqual(value, pvs_value)
+            self.assertEqual(depth, len(principal_variation))
+
+            for pv_move in principal_variation:
+                self.assertTrue(position.play(pv_move))
+            self.assertEqual(value, HeuristicSimpleTreat().calculate(position))
+            position.rewind(0)
+
+    def test_aspiration_windows(self):
+        tiles = {'p1': [(9, 9), (10, 9), (12, 12)], 'p2': [(10, 10), (11, 10), (11, 11)]}
+        position = Position.from_node(Node(player_1='p1', player_2='p2', maximizing_player=True, tiles=tiles))
+        minimax = Minimax(HeuristicSimpleTreat(), transposition_table=TranspositionTable())
+        minimax.ASPIRATION_WINDOW = 1  # fails on every iteration
+
+        value, move, depth = minimax.iterative_deepening(position, time_limit=30, max_depth=3)
+        self.assertEqual(3, depth)
+        self.assertEqual(Minimax(HeuristicSimpleTreat()).calculate_minimax_in_place(position, 3)[0], value)
+        self.assertEqual(move, minimax.principal_variation[0])
+        self.assertEqual(3, len(minimax.principal_variation))
+
+
+class MoveOrderingTestCase(TestCase):
+    def test_stages(self):
+        board = Board.from_tiles([(1, 1), (2, 2), (3, 3), (4, 4)], [(10, 0), (10, 1), (10, 2), (10, 3)])
+        candidates = 0
+        for x, y in ((0, 0), (5, 5), (10, 4), (12, 12), (13, 13), (14, 14)):
+            candidates |= 1 << (y * 19 + x)
+        ordering = MoveOrdering()
+        ordering.cutoff((14, 14), X_STONE, ply=1, depth=1)
+        ordering.cutoff((13, 13), X_STONE, ply=3, depth=2)
+
+        moves = list(ordering.moves(board, X_STONE, candidates, ply=1, hash_move=(12, 12)))
+        self.assertEqual((12, 12), moves[0])
+        self.assertEqual({(0, 0), (5, 5)}, set(moves[1:3]))
+        self.assertEqual([(10, 4), (14, 14), (13, 13)], moves[3:])
+
+    def test_five_completions(self):
+        board = Board.from_tiles([(0, 0), (1, 0), (2, 0), (3, 0), (18, 4), (17, 5), (16, 6), (14, 8)], [(5, 5)])
+
+        self.assertEqual({(4, 0), (15, 7)}, set(iterate_coordinates(board.five_completions(X_STONE))))
+        self.assertEqual(0, board.five_completions(O_STONE))
+
+    def test_ordered_search_has_same_value(self):
+        tiles = {'p1': [(9, 9), (10, 9), (12, 12)], 'p2': [(10, 10), (11, 10), (11, 11)]}
+        node = Node(player_1='p1', player_2='p2', maximizing_player=True, tiles=tiles)
+        expected_value = Minimax(HeuristicSimpleTreat()).calculate_minimax_in_place(Position.from_node(node), 3)[0]
+
+        minimax = Minimax(HeuristicSimpleTreat(), move_ordering=MoveOrdering())
+        self.assertEqual(expected_value, minimax.calculate_minimax_in_place(Position.from_node(node), 3)[0])
+        self.assertEqual(expected_value, minimax.calculate_minimax(node, 3)[0])
+
+
+class DeltaEvaluationTestCase(TestCase):
+    def test_line_scores_match_full_evaluation(self):
+        heuristic = HeuristicSimpleTreat()
+        board = Board.from_tiles([(9, 9), (10, 9), (11, 9), (6, 6)], [(8, 9), (9, 10), (9, 11), (12, 12)])
+        position = Position(player_1='p1', player_2='p2', maximizing_player=True, board=board)
+
+        for move in ((9, 12), (12, 9), (9, 8), (13, 9), (7, 7)):
+            self.assertTrue(position.play(move))
+            full = heuristic.line_scores(position.board.lines())
+            self.assertEqual(full.scores, position.line_scores.scores)
+            self.assertEqual(full.value(position.maximizing_player), position.line_scores.value(position.maximizing_player))
+
+        for _ in range(5):
+            position.undo()
+        self.assertEqual(heuristic.line_scores(board.lines()).scores, position.line_scores.scores)
+
+    def test_node_and_position_values(self):
+        tiles = {'p1': [(9, 9), (10, 9), (11, 9)], 'p2': [(9, 10), (10, 10)]}
+        node = Node(player_1='p1', player_2='p2', maximizing_player=False, tiles=tiles)
+        child = node.create_child_with_new_tile((11, 10))
+        position = Position.from_node(node)
+        position.play((11, 10))
+
+        # '-xxx-' and 'xxx-' on x turn against '-ooo-' and 'ooo-' on the opponent turn
+        self.assertEqual(200000 + 6000 - 10000 - 2000, HeuristicSimpleTreat().calculate(child))
+        self.assertEqual(HeuristicSimpleTreat().calculate(child), HeuristicSimpleTreat().calculate(position))
+
+
+class PatternTablesTestCase(TestCase):
+    @staticmethod
+    def _lines():
+        for length in range(1, 9):
+            for cells in product('-xo', repeat=length):
+                yield ''.join(cells)
+        random = Random(0)
+        for _ in range(3000):
+            yield ''.join(random.choice('--xo') for _ in range(19))
+
+    def test_treats_match_regex(self):
+        heuristic = HeuristicSimpleTreat()
+        pattern_x = re.compile(f'(?=({"|".join([treat.x_template for treat in heuristic.TREAT_TYPES])}))')
+        pattern_o = re.compile(f'(?=({"|".join([treat.o_template for treat in heuristic.TREAT_TYPES])}))')
+
+        for line in self._lines():
+            expected = [0, 0, 0, 0]
+            if len(line) >= 4:
+                for treat in pattern_x.findall(line):
+                    expected[0] += heuristic.treats_x[treat][0]
+                    expected[1] += heuristic.treats_x[treat][1]
+                for treat in pattern_o.findall(line):
+                    expected[2] += heuristic.treats_o[treat][0]
+                    expected[3] += heuristic.treats_o[treat][1]
+            self.assertEqual(tuple(expected), heuristic.line_score(line), line)
+
+    def test_open_threes_match_regex(self):
+        rules = GameRules()
+        pattern_x = re.compile(f'(?=({"|".join(rules.x_open_threes)}))')
+        pattern_o = re.compile(f'(?=({"|".join(rules.o_open_threes)}))')
+
+        for line in self._lines():
+            self.assertEqual(
+                (len(pattern_x.findall(line)), len(pattern_o.findall(line))),
+                rules.count_open_threes(line),
+                line,
+            )
+
+
+class BatchEvaluationTestCase(TestCase):
+    def test_batch_matches_played_children(self):
+        heuristic = HeuristicSimpleTreat()
+        board = Board.from_tiles(
+            [(9, 9), (10, 9), (10, 11), (7, 9), (12, 12)],
+            [(8, 9), (10, 10), (11, 10), (9, 11), (8, 8)],
+        )
+        for maximizing_player in (True, False):
+            position = Position(player_1='p1', player_2='p2', maximizing_player=maximizing_player, board=board.copy())
+            moves = list(position.moves())
+            values = BatchLeafEvaluator().evaluate(position, moves)
+            self.assertEqual(set(moves), set(values))
+            for move in moves:
+                if not position.play(move):
+                    self.assertEqual(ILLEGAL, values[move])
+                    continue
+                if bin(position.board.occupied).count('1') == bin(board.occupied).count('1') + 1:
+                    self.assertEqual(heuristic.calculate(position), values[move])
+                else:
+                    self.assertIsNone(values[move])
+                position.undo()
+
+    def test_batch_search_has_same_value(self):
+        board = Board.from_tiles([(9, 9), (10, 9), (10, 11)], [(8, 9), (10, 10), (11, 10)])
+        for depth in (1, 2, 3):
+            position = Position(player_1='p1', player_2='p2', maximizing_player=True, board=board.copy())
+            plain = Minimax(HeuristicSimpleTreat()).calculate_minimax_in_place(
+                position, depth, float('-inf'), float('inf'))
+            batch = Minimax(HeuristicSimpleTreat(), batch_evaluator=BatchLeafEvaluator()).calculate_minimax_in_place(
+                position, depth, float('-inf'), float('inf'))
+            self.assertEqual(plain, batch)
+
+    def test_batch_search_with_transposition_table_is_the_same_search(self):
+        board = Board.from_tiles(
+            [(9, 9), (10, 9), (10, 11), (7, 9), (12, 12)],
+            [(8, 9), (10, 10), (11, 10), (9, 11), (8, 8)],
+        )
+        searches = []
+        for batch_evaluator in (None, BatchLeafEvaluator()):
+            minimax = Minimax(
+                HeuristicSimpleTreat(),
+                transposition_table=TranspositionTable(),
+                move_ordering=MoveOrdering(),
+                batch_evaluator=batch_evaluator,
+            )
+            position = Position(player_1='p1', player_2='p2', maximizing_player=True, board=board.copy())
+            Analyzer.refresh()
+            searches.append((
+                minimax.iterative_deepening(position, 600, 3),
+                minimax.principal_variation,
+                minimax.calculate_minimax_in_place(position, 3),
+                Analyzer.get(Analyzer.NODE_COUNT),
+                [entry for entry in minimax.transposition_table._entries if entry is not None],
+            ))
+        self.assertEqual(searches[0], searches[1])
+
+
+class ParallelSearchTestCase(TestCase):
+    @staticmethod
+    def _minimax():
+        return Minimax(
+            HeuristicSimpleTreat(),
+            transposition_table=TranspositionTable(),
+            move_ordering=MoveOrdering(),
+            batch_evaluator=BatchLeafEvaluator(),
+        )
+
+    def test_parallel_search_matches_serial(self):
+        board = Board.from_tiles([(9, 9), (10, 9), (10, 11), (7, 9)], [(8, 9), (10, 10), (11, 10), (9, 11)])
+        for maximizing_player, depth in product((True, False), (1, 2, 3)):
+            serial = self._minimax().calculate_minimax_in_place(
+                Position(player_1='p1', player_2='p2', maximizing_player=maximizing_player, board=board.copy()), depth)
+            parallel = ParallelMinimax(self._minimax(), workers=2).search(
+                Position(player_1='p1', player_2='p2', maximizing_player=maximizing_player, board=board.copy()), depth)
+            self.assertEqual(serial, parallel)
+
+    def test_iterative_deepening(self):
+        board = Board.from_tiles([(9, 9), (10, 9)], [(9, 10)])
+        position = Position(player_1='p1', player_2='p2', maximizing_player=False, board=board)
+        minimax = self._minimax()
+        minimax.principal_variation = [(0, 0), (18, 18)]  # left by a search of another position
+        value, move, depth = ParallelMinimax(minimax, workers=2).iterative_deepening(position, 0.5, 2)
+        self.assertEqual(2, depth)
+        self.assertEqual(self._minimax().calculate_minimax_in_place(position, 2), (value, move))
+        self.assertEqual([move], minimax.principal_variation)
+
+    def test_worker_tables_belong_to_one_search(self):
+        board = Board.from_tiles([(9, 9), (10, 9)], [(9, 10)])
+        snapshot = Snapshot.from_position(Position(player_1='p1', player_2='p2', maximizing_player=True, board=board))
+        parallel._init_worker(Array('d', [HeuristicSimpleTreat().beta_max]))
+        try:
+            first, second = ParallelMinimax(self._minimax(), workers=1), ParallelMinimax(self._minimax(), workers=1)
+            self.assertNotEqual(first.search_id, second.search_id)
+
+            parallel._search_root_move(first.search_id, 0, snapshot, (8, 8), 3, None)
+            table = parallel._worker_minimax(first.search_id).transposition_table
+            self.assertTrue(any(table._entries))
+            self.assertFalse(any(parallel._worker_minimax(second.search_id).transposition_table._entries))
+            self.assertIs(table, parallel._worker_minimax(first.search_id).transposition_table)
+        finally:
+            parallel._worker_searches.clear()
+
+
+class ThreatSpaceSearchTestCase(TestCase):
+    def test_double_four(self):
+        board = Board.from_tiles(
+            [(5, 5), (6, 5), (7, 5), (8, 6), (8, 7), (8, 8)],
+            [(4, 5), (8, 9), (12, 12), (13, 13), (0, 0), (1, 18)],
+        )
+        position = Position(player_1='p1', player_2='p2', maximizing_player=True, board=board)
+        winning_line = ThreatSpaceSearch().solve(position, 10, 0)
+        self.assertEqual((8, 5), winning_line[0])
+        self.assertEqual(3, len(winning_line))
+        self.assertEqual(0, position.ply)
+
+        for move in winning_line:
+            self.assertTrue(position.play(move))
+        self.assertEqual('p1', GameRules().is_terminated(position))
+
+    def test_continuous_threats(self):
+        board = Board.from_tiles([(11, 10), (10, 11), (12, 11), (9, 12)], [(6, 9), (10, 8), (8, 12)])
+        position = Position(player_1='p1', player_2='p2', maximizing_player=True, board=board)
+        self.assertIsNone(ThreatSpaceSearch().solve(position, 10, 0))
+
+        winning_line = ThreatSpaceSearch().solve(position, 10, 3)
+        self.assertEqual((10, 9), winning_line[0])
+        for move in winning_line:
+            self.assertTrue(position.play(move))
+        self.assertEqual('p1', GameRules().is_terminated(position))
+
+    def test_breakable_five_is_not_a_win(self):
+        x_tiles = [(5, 5), (6, 5), (7, 5), (8, 5)]
+        position = Position(
+            player_1='p1', player_2='p2', maximizing_player=True, board=Board.from_tiles(x_tiles, [(4, 5)]),
+        )
+        self.assertEqual([(9, 5)], ThreatSpaceSearch().solve(position, 1, 0))
+
+        # o takes (6, 5) and (6, 6) with (6, 4) after the five
+        board = Board.from_tiles(x_tiles + [(6, 6)], [(4, 5), (6, 7)])
+        position = Position(player_1='p1', player_2='p2', maximizing_player=True, board=board)
+        self.assertIsNone(ThreatSpaceSearch().solve(position, 1, 0))
+
+    def test_capture_threat_against_a_four(self):
+        board = Board.from_tiles(
+            [(5, 10), (5, 11), (6, 11), (6, 13), (7, 7), (7, 11), (9, 5), (10, 5), (12, 10), (13, 10)],
+            [(5, 8), (5, 13), (7, 8), (9, 8), (9, 11), (10, 7), (10, 11), (11, 12)],
+        )
+        position = Position(player_1='p1', player_2='p2', maximizing_player=True, board=board)
+        self.assertIsNone(ThreatSpaceSearch().solve(position, 10, 0))
+
+        # o answers the four with (4, 9): both fives on row 11 lose (6, 11) and (5, 10) to (7, 12)
+        self.assertTrue(position.play((4, 11)))
+        self.assertTrue(position.board.capture_threat_squares(O_STONE, 1 << index(6, 11)) >> index(4, 9) & 1)
+        self.assertTrue(position.play((4, 9)))
+        self.assertEqual({(7, 12)}, set(iterate_coordinates(position.board.capture_squares(O_STONE))))
+        self.assertIsNone(ThreatSpaceSearch().solve(position, 10, 0))
+
+    def test_time_limit(self):
+        board = Board.from_tiles([(9, 9), (10, 10), (8, 11)], [(10, 9), (9, 10), (11, 11)])
+        position = Position(player_1='p1', player_2='p2', maximizing_player=True, board=board.copy())
+        start = time()
+        ThreatSpaceSearch().solve(position, 30, 30, time_limit=0.2)
+        self.assertLess(time() - start, 1)
+        self.assertEqual(board, position.board)
+
+
+class OpeningBookTestCase(TestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'book.bin')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_write_and_read(self):
+        random = Random(0)
+        moves = {random.getrandbits(64): (random.randrange(19), random.randrange(19)) for _ in range(1000)}
+        OpeningBook.write(self.path, moves)
+
+        book = OpeningBook(self.path)
+        self.assertEqual(len(moves), len(book))
+        for key, move in moves.items():
+            self.assertEqual(move, book.get(key))
+        self.assertIsNone(book.get(random.getrandbits(64)))
+        book.close()
+
+        with open(self.path, 'ab') as book_file:
+            book_file.write(b'tail')
+        with self.assertRaises(ValueError):
+            OpeningBook(self.path)
+
+    def test_builder(self):
+        moves = OpeningBookBuilder(plies=3, width=2, time_limit=0.05, max_depth=1).build()
+        OpeningBook.write(self.path, moves)
+        book = OpeningBook(self.path)
+
+        position = Position(player_1='p1', player_2='p2', maximizing_player=True, board=Board())
+        self.assertEqual((9, 9), book.move(position))
+        position.play((9, 9))
+        position.play((9, 8))
+        move = book.move(position)
+        self.assertIsNotNone(move)
+
+        # the same position turned upside down has the move turned upside down
+        mirrored = Position(
+            player_1='p1', player_2='p2', maximizing_player=True, board=Board.from_tiles([(9, 9)], [(9, 10)]),
+        )
+        self.assertEqual((move[0], 18 - move[1]), book.move(mirrored))
+        book.close()
+
+    def test_rewritten_book_is_read_again(self):
+        OpeningBook.write(self.path, {1: (3, 3)})
+        with override_settings(GOMOKU_OPENING_BOOK_PATH=self.path):
+            book = get_opening_book()
+            self.assertEqual((3, 3), book.get(1))
+            self.assertIs(book, get_opening_book())
+
+            OpeningBook.write(self.path, {1: (4, 4)})
+            new_book = get_opening_book()
+            self.assertEqual((4, 4), new_book.get(1))
+            self.assertTrue(book._map.closed)
+
+            os.remove(self.path)
+            self.assertIsNone(get_opening_book())
+            self.assertTrue(new_book._map.closed)
+
+    def test_next_move_from_book(self):
+        game = Game.objects.create(type=GameType.BOT.value, player_1="player_1", player_2="player_2")
+        Tile.objects.create(game=game, player="player_1", x_coordinate=9, y_coordinate=9)
+        key = Position.from_game(game, 'player_2').key
+        OpeningBook.write(self.path, {key: (3, 3)})
+
+        with override_settings(GOMOKU_OPENING_BOOK_PATH=self.path):
+            response = Client().get(reverse('next_move', kwargs={'game_id': game.id, 'player': 'player_2'}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([3, 3], list(response.data['coordinates']))
+        self.assertEqual(0, response.data['depth'])
+
+
+class EngineSessionTestCase(TestCase):
+    def test_next_search_continues_the_variation(self):
+        board = Board.from_tiles([(9, 9), (10, 9), (12, 12)], [(10, 10), (11, 10), (11, 11)])
+        session = EngineSession()
+        position = Position(player_1='p1', player_2='p2', maximizing_player=True, board=board)
+        session.search(position, time_limit=30, max_depth=3)
+        principal_variation = session.minimax.principal_variation
+        self.assertEqual(3, len(principal_variation))
+
+        position.play(principal_variation[0])
+        position.play(principal_variation[1])
+        next_position = Position(player_1='p1', player_2='p2', maximizing_player=True, board=position.board.copy())
+        Analyzer.refresh()
+        value, move, depth = session.search(next_position, time_limit=30, max_depth=1)
+        self.assertEqual(principal_variation[2], move)
+        self.assertGreater(Analyzer.get(Analyzer.TRANSPOSITION_HITS), 0)
+
+        # after a capture the stored values are off, the table starts again
+        captured = Position(
+            player_1='p1', player_2='p2', maximizing_player=True, board=position.board.copy(), captures_x=1,
+        )
+        Analyzer.refresh()
+        session.search(captured, time_limit=30, max_depth=1)
+        self.assertEqual(0, Analyzer.get(Analyzer.TRANSPOSITION_HITS))
+
+    def test_eviction(self):
+        sessions = EngineSessions()
+        with override_settings(GOMOKU_SESSION_MAX_COUNT=2, GOMOKU_SESSION_IDLE_TIMEOUT=600):
+            first = sessions.get(-1)
+            self.assertIs(first, sessions.get(-1))
+            sessions.get(-2)
+            sessions.get(-3)
+            self.assertEqual(2, len(sessions))
+            self.assertIsNot(first, sessions.get(-1))
+
+        with override_settings(GOMOKU_SESSION_IDLE_TIMEOUT=0):
+            sessions.get(-4)
+            self.assertEqual(1, len(sessions))
+
+        sessions.discard(-4)
+        self.assertEqual(0, len(sessions))
+
+
+class PonderingTestCase(TestCase):
+    def setUp(self):
+        board = Board.from_tiles([(9, 9), (10, 9), (12, 12)], [(10, 10), (11, 10), (11, 11)])
+        self.position = Position(player_1='p1', player_2='p2', maximizing_player=True, board=board)
+        self.session = EngineSession()
+        self.session.search(self.position, time_limit=30, max_depth=3)
+        self.expected_line = self.session.minimax.principal_variation
+
+    def test_ponder_hit(self):
+        self.assertTrue(self.session.ponder(self.position, self.expected_line, time_limit=30, max_depth=2))
+        self.session._ponder_thread.join()
+
+        self.position.play(self.expected_line[0])
+        self.position.play(self.expected_line[1])
+        self.assertEqual(self.position.key, self.session.pondering_key)
+        (value, move, depth), ponder_time = self.session.stop_pondering(self.position.key)
+        self.assertEqual(2, depth)
+        self.assertIsNotNone(move)
+        self.assertIsNone(self.session.pondering_key)
+
+    def test_ponder_miss_is_cancelled(self):
+        self.assertTrue(self.session.ponder(self.position, self.expected_line, time_limit=600, max_depth=19))
+        start_time = time()
+        self.assertIsNone(self.session.stop_pondering(self.position.key))
+        self.assertLess(time() - start_time, 1)
+
+        # the engine is usable again after a cancelled pondering
+        self.assertEqual(1, self.session.search(self.position, time_limit=30, max_depth=1)[2])
+
+    def test_stopping_the_pondering_leaves_other_searches_alone(self):
+        self.session.lock.acquire()
+        try:
+            # the pondering waits for the lock, the search of a next_move request holds it
+            self.assertTrue(self.session.ponder(self.position, self.expected_line, time_limit=600, max_depth=19))
+            cancelled = self.session._ponder_cancelled
+            stopper = Thread(target=self.session.stop_pondering)
+            stopper.start()
+            cancelled.wait(timeout=5)
+            self.assertEqual(3, self.session.search(self.position, time_limit=30, max_depth=3)[2])
+        finally:
+            self.session.lock.release()
+        stopper.join()
+        self.assertIsNone(self.session.pondering_key)
+
+    def test_concurrent_requests_ponder_once(self):
+        errors = []
+
+        def request():
+            try:
+                self.session.stop_pondering(self.position.key)
+                self.session.ponder(self.position, self.expected_line, time_limit=600, max_depth=19)
+            except Exception as error:
+                errors.append(error)
+
+        threads_before = active_count()
+        requests = [Thread(target=request) for _ in range(8)]
+        for thread in requests:
+            thread.start()
+        for thread in requests:
+            thread.join()
+        self.assertEqual([], errors)
+        self.assertEqual(threads_before + 1, active_count())  # one pondering thread
+
+        self.session.stop_pondering()
+        self.assertEqual(threads_before, active_count())
+
+    def test_line_through_taken_squares_is_not_pondered(self):
+        taken = [(9, 9), (10, 10)]
+        self.assertFalse(self.session.ponder(self.position, taken, time_limit=30, max_depth=2))
+        self.assertIsNone(self.session.pondering_key)
+        self.assertEqual(0, self.position.ply)
+
+    def test_nothing_to_ponder(self):
+        self.assertFalse(self.session.ponder(self.position, self.expected_line[:1], time_limit=30, max_depth=2))
+        self.assertIsNone(self.session.pondering_key)
+
+    def test_missed_answer_stops_the_pondering(self):
+        game = Game.objects.create(type=GameType.BOT.value, player_1="player_1", player_2="player_2")
+        Tile.objects.create(game=game, player="player_1", x_coordinate=9, y_coordinate=9)
+        Tile.objects.create(game=game, player="player_2", x_coordinate=10, y_coordinate=10)
+
+        response = self.client.get(
+            reverse('next_move', kwargs={'game_id': game.id, 'player': 'player_1'}),
+            {'time_limit': 0.5, 'ponder': True},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        x, y = response.data['coordinates']
+        Tile.objects.create(game=game, player="player_1", x_coordinate=x, y_coordinate=y)
+        session = EngineSessions().find(game.id)
+        self.assertIsNotNone(session.pondering_key)
+
+        response = self.client.post(
+            reverse('tile'),
+            {'game_id': game.id, 'player': 'player_2', 'x_coordinate': 0, 'y_coordinate': 0},
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIsNone(session.pondering_key)
+        EngineSessions().discard(game.id)
+
+
+class SearchStreamTestCase(TestCase):
+    def setUp(self):
+        self.game = Game.objects.create(type=GameType.BOT.value, player_1="player_1", player_2="player_2")
+        Tile.objects.create(game=self.game, player="player_1", x_coordinate=9, y_coordinate=9)
+        Tile.objects.create(game=self.game, player="player_2", x_coordinate=10, y_coordinate=10)
+
+    def tearDown(self):
+        EngineSessions().discard(self.game.id)
+
+    def test_event_per_iteration(self):
+        response = self.client.get(
+            reverse('next_move_stream', kwargs={'game_id': self.game.id, 'player': 'player_1'}),
+            {'time_limit': 0.5},
+            HTTP_ACCEPT='text/event-stream',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual('text/event-stream', response['Content-Type'])
+        events = [
+            json.loads(line[len('data: '):])
+            for line in b''.join(response.streaming_content).decode().splitlines()
+            if line.startswith('data: ')
+        ]
+        self.assertEqual(list(range(1, len(events) + 1)), [event['depth'] for event in events])
+        for event in events:
+            self.assertEqual(event['coordinates'], event['principal_variation'][0])
+            self.assertGreater(event['nodes'], 0)
+
+        response = self.client.get(
+            reverse('next_move_stream', kwargs={'game_id': self.game.id, 'player': 'nobody'}),
+            HTTP_ACCEPT='text/event-stream',
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_closing_the_stream_cancels_the_search(self):
+        session = EngineSessions().get(self.game.id)
+        iterations = session.stream(GameStates().get(self.game).position('player_1'), time_limit=600)
+        iteration = next(iteration for iteration in iterations if iteration is not None)
+        self.assertEqual(1, iteration.depth)
+
+        start_time = time()
+        iterations.close()
+        self.assertLess(time() - start_time, 1)
+
+    def test_closing_the_stream_leaves_other_searches_alone(self):
+        session = EngineSessions().get(self.game.id)
+        position = GameStates().get(self.game).position('player_1')
+        session.lock.acquire()
+        try:
+            # the stream's search waits for the lock, the search of a next_move request holds it
+            with patch('game.sessions.STREAM_KEEPALIVE', 0.01):
+                iterations = session.stream(position, time_limit=600)
+                self.assertIsNone(next(iterations))
+            closer = Thread(target=iterations.close)
+            closer.start()
+            closer.join(timeout=0.1)  # the stream is cancelled and waits for its thread
+            self.assertEqual(3, session.search(position, time_limit=30, max_depth=3)[2])
+        finally:
+            session.lock.release()
+        closer.join()
+
+
+class SearchJobTestCase(TransactionTestCase):
+    """ The results are written by threads of their own, they see committed rows only """
+    def setUp(self):
+        self.game = Game.objects.create(type=GameType.BOT.value, player_1="player_1", player_2="player_2")
+        Tile.objects.create(game=self.game, player="player_1", x_coordinate=9, y_coordinate=9)
+        self.url = reverse('next_move_job', kwargs={'game_id': self.game.id, 'player': 'player_2'})
+
+    def _poll(self, job_id: str):
+        for _ in range(300):
+            response = self.client.get(reverse('job', kwargs={'job_id': job_id}))
+            if response.data['status'] != SearchJob.PENDING:
+                return response
+            sleep(0.1)
+        self.fail(f'job {job_id} is still pending')
+
+    def test_job_result_is_polled(self):
+        response = self.client.post(self.url, {'time_limit': 0.2})
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job_id = response.data['job_id']
+
+        # the same position gets the same job
+        response = self.client.post(self.url, {'time_limit': 0.2})
+        self.assertEqual(job_id, response.data['job_id'])
+
+        response = self._poll(job_id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(SearchJob.DONE, response.data['status'])
+        self.assertIn(tuple(response.data['coordinates']), Node.from_game(self.game, 'player_2').should_inspect)
+        self.assertGreaterEqual(response.data['depth'], 1)
+
+        Tile.objects.create(game=self.game, player="player_2", x_coordinate=10, y_coordinate=10)
+        self.game.refresh_from_db()
+        response = self.client.post(self.url, {'time_limit': 0.2})
+        self.assertNotEqual(job_id, response.data['job_id'])
+        self.assertEqual(SearchJob.DONE, self._poll(response.data['job_id']).data['status'])
+
+    def test_job_of_another_web_worker(self):
+        job = SearchJob.objects.create(
+            game=self.game, key='key', status=SearchJob.DONE, x_coordinate=3, y_coordinate=4, depth=2, time=0.5,
+        )
+        response = self.client.get(reverse('job', kwargs={'job_id': job.id.hex}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([3, 4], list(response.data['coordinates']))
+
+    def test_one_job_per_position(self):
+        SearchJob.objects.create(game=self.game, key='key', status=SearchJob.FAILED)
+        SearchJob.objects.create(game=self.game, key='key')
+        with self.assertRaises(IntegrityError):
+            SearchJob.objects.create(game=self.game, key='key', status=SearchJob.DONE)
+
+    def test_request_losing_the_race_gets_the_other_job(self):
+        lookup = QuerySet.get
+        other_jobs = []
+
+        def lookup_before_the_other_request(queryset, *args, **kwargs):
+            if not other_jobs:
+                # the other request creates the job after this one has looked for it
+                other_jobs.append(SearchJob.objects.create(game=self.game, key=kwargs['key']))
+                raise SearchJob.DoesNotExist()
+            return lookup(queryset, *args, **kwargs)
+
+        with patch.object(QuerySet, 'get', autospec=True, side_effect=lookup_before_the_other_request):
+            job = SearchJobs().submit(self.game, 'player_2', 0.1)
+        self.assertEqual(other_jobs[0].id, job.id)
+        self.assertEqual(1, SearchJob.objects.count())
+
+    def test_bad_requests(self):
+        response = self.client.post(self.url, {'time_limit': -1})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(reverse('next_move_job', kwargs={'game_id': self.game.id, 'player': 'nobody'}))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(reverse('job', kwargs={'job_id': 'missing'}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_old_jobs_are_dropped(self):
+        jobs = SearchJobs()
+        job = jobs.submit(self.game, 'player_2', 0.1)
+        self._poll(job.id.hex)
+        with override_settings(GOMOKU_JOB_RESULT_TIMEOUT=-1):
+            new_job = jobs.submit(self.game, 'player_2', 0.1)
+        self.assertNotEqual(job.id, new_job.id)
+        self.assertIsNone(jobs.get(job.id.hex))
+        self._poll(new_job.id.hex)
+
+
+class GameStateTestCase(TestCase):
+    def setUp(self):
+        self.game = Game.objects.create(type=GameType.BOT.value, player_1="player_1", player_2="player_2")
+        Tile.objects.create(game=self.game, player="player_1", x_coordinate=9, y_coordinate=9)
+
+    def test_add_tile_writes_through(self):
+        states = GameStates()
+        state = states.get(self.game)
+        self.assertEqual([(9, 9)], state.board.stones(X_STONE))
+
+        for player, x, y in (('player_2', 10, 9), ('player_2', 11, 9), ('player_1', 12, 9)):
+            response = self.client.post(
+                reverse('tile'), {'game_id': self.game.id, 'player': player, 'x_coordinate': x, 'y_coordinate': y},
+            )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.game.refresh_from_db()
+        self.assertIs(state, states.get(self.game))
+        self.assertEqual(Board.from_game(self.game), state.board)
+        self.assertEqual((1, 0), (state.captures_x, state.captures_o))
+        self.assertEqual({'x': 1, 'o': 0}, response.data['captures'])
+        self.assertEqual(
+            sorted((tile['x_coordinate'], tile['y_coordinate'], tile['player']) for tile in response.data['tiles']),
+            [(9, 9, 'player_1'), (12, 9, 'player_1')],
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            states.get(self.game).position('player_2')
+        self.assertEqual(0, len(queries))
+
+    def test_stale_state_is_read_again(self):
+        states = GameStates()
+        state = states.get(self.game)
+
+        Tile.objects.create(game=self.game, player="player_2", x_coordinate=10, y_coordinate=10)
+        self.assertIsNot(state, states.get(self.game))
+        self.assertEqual([(10, 10)], states.get(self.game).board.stones(O_STONE))
+
+        # written by another process: only the version tells
+        state = states.get(self.game)
+        Game.objects.filter(pk=self.game.pk).update(version=F('version') + 1)
+        self.game.refresh_from_db()
+        self.assertIsNot(state, states.get(self.game))
+
+    def test_eviction(self):
+        states = GameStates()
+        with override_settings(GOMOKU_GAME_STATE_MAX_COUNT=1):
+            state = states.get(self.game)
+            states.get(Game.objects.create(type=GameType.BOT.value, player_1="player_1", player_2="player_2"))
+            self.assertEqual(1, len(states))
+            self.assertIsNot(state, states.get(self.game))
+
+        with override_settings(GOMOKU_GAME_STATE_IDLE_TIMEOUT=0):
+            state = states.get(self.game)
+            self.assertIsNot(state, states.get(self.game))
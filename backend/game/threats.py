@@ -0,0 +1,263 @@
+from time import time
+from typing import Tuple, List, Dict, Set, Union
+
+from game.analyzer import Analyzer
+from game.board import X_STONE, O_STONE, SIZE, DIRECTIONS, LINE_SQUARES, Board, index, line_keys, iterate_coordinates
+from game.internal_types import SearchTimeout
+from game.position import Position
+from game.rules import GameRules
+
+
+Move = Tuple[int, int]
+
+
+class ThreatSpaceSearch:
+    """
+    Looks for a forced win of the player to move by threats only: every attacking move makes a four
+    (VCF, victory by continuous fours) or also an open three (VCT, victory by continuous threats),
+    so the opponent has only a few answers - the squares which block the threat, own fours against
+    a three, captures and threats to capture a stone of a four. With so few moves per ply the search gets 15-20 plies deep.
+    A five which the opponent can break by a capture is not counted as a win.
+    """
+    def __init__(self, game_rules: GameRules = None):
+        self.game_rules = game_rules or GameRules()
+        self.deadline: Union[float, None] = None
+        self._failed: Dict[Tuple[int, bool], int] = {}
+        self._four_offsets_cache: Dict[Tuple[str, str], Tuple[int, ...]] = {}
+        self._three_offsets_cache: Dict[Tuple[str, str], Tuple[int, ...]] = {}
+
+    @Analyzer.update_time(Analyzer.THREAT_SEARCH)
+    def solve(
+            self,
+            position: Position,
+            max_depth: int,
+            max_three_depth: int,
+            time_limit: Union[float, None] = None,
+    ) -> Union[List[Move], None]:
+        """
+        Winning line for the player to move - its moves and the opponent's answers, ending with
+        the winning move - or None if no win was found.
+        Continuous fours are tried first up to `max_depth` attacking moves, then continuous threats
+        up to `max_three_depth` (every open three has many more answers than a four), each with
+        iterative deepening, so the shortest win is found first.
+        """
+        self.deadline = time() + time_limit if time_limit is not None else None
+        self._failed = {}
+        start_ply = position.ply
+        try:
+            for with_threes, depth_limit in ((False, max_depth), (True, max_three_depth)):
+                for depth in range(1, depth_limit + 1):
+                    winning_line = self._attack(position, depth, with_threes)
+                    if winning_line is not None:
+                        return winning_line
+        except SearchTimeout:
+            position.rewind(start_ply)
+        finally:
+            self.deadline = None
+        return None
+
+    def _attack(self, position: Position, depth: int, with_threes: bool) -> Union[List[Move], None]:
+        if self.deadline is not None and time() > self.deadline:
+            raise SearchTimeout()
+
+        winning_move = self._winning_move(position)
+        if winning_move is not None:
+            return [winning_move]
+        if depth == 0:
+            return None
+        failed_key = (position.key, with_threes)
+        if self._failed.get(failed_key, -1) >= depth:
+            return None
+
+        board = position.board
+        attacker = position.stone
+        defender = O_STONE if attacker == X_STONE else X_STONE
+        defender_fives = board.five_completions(defender)
+        for move in self._threat_moves(position, attacker, with_threes):
+            if defender_fives and not defender_fives >> index(*move) & 1:
+                continue  # the opponent's five has to be blocked first
+            if not position.play(move):
+                continue
+            is_four = bool(board.five_completions(attacker))
+            defence_line = self._defend(position, depth, with_threes, move, attacker, is_four)
+            position.undo()
+            if defence_line is not None:
+                return [move] + defence_line
+
+        self._failed[failed_key] = depth
+        return None
+
+    def _defend(
+            self,
+            position: Position,
+            depth: int,
+            with_threes: bool,
+            threat: Move,
+            attacker: str,
+            is_four: bool,
+    ) -> Union[List[Move], None]:
+        """ The longest of the winning lines against every answer, None if one of them holds """
+        defender = position.stone
+        if position.board.five_completions(defender):
+            return None
+
+        main_line = None
+        for answer in self._answers(position, threat, attacker, defender, is_four):
+            if not position.play(answer):
+                continue
+            if self._wins_by_captures(position, defender):
+                position.undo()
+                return None
+            winning_line = self._attack(position, depth - 1, with_threes)
+            position.undo()
+            if winning_line is None:
+                return None
+            if main_line is None or len(winning_line) + 1 > len(main_line):
+                main_line = [answer] + winning_line
+
+        if main_line is None and not is_four:
+            return None  # no answer to a three is legal: don't count on it
+        return main_line if main_line is not None else []
+
+    def _winning_move(self, position: Position) -> Union[Move, None]:
+        """ A move which makes an unbreakable five or the fifth capture """
+        board = position.board
+        attacker = position.stone
+        if self._captures(position, attacker) == 4:
+            for move in self._capture_moves(position, attacker):
+                if position.play(move):
+                    position.undo()
+                    return move
+
+        for move in iterate_coordinates(board.five_completions(attacker)):
+            if not position.play(move):
+                continue
+            breakable = self._five_is_breakable(position, attacker)
+            position.undo()
+            if not breakable:
+                return move
+        return None
+
+    def _five_is_breakable(self, position: Position, attacker: str) -> bool:
+        """ Whether the opponent can capture a stone out of every five or win by the captures """
+        defender = position.stone
+        attacker_index = 0 if attacker == X_STONE else 1
+        for move in self._capture_moves(position, defender):
+            if not position.play(move):
+                continue
+            broken = self._wins_by_captures(position, defender) or not position.fives[attacker_index]
+            position.undo()
+            if broken:
+                return True
+        return False
+
+    def _threat_moves(self, position: Position, stone: str, with_threes: bool) -> List[Move]:
+        """ Moves which make a four, then the ones which make an open three """
+        fours: Set[int] = set()
+        threes: Set[int] = set()
+        for key, line in position.lines.items():
+            squares = LINE_SQUARES[key]
+            fours.update(squares[offset] for offset in self._four_offsets(line, stone))
+            if with_threes:
+                threes.update(squares[offset] for offset in self._three_offsets(line, stone))
+        return [(square % SIZE, square // SIZE) for square in sorted(fours) + sorted(threes - fours)]
+
+    def _answers(self, position: Position, threat: Move, attacker: str, defender: str, is_four: bool) -> List[Move]:
+        """
+        Answers worth trying against the threat, the ones which most likely hold first: squares which
+        block it, against an open three the opponent's own fours, captures, and the moves which threaten
+        to capture a stone of the threat, so the five it leads to can be broken
+        """
+        board = position.board
+        completions = board.five_completions(attacker)
+        answers = list(iterate_coordinates(completions))
+        if not is_four:
+            threat_square = index(*threat)
+            for key in line_keys(*threat):
+                squares = LINE_SQUARES[key]
+                line = board.line(key)
+                for offset in sorted(self._open_three_defences(line, attacker, squares.index(threat_square))):
+                    answers.append((squares[offset] % SIZE, squares[offset] // SIZE))
+            answers.extend(self._threat_moves(position, defender, False))
+        answers.extend(self._capture_moves(position, defender))
+        if is_four:
+            five_stones = self._five_stones(board, completions, attacker)
+            answers.extend(iterate_coordinates(board.capture_threat_squares(defender, five_stones)))
+        return list(dict.fromkeys(answers))
+
+    @staticmethod
+    def _five_stones(board: Board, completions: int, stone: str) -> int:
+        """ Bits of the stones of `stone` which stand in a five with every one of the `completions` squares """
+        common = -1
+        for x, y in iterate_coordinates(completions):
+            stones = 0
+            for dx, dy in DIRECTIONS:
+                line = []
+                for sign in (-1, 1):
+                    step = 1
+                    while board.get(x + sign * step * dx, y + sign * step * dy) == stone:
+                        line.append(index(x + sign * step * dx, y + sign * step * dy))
+                        step += 1
+                if len(line) >= 4:
+                    for square in line:
+                        stones |= 1 << square
+            common &= stones
+        return common if completions else 0
+
+    def _four_offsets(self, line: str, stone: str) -> Tuple[int, ...]:
+        """ Empty squares of the line where `stone` makes four stones out of five squares """
+        cached = self._four_offsets_cache.get((line, stone))
+        if cached is not None:
+            return cached
+
+        offsets = set()
+        for start in range(len(line) - 4):
+            window = line[start:start + 5]
+            if window.count(stone) == 3 and window.count('-') == 2:
+                offsets.update(start + position for position, cell in enumerate(window) if cell == '-')
+        cached = self._four_offsets_cache[(line, stone)] = tuple(sorted(offsets))
+        return cached
+
+    def _three_offsets(self, line: str, stone: str) -> Tuple[int, ...]:
+        """ Empty squares of the line where `stone` makes a new open three """
+        cached = self._three_offsets_cache.get((line, stone))
+        if cached is not None:
+            return cached
+
+        player_index = 0 if stone == X_STONE else 1
+        open_threes = self.game_rules.count_open_threes(line)[player_index]
+        offsets = tuple(
+            offset
+            for offset, cell in enumerate(line)
+            if cell == '-'
+            and self.game_rules.count_open_threes(f'{line[:offset]}{stone}{line[offset + 1:]}')[player_index] > open_threes
+        )
+        self._three_offsets_cache[(line, stone)] = offsets
+        return offsets
+
+    def _open_three_defences(self, line: str, stone: str, threat_offset: int) -> Set[int]:
+        """ Empty squares in and right next to the open threes of the line which hold the new stone """
+        templates = self.game_rules.x_open_threes if stone == X_STONE else self.game_rules.o_open_threes
+        defences = set()
+        for template in templates:
+            start = line.find(template)
+            while start != -1:
+                end = start + len(template)
+                if start <= threat_offset < end:
+                    for offset in range(max(start - 1, 0), min(end + 1, len(line))):
+                        if line[offset] == '-':
+                            defences.add(offset)
+                start = line.find(template, start + 1)
+        return defences
+
+    @staticmethod
+    def _capture_moves(position: Position, stone: str) -> List[Move]:
+        return list(iterate_coordinates(position.board.capture_squares(stone)))
+
+    @staticmethod
+    def _captures(position: Position, stone: str) -> int:
+        return position.captures_x if stone == X_STONE else position.captures_o
+
+    @staticmethod
+    def _wins_by_captures(position: Position, stone: str) -> bool:
+        return ThreatSpaceSearch._captures(position, stone) >= 5
@@ -0,0 +1,54 @@
+from typing import Tuple, List, NamedTuple, Union
+
+
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+
+class TranspositionEntry(NamedTuple):
+    key: int
+    depth: int
+    flag: int
+    value: float
+    move: Union[Tuple[int, int], None]
+    generation: int
+
+
+class TranspositionTable:
+    """
+    Fixed-size table of searched positions, indexed by the low bits of the Zobrist key.
+    A slot is replaced when it is empty, holds the same position, was stored by an older
+    search or was searched not deeper than the new entry.
+    """
+    def __init__(self, size_power: int = 18):
+        self._mask = (1 << size_power) - 1
+        self._entries: List[Union[TranspositionEntry, None]] = [None] * (1 << size_power)
+        self.generation = 0
+
+    def get(self, key: int) -> Union[TranspositionEntry, None]:
+        entry = self._entries[key & self._mask]
+        if entry is not None and entry.key == key:
+            return entry
+        return None
+
+    def store(self, key: int, depth: int, flag: int, value: float, move: Union[Tuple[int, int], None]):
+        slot = key & self._mask
+        entry = self._entries[slot]
+        if entry is None or entry.key == key or entry.generation != self.generation or entry.depth <= depth:
+            self._entries[slot] = TranspositionEntry(key, depth, flag, value, move, self.generation)
+
+    def new_search(self):
+        self.generation += 1
+
+    def clear(self):
+        self._entries = [None] * (self._mask + 1)
+        self.generation = 0
+
+    @staticmethod
+    def flag_for(value: float, alpha: float, beta: float) -> int:
+        if value <= alpha:
+            return UPPER_BOUND
+        if value >= beta:
+            return LOWER_BOUND
+        return EXACT
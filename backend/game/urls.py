@@ -1,9 +1,12 @@
 from django.urls import path
 
-from game.views import GameView, TileView, NextMoveView
+from game.views import GameView, TileView, NextMoveView, NextMoveStreamView, NextMoveJobView, JobView
 
 urlpatterns = [
     path('', GameView.as_view(), name='game'),
     path('add_tile/', TileView.as_view(), name='tile'),
     path('<int:game_id>/next_move/<str:player>/', NextMoveView.as_view(), name='next_move'),
+    path('<int:game_id>/next_move/<str:player>/stream/', NextMoveStreamView.as_view(), name='next_move_stream'),
+    path('<int:game_id>/next_move/<str:player>/jobs/', NextMoveJobView.as_view(), name='next_move_job'),
+    path('jobs/<str:job_id>/', JobView.as_view(), name='job'),
 ]
@@ -1,29 +1,35 @@
+import json
+from functools import reduce
+from operator import or_
+from typing import Iterator, Union
+
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import F, Q
+from django.http import StreamingHttpResponse
 from rest_framework.generics import GenericAPIView
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import BasePermission
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
 from rest_framework import status
 
-from game.serializers import GameSerializer, TileSerializer, NextMoveSerializer
+from game.serializers import GameSerializer, TileSerializer, NextMoveSerializer, SearchRequestSerializer
 from game.models import Tile, Game
-from game.node import Node
-from game.algorithm import Minimax
-from game.heuristics import HeuristicSimpleTreat
+from game.board import coordinates
+from game.position import Position
+from game.sessions import EngineSessions, Iteration
+from game.jobs import SearchJobs
+from game.states import GameStates
 from game.rules import GameRules
 from game.analyzer import Analyzer
 from game.internal_types import TileXY
 
 
 class TilePermission(BasePermission):
-    def has_permission(self, request, view) -> bool:
-        serializer = TileSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-
-        game = Game.objects.get(pk=serializer.data["game_id"])
-        player = serializer.data["player"]
-        node = Node.from_game(game, player)
-
-        return GameRules().check_open_threes(node, TileXY.from_dict(serializer.data))
+    def has_object_permission(self, request, view, tile: Tile) -> bool:
+        return GameStates().get(tile.game).allows(tile.x_coordinate, tile.y_coordinate, tile.player)
 
 
 class GameView(GenericAPIView):
@@ -42,37 +48,77 @@ class TileView(GenericAPIView):
     permission_classes = (TilePermission,)
 
     @staticmethod
-    def _delete_tiles_by_captures(game, player, captures):
-        for capture in captures:
-            Tile.objects.filter(game=game, x_coordinate=capture[0].x, y_coordinate=capture[0].y).delete()
-            Tile.objects.filter(game=game, x_coordinate=capture[1].x, y_coordinate=capture[1].y).delete()
-
-            if player == game.player_1:
-                game.captures_o += 1
-                game.save()
-            elif player == game.player_2:
-                game.captures_x += 1
-                game.save()
+    def _delete_tiles_by_captures(game, captures):
+        """
+        One query for all the captured stones. The game state has the captures already, so the
+        tiles go without the post_delete signal, which would make the collector select them first.
+        """
+        if captures:
+            squares = reduce(or_, (Q(x_coordinate=x, y_coordinate=y) for x, y in captures))
+            tiles = Tile.objects.filter(squares, game=game)
+            tiles._raw_delete(tiles.db)
 
-    def post(self, request):
-        serializer = self.serializer_class(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        tile = serializer.save()
-        game = tile.game
-        player = game.player_1 if tile.player == game.player_2 else game.player_2
-        node = Node.from_game(game=game, player=player)
+    @staticmethod
+    def _update_game(game, tile, captures, board: bytes):
+        """ Capture counter, board and version in one query """
+        captures_field = 'captures_x' if tile.player == game.player_1 else 'captures_o'
+        Game.objects.filter(pk=game.pk).update(
+            **{captures_field: F(captures_field) + len(captures) // 2},
+            board=board,
+            version=F('version') + 1,
+        )
+        setattr(game, captures_field, getattr(game, captures_field) + len(captures) // 2)
+        game.board = board
+        game.version += 1
 
-        captures = node.find_captures_to_delete(tile_xy=TileXY.from_serializer(tile))
-        node.update_from_captures(captures)
-        self._delete_tiles_by_captures(game, player, captures)
+    @staticmethod
+    def _stop_missed_pondering(game, position: Position):
+        """ The bot pondered on another answer: free the CPU at once """
+        session = EngineSessions().find(game.id)
+        if session is not None and session.pondering_key is not None and position.key != session.pondering_key:
+            session.stop_pondering()
 
-        winner = GameRules().deeper_winner_check(node)
+    def post(self, request):
+        """
+        One transaction: the game row is read and locked by the validation, then the tile is inserted,
+        the captured stones are deleted and the game is updated with one query each
+        """
+        states = GameStates()
+        with transaction.atomic():
+            serializer = self.serializer_class(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            game = serializer.validated_data["game"]
+            self.check_object_permissions(request, Tile(**serializer.validated_data))
+            state = states.get(game)
+
+            with state.lock:
+                try:
+                    tile_xy = TileXY.from_dict(serializer.validated_data)
+                    captures = [
+                        coordinates(captured)
+                        for capture in state.place(tile_xy.x, tile_xy.y, serializer.validated_data["player"])
+                        for captured in capture
+                    ]
+                    tile = serializer.save()
+                    player = game.player_1 if tile.player == game.player_2 else game.player_2
+                    self._delete_tiles_by_captures(game, captures)
+                    self._update_game(game, tile, captures, state.pack(x_to_move=player == game.player_1))
+                except IntegrityError:
+                    states.discard(game.id)  # another request took the square
+                    raise ValidationError("The square is taken")
+                except Exception:
+                    states.discard(game.id)  # the database may have only a part of the move
+                    raise
+                state.version = game.version
+                position = state.position(player)
+                tiles = state.tiles()
+
+        winner = GameRules().deeper_winner_check(position)
+        self._stop_missed_pondering(game, position)
 
-        tiles = Tile.objects.filter(game=tile.game)
-        tiles_serializer = self.serializer_class(instance=tiles, many=True)
         return Response(
             {
-                "tiles": tiles_serializer.data,
+                "tiles": tiles,
                 "captures": {
                     'x': game.captures_x,
                     'o': game.captures_o,
@@ -87,34 +133,119 @@ class NextMoveView(APIView):
     serializer_class = NextMoveSerializer
 
     def get(self, request, game_id: int, player: str):  # TODO: validate if it is this user turn
-        serializer = self.serializer_class(data={"game": game_id, "player": player})
+        serializer = self.serializer_class(data={**request.query_params.dict(), "game": game_id, "player": player})
         serializer.is_valid(raise_exception=True)
-        game = Game.objects.get(pk=game_id)
+        game = serializer.validated_data["game"]
 
         Analyzer.refresh()
-        value, chosen_node = self._get_move(game, player)
-        # self._print_logs(value, chosen_node)
+        value, chosen_move, depth = self._get_move(
+            game,
+            player,
+            serializer.validated_data["time_limit"],
+            serializer.validated_data["workers"],
+            serializer.validated_data["ponder"],
+        )
 
         return Response(
             {
-                'coordinates': chosen_node.new_move if chosen_node else (9, 9),
+                'coordinates': chosen_move if chosen_move else (9, 9),
                 'time': Analyzer.get(Analyzer.ALL_TIME),
+                'depth': depth,
             },
             status.HTTP_200_OK
         )
 
     @Analyzer.update_time(Analyzer.ALL_TIME)
-    def _get_move(self, game, player):
-        node = Node.from_game(game, player)
-        minimax = Minimax(HeuristicSimpleTreat())
-        value, chosen_node = minimax.calculate_minimax(node, 2)
-        self._print_logs(value, node)
-        return value, chosen_node
+    def _get_move(self, game, player, time_limit: float, workers: int, ponder: bool):
+        position = GameStates().get(game).position(player)
+        session = EngineSessions().get(game.id)
+        pondered = session.stop_pondering(position.key)
+        if pondered is not None and pondered[1] >= time_limit:
+            (value, chosen_move, depth), expected_line = pondered[0], session.minimax.principal_variation
+        else:
+            value, chosen_move, depth, expected_line = session.find_move(position, time_limit, workers)
+
+        if ponder and chosen_move is not None and expected_line[:1] == [chosen_move]:
+            session.ponder(position, expected_line, settings.GOMOKU_PONDER_TIME_LIMIT, settings.GOMOKU_SEARCH_MAX_DEPTH)
+        self._print_logs(value)
+        return value, chosen_move, depth
 
     @staticmethod
-    def _print_logs(value: float, node: Node):
-        if not node:
-            return
-        # node.print_children(0)
+    def _print_logs(value: float):
         Analyzer.print_results()
         print(value)
+
+
+class EventStreamRenderer(JSONRenderer):
+    """ Lets EventSource clients through the content negotiation, errors still go out as JSON """
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+
+
+class NextMoveStreamView(APIView):
+    """
+    Server-sent events with the best move after every completed iteration of the search. The stream
+    ends with the search, and the search is cancelled when the client goes away.
+    """
+    serializer_class = SearchRequestSerializer
+    renderer_classes = (JSONRenderer, EventStreamRenderer)
+
+    def get(self, request, game_id: int, player: str):
+        serializer = self.serializer_class(data={**request.query_params.dict(), "game": game_id, "player": player})
+        serializer.is_valid(raise_exception=True)
+        game = serializer.validated_data["game"]
+
+        position = GameStates().get(game).position(player)
+        session = EngineSessions().get(game.id)
+        response = StreamingHttpResponse(
+            self._events(session.stream(position, serializer.validated_data["time_limit"])),
+            content_type='text/event-stream',
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # nginx would hold the events back
+        return response
+
+    @staticmethod
+    def _events(iterations: Iterator[Union[Iteration, None]]) -> Iterator[str]:
+        """ The server closes this generator when the client disconnects, it closes the search's one """
+        try:
+            for iteration in iterations:
+                if iteration is None:
+                    yield ': keep-alive\n\n'  # a comment: writes show whether the client is still there
+                    continue
+                data = {
+                    'coordinates': iteration.move,
+                    'score': iteration.value,
+                    'depth': iteration.depth,
+                    'nodes': iteration.nodes,
+                    'principal_variation': iteration.principal_variation,
+                }
+                yield f'data: {json.dumps(data)}\n\n'
+        finally:
+            iterations.close()
+
+
+class NextMoveJobView(APIView):
+    """ Starts next_move in the background: the answer has the job id to poll with JobView """
+    serializer_class = SearchRequestSerializer
+
+    def post(self, request, game_id: int, player: str):
+        data = request.data.copy()
+        data["game"], data["player"] = game_id, player
+        serializer = self.serializer_class(data=data)
+        serializer.is_valid(raise_exception=True)
+
+        job = SearchJobs().submit(
+            serializer.validated_data["game"],
+            player,
+            serializer.validated_data["time_limit"],
+        )
+        return Response(job.data(), status.HTTP_202_ACCEPTED)
+
+
+class JobView(APIView):
+    def get(self, request, job_id: str):
+        job = SearchJobs().get(job_id)
+        if job is None:
+            return Response({'detail': 'Job not found'}, status.HTTP_404_NOT_FOUND)
+        return Response(job.data(), status.HTTP_200_OK)
@@ -127,3 +127,31 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/2.1/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Bot search
+
+# Seconds NextMoveView spends on iterative deepening (can be lowered per request with `time_limit`)
+GOMOKU_SEARCH_TIME_LIMIT = 1.0
+# Deepest iteration the search starts, even if there is time left
+GOMOKU_SEARCH_MAX_DEPTH = 10
+# Processes of the pool for parallel search, a request asks for up to this many with `workers`
+GOMOKU_SEARCH_MAX_WORKERS = os.cpu_count() or 1
+# Attacking moves of the forced win search which runs before the minimax: with fours only, with open threes too
+GOMOKU_THREAT_SEARCH_MAX_DEPTH = 10
+GOMOKU_THREAT_SEARCH_MAX_THREE_DEPTH = 4
+# Share of the request time limit the forced win search may spend
+GOMOKU_THREAT_SEARCH_TIME_SHARE = 0.25
+# Position -> move table written by `manage.py build_opening_book`, not used while the file doesn't exist
+GOMOKU_OPENING_BOOK_PATH = os.path.join(BASE_DIR, 'opening_book.bin')
+# Search state kept between next_move calls of a game: dropped after this many idle seconds, at most this many games
+GOMOKU_SESSION_IDLE_TIMEOUT = 600
+GOMOKU_SESSION_MAX_COUNT = 16
+# Longest background search on the expected answer after a next_move call with `ponder`
+GOMOKU_PONDER_TIME_LIMIT = 60.0
+# Boards of the games kept in memory between requests: dropped after this many idle seconds, at most this many games
+GOMOKU_GAME_STATE_IDLE_TIMEOUT = 600
+GOMOKU_GAME_STATE_MAX_COUNT = 256
+# Processes which run the next_move jobs, and seconds a job can be polled after it was queued
+GOMOKU_JOB_WORKERS = os.cpu_count() or 1
+GOMOKU_JOB_RESULT_TIMEOUT = 600